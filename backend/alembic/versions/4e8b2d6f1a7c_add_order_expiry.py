@@ -0,0 +1,46 @@
+"""add_order_expiry
+
+Revision ID: 4e8b2d6f1a7c
+Revises: 9c1e4f7a2b3d
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql as pg
+
+
+# revision identifiers, used by Alembic.
+revision = '4e8b2d6f1a7c'
+down_revision = '9c1e4f7a2b3d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+
+    # Create enum type (check if it exists first)
+    result = conn.execute(sa.text("SELECT EXISTS (SELECT 1 FROM pg_type WHERE typname = 'timeinforce')"))
+    if not result.scalar():
+        time_in_force_enum = pg.ENUM('GTC', 'GTT', name='timeinforce', create_type=True)
+        time_in_force_enum.create(conn)
+    time_in_force_enum = pg.ENUM('GTC', 'GTT', name='timeinforce', create_type=False)
+
+    inspector = sa.inspect(conn)
+    orders_columns = [col['name'] for col in inspector.get_columns('orders')]
+    if 'time_in_force' not in orders_columns:
+        op.add_column('orders', sa.Column('time_in_force', time_in_force_enum, nullable=False, server_default='GTC'))
+    if 'expires_at' not in orders_columns:
+        op.add_column('orders', sa.Column('expires_at', sa.DateTime(timezone=True), nullable=True))
+
+    markets_columns = [col['name'] for col in inspector.get_columns('markets')]
+    if 'expire_orders_at_deadline' not in markets_columns:
+        op.add_column('markets', sa.Column('expire_orders_at_deadline', sa.Boolean(), nullable=False, server_default=sa.false()))
+
+
+def downgrade() -> None:
+    op.drop_column('markets', 'expire_orders_at_deadline')
+    op.drop_column('orders', 'expires_at')
+    op.drop_column('orders', 'time_in_force')
+    pg.ENUM(name='timeinforce').drop(op.get_bind(), checkfirst=True)
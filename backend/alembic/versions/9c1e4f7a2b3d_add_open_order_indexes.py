@@ -0,0 +1,33 @@
+"""add_open_order_indexes
+
+Revision ID: 9c1e4f7a2b3d
+Revises: 2d730890095c
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c1e4f7a2b3d'
+down_revision = '2d730890095c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    existing_indexes = [idx['name'] for idx in inspector.get_indexes('orders')]
+    
+    # Open orders per user (mass cancel) and per market (halt)
+    if 'ix_orders_user_id_status' not in existing_indexes:
+        op.create_index('ix_orders_user_id_status', 'orders', ['user_id', 'status'], unique=False)
+    if 'ix_orders_market_id_status' not in existing_indexes:
+        op.create_index('ix_orders_market_id_status', 'orders', ['market_id', 'status'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_orders_market_id_status', table_name='orders')
+    op.drop_index('ix_orders_user_id_status', table_name='orders')
@@ -12,6 +12,7 @@ from ...models.community import Community, CommunityMember
 from ...models.market_vote import MarketVote
 from ...schemas.market import MarketCreate, MarketResponse, MarketResolve
 from ...schemas.market_outcome import MarketOutcomeResolve
+from ...services.expiry import order_expiry
 from sqlalchemy import func
 
 router = APIRouter()
@@ -62,7 +63,8 @@ def create_market(
         market_type=MarketType.YES_NO,
         resolution_deadline=market_data.resolution_deadline,
         outcomes=outcome_names,  # Store as JSON for backward compatibility
-        image_url=market_data.image_url
+        image_url=market_data.image_url,
+        expire_orders_at_deadline=market_data.expire_orders_at_deadline
     )
     db.add(market)
     db.flush()  # Flush to get market.id
@@ -85,6 +87,9 @@ def create_market(
     db.commit()
     db.refresh(market)
     
+    # Resting orders are cancelled automatically once the deadline passes
+    order_expiry.schedule_market(market)
+    
     return market
 
 
@@ -157,6 +162,7 @@ def list_markets(
             "community_image_url": community.image_url if community else None,
             "outcomes": market.outcomes if market.outcomes else ["default"],  # Include outcomes list
             "image_url": market.image_url,  # Market image URL
+            "expire_orders_at_deadline": market.expire_orders_at_deadline,
             "upvotes": upvotes,
             "downvotes": downvotes,
             "last_traded_prices": last_traded_prices  # Include last traded prices
@@ -258,7 +264,8 @@ def get_market(
         "outcomes": market.outcomes if market.outcomes else ["default"],  # Include outcomes list
         "outcomes_detailed": market_outcomes,  # Include full outcome details
         "last_traded_prices": last_traded_prices,  # Last traded prices for YES/NO
-        "image_url": market.image_url  # Market image URL
+        "image_url": market.image_url,  # Market image URL
+        "expire_orders_at_deadline": market.expire_orders_at_deadline
     }
     return market_dict
 
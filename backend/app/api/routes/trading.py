@@ -1,30 +1,103 @@
+import asyncio
+from dataclasses import asdict
 from fastapi import APIRouter, Depends, HTTPException, status, Query
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from typing import List
-from decimal import Decimal
-from ...core.database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from decimal import Decimal, ROUND_CEILING, ROUND_FLOOR
+from datetime import datetime, timezone
+from ...core.database import get_db, get_async_db
 from ...api.dependencies import get_current_user
 from ...models.user import User
-from ...models.order import Order, OrderSide, OrderType, OrderStatus
+from ...models.order import Order, OrderSide, OrderType, OrderStatus, TimeInForce
 from ...models.market import Market, MarketStatus
+from ...models.community import CommunityMember
 from ...models.trade import Trade
-from ...schemas.order import OrderCreate, OrderResponse, OrderBookResponse, OrderBookEntry
+from ...schemas.order import (
+    OrderCreate, OrderResponse, OrderBookResponse, OrderBookEntry,
+    OrderBatchCreate, OrderBatchResult, OrderBatchResponse, MassCancelResponse,
+    ReconciliationResponse, QuoteResponse, DepthResponse
+)
 from ...schemas.trade import TradeResponse
-from ...services.trading import place_order
-from ...services.orderbook import get_orderbook, get_best_price
+from ...services.trading import (
+    place_order_async, place_orders_async, cancel_resting_order_async, cancel_open_orders, halt_market
+)
+from ...services.sequencer import sequencer
+from ...services.reconciliation import reconcile_market
+from ...services.expiry import order_expiry
+from ...services.orderbook import get_orderbook, get_top_of_book, get_depth, remove_orders_from_orderbook
+from ...core.fixedpoint import PRICE_QUANTUM
+from ...core.config import settings
 from ...api.websocket import manager
 
 router = APIRouter()
 
 
+def _build_order(order_data: OrderCreate, current_user: User, outcome_name: str) -> Order:
+    """Validate one order request and build the (unsaved) Order; raises ValueError"""
+    # Validate outcome
+    if order_data.outcome not in ["yes", "no"]:
+        raise ValueError("Outcome must be 'yes' or 'no'")
+    
+    # Default side to "buy" if not provided (new buy-only model)
+    side = getattr(order_data, 'side', 'buy') or 'buy'
+    if side != "buy":
+        raise ValueError('Only "buy" orders are allowed. To sell, buy the opposite outcome (e.g., buy NO to sell YES).')
+    
+    # Validate quantity is a whole number
+    if order_data.quantity != int(order_data.quantity):
+        raise ValueError('Quantity must be a whole number (no fractional contracts)')
+    
+    # Validate order type
+    if order_data.order_type not in ["limit", "market"]:
+        raise ValueError("Order type must be 'limit' or 'market'")
+    
+    # For market orders, get best price first (price will be set later)
+    # For limit orders, validate price
+    if order_data.order_type == "limit":
+        if not order_data.price or order_data.price <= 0 or order_data.price > 1:
+            raise ValueError("Price must be between 0 and 1 (exclusive of 0)")
+        if order_data.price != order_data.price.quantize(PRICE_QUANTUM):
+            raise ValueError("Price can have at most 4 decimal places")
+        price = order_data.price
+    else:
+        # Market order - price will be determined from orderbook
+        price = Decimal(0)  # Temporary, will be set in place_order
+    
+    expires_at = None
+    if order_data.expires_at is not None:
+        if order_data.order_type == "market":
+            raise ValueError("Market orders cannot have an expiry")
+        expires_at = order_data.expires_at
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        if expires_at <= datetime.now(timezone.utc):
+            raise ValueError("expires_at must be in the future")
+    
+    # Create order (always BUY in new model)
+    return Order(
+        market_id=order_data.market_id,
+        user_id=current_user.id,
+        side=OrderSide.BUY,  # Always BUY in buy-only model
+        outcome_name=outcome_name,
+        outcome=order_data.outcome,
+        price=price,
+        quantity=order_data.quantity,
+        order_type=OrderType(order_data.order_type),
+        time_in_force=TimeInForce(order_data.time_in_force),
+        expires_at=expires_at  # Naive timestamps are UTC
+    )
+
+
 @router.post("/orders", response_model=OrderResponse, status_code=status.HTTP_201_CREATED)
 async def create_order(
     order_data: OrderCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Validate market exists and is active
-    market = db.query(Market).filter(Market.id == order_data.market_id).first()
+    market = await db.get(Market, order_data.market_id)
     if not market:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -49,10 +122,10 @@ async def create_order(
     
     # Check if outcome is resolved (cannot trade on resolved outcomes)
     from ...models.market_outcome import MarketOutcome, OutcomeStatus
-    market_outcome = db.query(MarketOutcome).filter(
+    market_outcome = await db.scalar(select(MarketOutcome).where(
         MarketOutcome.market_id == order_data.market_id,
         MarketOutcome.name == outcome_name
-    ).first()
+    ))
     
     if market_outcome and market_outcome.status == OutcomeStatus.RESOLVED:
         raise HTTPException(
@@ -60,56 +133,20 @@ async def create_order(
             detail=f"Cannot trade on resolved outcome '{outcome_name}'. This outcome has already been resolved."
         )
     
-    # Default side to "buy" if not provided (new buy-only model)
-    side = getattr(order_data, 'side', 'buy') or 'buy'
-    if side != "buy":
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail='Only "buy" orders are allowed. To sell, buy the opposite outcome (e.g., buy NO to sell YES).'
-        )
-    
-    # Validate quantity is a whole number
-    if order_data.quantity != int(order_data.quantity):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail='Quantity must be a whole number (no fractional contracts)'
-        )
-    
-    # Validate order type
-    if order_data.order_type not in ["limit", "market"]:
+    try:
+        order = _build_order(order_data, current_user, outcome_name)
+    except ValueError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Order type must be 'limit' or 'market'"
+            detail=str(e)
         )
     
-    # For market orders, get best price first (price will be set later)
-    # For limit orders, validate price
-    if order_data.order_type == "limit":
-        if not order_data.price or order_data.price <= 0 or order_data.price > 1:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Price must be between 0 and 1 (exclusive of 0)"
-            )
-        price = order_data.price
-    else:
-        # Market order - price will be determined from orderbook
-        price = Decimal(0)  # Temporary, will be set in place_order
-    
-    # Create order (always BUY in new model)
-    order = Order(
-        market_id=order_data.market_id,
-        user_id=current_user.id,
-        side=OrderSide.BUY,  # Always BUY in buy-only model
-        outcome_name=outcome_name,
-        outcome=order_data.outcome,
-        price=price,
-        quantity=order_data.quantity,
-        order_type=OrderType(order_data.order_type)
-    )
-    
     try:
-        trades = place_order(db, order)
-        db.refresh(order)
+        # Orders for one market are executed one at a time, in arrival order; database
+        # round trips are awaited, so other markets and WebSocket clients keep running
+        trades = await sequencer.submit(order.market_id, place_order_async, db, order)
+        if order.status in [OrderStatus.PENDING, OrderStatus.PARTIALLY_FILLED]:
+            order_expiry.schedule_order(order)
         
         # Broadcast orderbook updates via WebSocket (wrap in try-except to not fail the request)
         try:
@@ -153,6 +190,113 @@ async def create_order(
         )
 
 
+@router.post("/orders/batch", response_model=OrderBatchResponse)
+async def create_orders_batch(
+    batch: OrderBatchCreate,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Place several orders for one market in one transaction.
+    Each order gets its own result: rejected orders carry an error and do not affect the rest.
+    """
+    if not batch.orders:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Batch must contain at least one order"
+        )
+    
+    if len(batch.orders) > settings.MAX_BATCH_ORDERS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Batch can contain at most {settings.MAX_BATCH_ORDERS} orders"
+        )
+    
+    market_id = batch.orders[0].market_id
+    if any(order_data.market_id != market_id for order_data in batch.orders):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="All orders in a batch must be for the same market"
+        )
+    
+    market = await db.get(Market, market_id)
+    if not market:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Market not found"
+        )
+    
+    if market.status != MarketStatus.ACTIVE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Market is not active"
+        )
+    
+    results: List[OrderBatchResult] = [None] * len(batch.orders)
+    orders = []
+    indexes = []
+    for index, order_data in enumerate(batch.orders):
+        outcome_name = getattr(order_data, 'outcome_name', 'default') or 'default'
+        try:
+            orders.append(_build_order(order_data, current_user, outcome_name))
+            indexes.append(index)
+        except ValueError as e:
+            results[index] = OrderBatchResult(index=index, error=str(e))
+    
+    outcomes = []
+    if orders:
+        try:
+            # The whole batch is one unit of work on the market's sequencer; the session does not
+            # expire on commit, so building the response below issues no further queries
+            outcomes = await sequencer.submit(market_id, place_orders_async, db, orders)
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=str(e)
+            )
+        except Exception as e:
+            print(f"Unexpected error in create_orders_batch: {e}")
+            import traceback
+            traceback.print_exc()
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Internal server error: {str(e)}"
+            )
+    
+    # Books to broadcast, once each however many orders touched them
+    affected_books = set()
+    all_trades = []
+    for index, order, (trades, error) in zip(indexes, orders, outcomes):
+        if error:
+            results[index] = OrderBatchResult(index=index, error=error)
+            continue
+        results[index] = OrderBatchResult(index=index, order=OrderResponse.model_validate(order))
+        if order.status in [OrderStatus.PENDING, OrderStatus.PARTIALLY_FILLED]:
+            order_expiry.schedule_order(order)
+        affected_books.add((order.outcome_name, order.outcome))
+        if trades:
+            opposite_outcome = "no" if order.outcome == "yes" else "yes"
+            affected_books.add((order.outcome_name, opposite_outcome))
+            all_trades.extend(trades)
+    
+    # Broadcast orderbook updates via WebSocket (wrap in try-except to not fail the request)
+    try:
+        for outcome_name, outcome in sorted(affected_books):
+            await manager.broadcast_orderbook_update(market_id, outcome_name, outcome)
+        for trade in all_trades:
+            trade_data = {
+                "outcome_name": trade.outcome_name,
+                "outcome": trade.outcome,
+                "price": float(trade.price),
+                "quantity": float(trade.quantity),
+                "executed_at": trade.executed_at.isoformat(),
+            }
+            await manager.broadcast_trade(market_id, trade_data)
+    except Exception as ws_error:
+        print(f"WebSocket broadcast error: {ws_error}")
+    
+    return OrderBatchResponse(market_id=market_id, results=results)
+
+
 @router.get("/orders/{order_id}", response_model=OrderResponse)
 def get_order(
     order_id: int,
@@ -192,9 +336,9 @@ def get_user_orders(
 async def cancel_order(
     order_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    order = db.query(Order).filter(Order.id == order_id).first()
+    order = await db.get(Order, order_id)
     if not order:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -213,13 +357,14 @@ async def cancel_order(
             detail="Order cannot be cancelled"
         )
     
-    # Remove from orderbook
-    from ...services.orderbook import remove_order_from_orderbook
-    remove_order_from_orderbook(order.market_id, order.outcome_name, order.outcome, order.side.value, order.id)
-    
-    order.status = OrderStatus.CANCELLED
-    db.commit()
-    db.refresh(order)
+    # Cancel through the market's sequencer so it cannot interleave with a match on this order
+    try:
+        order = await sequencer.submit(order.market_id, cancel_resting_order_async, db, order)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     
     # Broadcast orderbook update
     await manager.broadcast_orderbook_update(order.market_id, order.outcome_name, order.outcome)
@@ -227,6 +372,126 @@ async def cancel_order(
     return order
 
 
+async def _finish_mass_cancel(cancelled: list, books_removed: bool = False) -> MassCancelResponse:
+    """Take cancelled orders off the books (per market, through its sequencer) and broadcast each affected book once"""
+    by_market = {}
+    for row in cancelled:
+        by_market.setdefault(row[1], []).append(row)
+    
+    if not books_removed:
+        await asyncio.gather(*(
+            sequencer.submit(market_id, remove_orders_from_orderbook, rows)
+            for market_id, rows in by_market.items()
+        ))
+    
+    try:
+        for market_id, outcome_name, outcome in sorted({row[1:] for row in cancelled}):
+            await manager.broadcast_orderbook_update(market_id, outcome_name, outcome)
+    except Exception as ws_error:
+        print(f"WebSocket broadcast error: {ws_error}")
+    
+    return MassCancelResponse(cancelled=len(cancelled), order_ids=[row[0] for row in cancelled])
+
+
+def _require_market_admin(db: Session, market_id: int, current_user: User, action: str) -> Market:
+    """Load the market and check the user administers its community; raises HTTPException.
+    Synchronous queries: async routes run it in a thread.
+    """
+    market = db.query(Market).filter(Market.id == market_id).first()
+    if not market:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Market not found"
+        )
+    
+    # Check if user is admin of the community
+    membership = db.query(CommunityMember).filter(
+        CommunityMember.user_id == current_user.id,
+        CommunityMember.community_id == market.community_id,
+        CommunityMember.role == "admin"
+    ).first()
+    
+    if not membership:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"Only community admins can {action} markets"
+        )
+    
+    return market
+
+
+@router.post("/orders/cancel-all", response_model=MassCancelResponse)
+async def cancel_all_orders(
+    market_id: Optional[int] = Query(None, description="Only cancel orders in this market"),
+    outcome_name: Optional[str] = Query(None, description="Only cancel orders on this outcome name (needs market_id)"),
+    outcome: Optional[str] = Query(None, description="Only cancel orders on this side: 'yes' or 'no'"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Cancel all of the current user's open orders, optionally narrowed to a market, outcome name and side"""
+    if outcome is not None and outcome not in ["yes", "no"]:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Outcome must be 'yes' or 'no'"
+        )
+    
+    if outcome_name is not None and market_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="outcome_name requires market_id"
+        )
+    
+    # One UPDATE for every matching order (in a thread, off the event loop); the books are
+    # cleaned up afterwards
+    cancelled = await asyncio.to_thread(
+        cancel_open_orders, db, user_id=current_user.id, market_id=market_id,
+        outcome_name=outcome_name, outcome=outcome
+    )
+    return await _finish_mass_cancel(cancelled)
+
+
+@router.post("/markets/{market_id}/halt", response_model=MassCancelResponse)
+async def halt_market_trading(
+    market_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Kill switch: close a market to trading and cancel every resting order in it (community admins only)"""
+    await asyncio.to_thread(_require_market_admin, db, market_id, current_user, "halt")
+    
+    try:
+        # Queued behind any orders already submitted for this market; later ones see it closed
+        cancelled = await sequencer.submit(market_id, halt_market, db, market_id)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    
+    return await _finish_mass_cancel(cancelled, books_removed=True)
+
+
+@router.post("/markets/{market_id}/reconcile", response_model=ReconciliationResponse)
+async def reconcile_market_books(
+    market_id: int,
+    repair: bool = Query(False, description="Rebuild books that differ from the database"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Check a market's Redis orderbooks against its open orders, optionally repairing them (community admins only)"""
+    await asyncio.to_thread(_require_market_admin, db, market_id, current_user, "reconcile")
+    
+    try:
+        # Runs on the market's sequencer, so order entry on this market waits and other markets carry on
+        report = await sequencer.submit(market_id, reconcile_market, db, market_id, repair)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    return ReconciliationResponse(**asdict(report), in_sync=report.in_sync)
+
+
 @router.get("/markets/{market_id}/orderbook", response_model=OrderBookResponse)
 def get_market_orderbook(
     market_id: int,
@@ -247,19 +512,21 @@ def get_market_orderbook(
             detail="Outcome must be 'yes' or 'no'"
         )
     
-    orderbook_data = get_orderbook(market_id, outcome_name, outcome, db=db)
+    orderbook_data = get_orderbook(market_id, outcome_name, outcome)
     
     buys = [OrderBookEntry(
         price=entry["price"],
         quantity=entry["quantity"],
         order_id=entry["order_id"],
-        user_id=entry["user_id"]
+        user_id=entry["user_id"],
+        booked_at=entry["booked_at"]
     ) for entry in orderbook_data["buys"]]
     sells = [OrderBookEntry(
         price=entry["price"],
         quantity=entry["quantity"],
         order_id=entry["order_id"],
-        user_id=entry["user_id"]
+        user_id=entry["user_id"],
+        booked_at=entry["booked_at"]
     ) for entry in orderbook_data["sells"]]
     
     return OrderBookResponse(
@@ -271,6 +538,72 @@ def get_market_orderbook(
     )
 
 
+@router.get("/markets/{market_id}/depth", response_model=DepthResponse)
+def get_market_depth(
+    market_id: int,
+    outcome_name: str = Query("default", description="Outcome name (e.g., 'Team A', 'default')"),
+    outcome: str = Query("yes", description="Outcome side: 'yes' or 'no'"),
+    levels: int = Query(20, ge=1, le=settings.MAX_DEPTH_LEVELS, description="Price levels per side"),
+    min_price: Optional[Decimal] = Query(None, ge=0, le=1, description="Lowest price to include"),
+    max_price: Optional[Decimal] = Query(None, ge=0, le=1, description="Highest price to include"),
+    db: Session = Depends(get_db)
+):
+    market = db.query(Market).filter(Market.id == market_id).first()
+    if not market:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Market not found"
+        )
+    
+    if outcome not in ["yes", "no"]:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Outcome must be 'yes' or 'no'"
+        )
+    
+    # Snap the band inwards to whole ticks
+    if min_price is not None:
+        min_price = min_price.quantize(PRICE_QUANTUM, rounding=ROUND_CEILING)
+    if max_price is not None:
+        max_price = max_price.quantize(PRICE_QUANTUM, rounding=ROUND_FLOOR)
+    
+    return DepthResponse(
+        market_id=market_id,
+        outcome_name=outcome_name,
+        outcome=outcome,
+        **get_depth(market_id, outcome_name, outcome, levels, min_price, max_price)
+    )
+
+
+@router.get("/markets/{market_id}/quote", response_model=QuoteResponse)
+def get_market_quote(
+    market_id: int,
+    outcome_name: str = Query("default", description="Outcome name (e.g., 'Team A', 'default')"),
+    outcome: str = Query("yes", description="Outcome side: 'yes' or 'no'"),
+    db: Session = Depends(get_db)
+):
+    market = db.query(Market).filter(Market.id == market_id).first()
+    if not market:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Market not found"
+        )
+    
+    if outcome not in ["yes", "no"]:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Outcome must be 'yes' or 'no'"
+        )
+    
+    # Served from the top-of-book cache, the sorted sets are not read
+    return QuoteResponse(
+        market_id=market_id,
+        outcome_name=outcome_name,
+        outcome=outcome,
+        **get_top_of_book(market_id, outcome_name, outcome)
+    )
+
+
 @router.get("/markets/{market_id}/trades", response_model=List[TradeResponse])
 def get_market_trades(
     market_id: int,
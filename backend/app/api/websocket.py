@@ -1,20 +1,156 @@
 from fastapi import WebSocket, WebSocketDisconnect, Depends
-from typing import Dict, List, Set
-import json
+from typing import Dict, List, Optional, Set, Tuple, Union
+import asyncio
+import orjson
 from decimal import Decimal
-from ..services.orderbook import get_orderbook
+from ..services.orderbook import get_orderbook_async, get_orderbooks_async
+from ..core.config import settings
+from ..core.redis_client import get_async_redis
 from ..models.user import User
 from ..core.security import decode_access_token
 from sqlalchemy.orm import Session
 from ..core.database import SessionLocal
 
 
+# Book views are keyed by (market_id, outcome_name, outcome)
+BookKey = Tuple[int, str, str]
+
+# Market events go out over Redis pub/sub so that every worker reaches its own sockets:
+#   ws:market:{id}:trades:{outcome_name}
+#                          encoded "trades" batch frames of one outcome, forwarded as they are
+#   ws:market:{id}:books   [[outcome_name, outcome], ...] of the books that changed; each worker
+#                          diffs them against its own views, so seq is per worker (a client
+#                          only ever talks to one)
+# Both are published at most once per market (and outcome) per WS_COALESCE_MS tick, and
+# each worker passes them on only to the sockets subscribed to the book or outcome.
+CHANNEL_PREFIX = "ws:market:"
+
+
+def _channel(market_id: int, kind: str, outcome_name: Optional[str] = None) -> str:
+    if outcome_name is None:
+        return f"{CHANNEL_PREFIX}{market_id}:{kind}"
+    return f"{CHANNEL_PREFIX}{market_id}:{kind}:{outcome_name}"
+
+
+
+def _encode_default(value):
+    # Prices are Decimals; orjson handles everything else we send natively
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError
+
+
+def encode_message(message: dict) -> str:
+    """Serialise a message once; the same text frame then goes to every subscriber"""
+    return orjson.dumps(message, default=_encode_default).decode()
+
+
+def _entry_message(entry: dict) -> dict:
+    # Left as Decimal/int: converted once, when the message is encoded
+    return {
+        "price": entry["price"],
+        "quantity": entry["quantity"],
+        "order_id": entry.get("order_id"),
+        "user_id": entry.get("user_id")
+    }
+
+
+def _view(orderbook_data: dict) -> Dict[str, List[dict]]:
+    return {
+        "buys": [_entry_message(entry) for entry in orderbook_data["buys"]],
+        "sells": [_entry_message(entry) for entry in orderbook_data["sells"]]
+    }
+
+
+def _diff_side(old: List[dict], new: List[dict]) -> List[dict]:
+    """Entries of new that differ from old, plus old entries that are gone (quantity 0)"""
+    before = {entry["order_id"]: entry for entry in old}
+    after = {entry["order_id"]: entry for entry in new}
+    changes = [entry for order_id, entry in after.items() if before.get(order_id) != entry]
+    changes.extend({**entry, "quantity": 0} for order_id, entry in before.items() if order_id not in after)
+    return changes
+
+
+# Queued in place of the dropped backlog when a client falls too far behind
+RESYNC = object()
+
+
+class ClientConnection:
+    """
+    One subscriber with a bounded outgoing queue drained by its own writer task,
+    so a slow socket only ever delays itself. Broadcasts enqueue without waiting.
+    A client whose queue fills up loses its backlog and is sent fresh snapshots
+    instead; a client that does not take a message within WS_SEND_TIMEOUT is dropped.
+    """
+    def __init__(self, websocket: WebSocket, market_id: int, manager: "ConnectionManager"):
+        self.websocket = websocket
+        self.market_id = market_id
+        self.manager = manager
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=settings.WS_SEND_QUEUE_SIZE)
+        self.writer: Optional[asyncio.Task] = None
+    
+    def start(self):
+        self.writer = asyncio.create_task(self._write())
+    
+    def stop(self):
+        if self.writer and self.writer is not asyncio.current_task():
+            self.writer.cancel()
+    
+    def send(self, message: str):
+        """Queue an encoded text frame without blocking"""
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Anything still queued is stale once the client resyncs, so drop it all
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+    
+    async def _write(self):
+        try:
+            while True:
+                message = await self.queue.get()
+                if message is RESYNC:
+                    books = sorted(self.manager.subscriptions.get(self.websocket, ()))
+                    for snapshot in await self.manager.get_snapshots(self.market_id, books):
+                        await asyncio.wait_for(self.websocket.send_text(encode_message(snapshot)), settings.WS_SEND_TIMEOUT)
+                else:
+                    await asyncio.wait_for(self.websocket.send_text(message), settings.WS_SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Timed out or the socket is gone: drop the client
+            self.manager.disconnect(self.websocket, self.market_id)
+            try:
+                await self.websocket.close(code=1013, reason="Too slow")
+            except Exception:
+                pass
+
+
 class ConnectionManager:
     def __init__(self):
         # Map of market_id -> set of websocket connections
         self.active_connections: Dict[int, Set[WebSocket]] = {}
         # Map of websocket -> user_id
         self.websocket_users: Dict[WebSocket, int] = {}
+        # Map of websocket -> its send queue and writer task
+        self.clients: Dict[WebSocket, ClientConnection] = {}
+        # Map of websocket -> the (outcome_name, outcome) books it subscribed to
+        self.subscriptions: Dict[WebSocket, Set[Tuple[str, str]]] = {}
+        # Map of book -> websockets subscribed to it (deltas and trades go to these only)
+        self.book_subscribers: Dict[BookKey, Set[WebSocket]] = {}
+        # Last state sent for each book ({"buys": [...], "sells": [...]}), deltas are diffed against it
+        self.book_views: Dict[BookKey, Dict[str, List[dict]]] = {}
+        # Sequence number of the last message for each book, never reset
+        self.book_seq: Dict[BookKey, int] = {}
+        # Serialises read-and-diff per book so views never go backwards
+        self.book_locks: Dict[BookKey, asyncio.Lock] = {}
+        # True while this worker's pub/sub subscriber is listening; until then events stay local
+        self.subscribed = False
+        # Per market: books changed and trades made during the current coalescing tick
+        self.pending_books: Dict[int, Dict[Tuple[str, str], None]] = {}
+        self.pending_trades: Dict[int, List[dict]] = {}
+        self.flush_tasks: Dict[int, asyncio.Task] = {}
     
     async def connect(self, websocket: WebSocket, market_id: int, user_id: int):
         # Connection already accepted in websocket_endpoint
@@ -22,84 +158,219 @@ class ConnectionManager:
             self.active_connections[market_id] = set()
         self.active_connections[market_id].add(websocket)
         self.websocket_users[websocket] = user_id
+        self.subscriptions[websocket] = set()
+        client = ClientConnection(websocket, market_id, self)
+        self.clients[websocket] = client
+        client.start()
+    
+    def send(self, websocket: WebSocket, message: Union[dict, str]):
+        """Queue a message (a dict is sent as JSON, a str as text) for one connection"""
+        client = self.clients.get(websocket)
+        if client:
+            client.send(message if isinstance(message, str) else encode_message(message))
+    
+    def _fan_out_frame(self, websockets, frame: str):
+        # Encoded once for everyone, and only enqueued, so no subscriber waits on another
+        for websocket in list(websockets):
+            client = self.clients.get(websocket)
+            if client:
+                client.send(frame)
+    
+    def _outcome_subscribers(self, market_id: int, outcome_name: str) -> Set[WebSocket]:
+        return (
+            self.book_subscribers.get((market_id, outcome_name, "yes"), set())
+            | self.book_subscribers.get((market_id, outcome_name, "no"), set())
+        )
+    
+    async def subscribe(self, websocket: WebSocket, market_id: int, books: List[Tuple[str, str]]) -> List[dict]:
+        """Subscribe a connection to (outcome_name, outcome) books. Returns their snapshots"""
+        subscribed = self.subscriptions.get(websocket)
+        if subscribed is None:
+            return []
+        added = [
+            book for book in dict.fromkeys(books)
+            if book not in subscribed
+        ][:max(settings.WS_MAX_SUBSCRIPTIONS - len(subscribed), 0)]
+        for book in added:
+            subscribed.add(book)
+            self.book_subscribers.setdefault((market_id, *book), set()).add(websocket)
+        return await self.get_snapshots(market_id, added)
+    
+    def unsubscribe(self, websocket: WebSocket, market_id: int, books: List[Tuple[str, str]]):
+        subscribed = self.subscriptions.get(websocket, set())
+        for book in books:
+            if book not in subscribed:
+                continue
+            subscribed.discard(book)
+            key = (market_id, *book)
+            subscribers = self.book_subscribers.get(key, set())
+            subscribers.discard(websocket)
+            if not subscribers:
+                # Nobody here is watching, so the view would go stale; rebuild it on the next subscribe
+                self.book_subscribers.pop(key, None)
+                self.book_views.pop(key, None)
     
     def disconnect(self, websocket: WebSocket, market_id: int):
+        self.unsubscribe(websocket, market_id, list(self.subscriptions.get(websocket, ())))
+        self.subscriptions.pop(websocket, None)
         if market_id in self.active_connections:
             self.active_connections[market_id].discard(websocket)
+            if not self.active_connections[market_id]:
+                del self.active_connections[market_id]
         if websocket in self.websocket_users:
             del self.websocket_users[websocket]
+        client = self.clients.pop(websocket, None)
+        if client:
+            client.stop()
     
-    async def broadcast_orderbook_update(self, market_id: int, outcome_name: str, outcome: str):
-        """Broadcast orderbook update to all connected clients"""
-        if market_id not in self.active_connections:
-            return
-        
-        from ..core.database import SessionLocal
-        
-        # Get orderbook with user info (need db session for user lookups)
-        db = SessionLocal()
-        try:
-            orderbook_data = get_orderbook(market_id, outcome_name, outcome, db=db)
-            
-            # Format entries for WebSocket (orderbook_data already has dicts with price, quantity, order_id, user_id)
-            message = {
+    async def get_snapshots(self, market_id: int, books: List[Tuple[str, str]]) -> List[dict]:
+        """Full book messages carrying the sequence number the next delta follows.
+        Served from the current views where there are some, so they line up with the deltas
+        exactly; the other books are read in one pipelined Redis call (owners come from the
+        book itself, so no SQL).
+        """
+        missing = [(market_id, *book) for book in books if (market_id, *book) not in self.book_views]
+        if missing:
+            for key, orderbook_data in zip(missing, await get_orderbooks_async(missing)):
+                # A delta sent while we were reading has installed a newer view; skip books
+                # nobody subscribes to any more, their views would go stale
+                if key in self.book_subscribers:
+                    self.book_views.setdefault(key, _view(orderbook_data))
+        snapshots = []
+        for outcome_name, outcome in books:
+            key = (market_id, outcome_name, outcome)
+            view = self.book_views.get(key) or {"buys": [], "sells": []}
+            snapshots.append({
                 "type": "orderbook_update",
                 "market_id": market_id,
                 "outcome_name": outcome_name,
                 "outcome": outcome,
-                "buys": [
-                    {
-                        "price": float(entry["price"]),
-                        "quantity": float(entry["quantity"]),
-                        "order_id": entry.get("order_id"),
-                        "user_id": entry.get("user_id")
-                    }
-                    for entry in orderbook_data["buys"]
-                ],
-                "sells": [
-                    {
-                        "price": float(entry["price"]),
-                        "quantity": float(entry["quantity"]),
-                        "order_id": entry.get("order_id"),
-                        "user_id": entry.get("user_id")
-                    }
-                    for entry in orderbook_data["sells"]
-                ]
-            }
+                "seq": self.book_seq.get(key, 0),
+                "buys": view["buys"],
+                "sells": view["sells"]
+            })
+        return snapshots
+    
+    async def broadcast_orderbook_update(self, market_id: int, outcome_name: str, outcome: str):
+        """Mark a book as changed. At the end of the market's coalescing tick every worker sends
+        its subscribers one delta per changed book, however many changes there were.
+        """
+        self.pending_books.setdefault(market_id, {})[outcome_name, outcome] = None
+        self._schedule_flush(market_id)
+    
+    async def broadcast_trade(self, market_id: int, trade_data: dict):
+        """Queue a trade for the market's next "trades" batch message"""
+        self.pending_trades.setdefault(market_id, []).append(trade_data)
+        self._schedule_flush(market_id)
+    
+    def _schedule_flush(self, market_id: int):
+        if market_id not in self.flush_tasks:
+            self.flush_tasks[market_id] = asyncio.create_task(self._flush_after_tick(market_id))
+    
+    async def _flush_after_tick(self, market_id: int):
+        try:
+            await asyncio.sleep(settings.WS_COALESCE_MS / 1000)
         finally:
-            db.close()
+            # Anything that arrives from here on starts the next tick
+            del self.flush_tasks[market_id]
+        books = list(self.pending_books.pop(market_id, {}))
+        trades = self.pending_trades.pop(market_id, [])
+        try:
+            await self.flush(market_id, books, trades)
+        except Exception as e:
+            print(f"WebSocket broadcast error for market {market_id}: {e}")
+    
+    async def flush(self, market_id: int, books: List[Tuple[str, str]], trades: List[dict]):
+        """Publish one tick's worth of events for a market (or deliver them locally when this
+        worker has no pub/sub subscription)
+        """
+        by_outcome: Dict[str, List[dict]] = {}
+        for trade in trades:
+            by_outcome.setdefault(trade["outcome_name"], []).append(trade)
+        frames = {
+            outcome_name: encode_message({"type": "trades", "market_id": market_id, "trades": outcome_trades})
+            for outcome_name, outcome_trades in by_outcome.items()
+        }
+        if self.subscribed:
+            pipe = get_async_redis().pipeline(transaction=False)
+            if books:
+                pipe.publish(_channel(market_id, "books"), orjson.dumps(books))
+            for outcome_name, frame in frames.items():
+                pipe.publish(_channel(market_id, "trades", outcome_name), frame)
+            await pipe.execute()
+            return
+        for outcome_name, frame in frames.items():
+            self._fan_out_frame(self._outcome_subscribers(market_id, outcome_name), frame)
+        for outcome_name, outcome in books:
+            await self.deliver_orderbook_update(market_id, outcome_name, outcome)
+    
+    async def deliver_orderbook_update(self, market_id: int, outcome_name: str, outcome: str):
+        """Send this worker's subscribers the changes to a book since the last message, as one
+        sequenced orderbook_delta. Entries are set as given (quantity 0 removes the order);
+        a client that sees a gap in seq asks for a snapshot.
+        """
+        key = (market_id, outcome_name, outcome)
+        if not self.book_subscribers.get(key):
+            return
         
-        disconnected = []
-        for connection in self.active_connections[market_id]:
-            try:
-                await connection.send_json(message)
-            except:
-                disconnected.append(connection)
+        async with self.book_locks.setdefault(key, asyncio.Lock()):
+            view = _view(await get_orderbook_async(market_id, outcome_name, outcome))
+            if not self.book_subscribers.get(key):
+                return  # The last subscriber left while we were reading
+            previous = self.book_views.get(key, {"buys": [], "sells": []})
+            buys = _diff_side(previous["buys"], view["buys"])
+            sells = _diff_side(previous["sells"], view["sells"])
+            self.book_views[key] = view
+            if not buys and not sells:
+                return
+            seq = self.book_seq.get(key, 0) + 1
+            self.book_seq[key] = seq
         
-        # Clean up disconnected clients
-        for conn in disconnected:
-            self.disconnect(conn, market_id)
+        self._fan_out_frame(self.book_subscribers.get(key, ()), encode_message({
+            "type": "orderbook_delta",
+            "market_id": market_id,
+            "outcome_name": outcome_name,
+            "outcome": outcome,
+            "seq": seq,
+            "buys": buys,
+            "sells": sells
+        }))
     
-    async def broadcast_trade(self, market_id: int, trade_data: dict):
-        """Broadcast trade execution to all connected clients"""
+    async def _relay(self, channel: str, data: str):
+        market_id, rest = channel[len(CHANNEL_PREFIX):].split(":", 1)
+        market_id = int(market_id)
         if market_id not in self.active_connections:
             return
-        
-        message = {
-            "type": "trade",
-            "market_id": market_id,
-            **trade_data
-        }
-        
-        disconnected = []
-        for connection in self.active_connections[market_id]:
+        kind, _, outcome_name = rest.partition(":")
+        if kind == "trades":
+            self._fan_out_frame(self._outcome_subscribers(market_id, outcome_name), data)
+        else:
+            for outcome_name, outcome in orjson.loads(data):
+                await self.deliver_orderbook_update(market_id, outcome_name, outcome)
+    
+    async def run_subscriber(self):
+        """Background task, one per worker: relay the events any worker publishes to local sockets"""
+        while True:
+            pubsub = get_async_redis().pubsub()
             try:
-                await connection.send_json(message)
-            except:
-                disconnected.append(connection)
-        
-        for conn in disconnected:
-            self.disconnect(conn, market_id)
+                await pubsub.psubscribe(f"{CHANNEL_PREFIX}*")
+                self.subscribed = True
+                # Catch up on whatever changed while nothing was listening
+                for key in list(self.book_views):
+                    await self.deliver_orderbook_update(*key)
+                while True:
+                    # Poll with a timeout: a blocking read would trip the pool's socket timeout when idle
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message:
+                        await self._relay(message["channel"], message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"WebSocket pub/sub error: {e}")
+                await asyncio.sleep(1)
+            finally:
+                self.subscribed = False
+                await pubsub.aclose()
 
 
 manager = ConnectionManager()
@@ -125,8 +396,20 @@ async def get_user_from_token(token: str):
         db.close()
 
 
+def _requested_books(request: dict) -> List[Tuple[str, str]]:
+    """(outcome_name, outcome) books named by a client message: a "books" list, or one book inline"""
+    entries = request.get("books") if isinstance(request.get("books"), list) else [request]
+    books = []
+    for entry in entries:
+        if isinstance(entry, dict) and entry.get("outcome") in ("yes", "no"):
+            books.append((str(entry.get("outcome_name") or "default"), entry["outcome"]))
+    return books
+
+
 async def websocket_endpoint(websocket: WebSocket, market_id: int, token: str):
-    """WebSocket endpoint for real-time orderbook updates"""
+    """WebSocket endpoint for real-time orderbook updates.
+    Everything sent to the client goes through its queue (see ClientConnection).
+    """
     # Accept the connection first
     await websocket.accept()
     
@@ -139,51 +422,41 @@ async def websocket_endpoint(websocket: WebSocket, market_id: int, token: str):
     await manager.connect(websocket, market_id, user.id)
     
     try:
-        # Send initial orderbook state (for legacy markets, use "default" outcome_name)
-        db = SessionLocal()
+        # Start on the legacy "default" outcome; clients of named outcomes subscribe to theirs
         try:
-            for outcome in ["yes", "no"]:
-                try:
-                    orderbook_data = get_orderbook(market_id, "default", outcome, db=db)
-                    message = {
-                        "type": "orderbook_update",
-                        "market_id": market_id,
-                        "outcome_name": "default",
-                        "outcome": outcome,
-                        "buys": [
-                            {
-                                "price": float(entry["price"]),
-                                "quantity": float(entry["quantity"]),
-                                "order_id": entry.get("order_id"),
-                                "user_id": entry.get("user_id")
-                            }
-                            for entry in orderbook_data.get("buys", [])
-                        ],
-                        "sells": [
-                            {
-                                "price": float(entry["price"]),
-                                "quantity": float(entry["quantity"]),
-                                "order_id": entry.get("order_id"),
-                                "user_id": entry.get("user_id")
-                            }
-                            for entry in orderbook_data.get("sells", [])
-                        ]
-                    }
-                    await websocket.send_json(message)
-                except Exception as e:
-                    # Log error but continue with other outcomes
-                    print(f"Error sending orderbook for {outcome}: {e}")
-                    import traceback
-                    traceback.print_exc()
-        finally:
-            db.close()
-        
+            for snapshot in await manager.subscribe(websocket, market_id, [("default", "yes"), ("default", "no")]):
+                manager.send(websocket, snapshot)
+        except Exception as e:
+            # Log error but keep the connection; the client can subscribe again
+            print(f"Error sending initial orderbooks for market {market_id}: {e}")
+            import traceback
+            traceback.print_exc()
+    
         # Keep connection alive and handle incoming messages
         while True:
             data = await websocket.receive_text()
             # Handle ping/pong or other messages if needed
             if data == "ping":
-                await websocket.send_text("pong")
+                manager.send(websocket, "pong")
+                continue
+            try:
+                request = orjson.loads(data)
+            except ValueError:
+                continue
+            if not isinstance(request, dict):
+                continue
+            books = _requested_books(request)
+            if request.get("type") == "subscribe":
+                # {"type": "subscribe", "books": [{"outcome_name": ..., "outcome": ...}, ...]}
+                for snapshot in await manager.subscribe(websocket, market_id, books):
+                    manager.send(websocket, snapshot)
+            elif request.get("type") == "unsubscribe":
+                manager.unsubscribe(websocket, market_id, books)
+            elif request.get("type") == "snapshot":
+                # Resync after a gap in seq: {"type": "snapshot", "outcome_name": ..., "outcome": ...}
+                subscribed = manager.subscriptions.get(websocket, set())
+                for snapshot in await manager.get_snapshots(market_id, [book for book in books if book in subscribed]):
+                    manager.send(websocket, snapshot)
     
     except WebSocketDisconnect:
         manager.disconnect(websocket, market_id)
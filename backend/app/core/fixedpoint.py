@@ -0,0 +1,62 @@
+"""
+Fixed-point helpers for prices, quantities and money.
+
+Prices are stored as Numeric(10, 4) and always lie in (0, 1], so every valid
+price is a whole number of ticks of 0.0001 between 0 and PRICE_SCALE.
+Quantities are whole contracts and balances are Numeric(20, 2), i.e. whole
+cents. The matching path works in these integer units only (ticks, contracts,
+cents) so price comparisons, the implied price of the other outcome (1 - p),
+level lookups and trade costs are plain integer arithmetic and exact.
+Decimal is only used where values are read from or written to the database
+and the API.
+"""
+from decimal import Decimal
+
+PRICE_SCALE = 10000  # ticks per 1.0
+PRICE_QUANTUM = Decimal(1).scaleb(-4)  # 0.0001
+CENTS_PER_UNIT = 100  # cents per 1.0 token (one contract pays out 1.0)
+
+
+def price_to_tick(price) -> int:
+    """Convert a price (Decimal/str/int) to integer ticks.
+    Raises ValueError if the price is not on the 0.0001 grid or outside [0, 1].
+    """
+    scaled = Decimal(price) * PRICE_SCALE
+    tick = int(scaled)
+    if tick != scaled:
+        raise ValueError(f"Price {price} has more than 4 decimal places")
+    if tick < 0 or tick > PRICE_SCALE:
+        raise ValueError(f"Price {price} must be between 0 and 1")
+    return tick
+
+
+def tick_to_price(tick: int) -> Decimal:
+    """Convert integer ticks back to an exact 4-decimal price"""
+    return Decimal(int(tick)).scaleb(-4)
+
+
+def complement_tick(tick: int) -> int:
+    """Tick of the implied price on the other outcome: YES at p is NO at (1 - p)"""
+    return PRICE_SCALE - tick
+
+
+def to_contracts(quantity) -> int:
+    """Convert a quantity (Decimal/str/int) to a whole number of contracts.
+    Raises ValueError if it is fractional.
+    """
+    scaled = Decimal(quantity)
+    contracts = int(scaled)
+    if contracts != scaled:
+        raise ValueError(f"Quantity {quantity} is not a whole number of contracts")
+    return contracts
+
+
+def trade_cost_cents(tick: int, quantity: int) -> int:
+    """Cost in cents of `quantity` contracts at `tick`, rounded half-up to the cent"""
+    return (tick * quantity * CENTS_PER_UNIT * 2 + PRICE_SCALE) // (PRICE_SCALE * 2)
+
+
+def cents_to_amount(cents: int) -> Decimal:
+    """Convert integer cents to an exact 2-decimal token amount"""
+    return Decimal(int(cents)).scaleb(-2)
+
@@ -0,0 +1,54 @@
+"""
+Redis connections shared by the whole process.
+
+redis_client is the synchronous client used by order-entry code that runs on
+the per-market sequencer. Code on the event loop uses the redis.asyncio client
+that the app lifespan opens with open_async_redis() and get_async_redis() hands
+out. Each is backed by one bounded pool: when every connection is busy, callers
+wait up to REDIS_POOL_TIMEOUT seconds for one instead of opening more.
+"""
+from typing import Optional
+import redis
+import redis.asyncio
+from .config import settings
+
+
+def _pool_options() -> dict:
+    return dict(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        db=settings.REDIS_DB,
+        decode_responses=True,
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        timeout=settings.REDIS_POOL_TIMEOUT,
+        socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+        health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+    )
+
+
+redis_client = redis.Redis(connection_pool=redis.BlockingConnectionPool(**_pool_options()))
+
+_async_client: Optional[redis.asyncio.Redis] = None
+
+
+async def open_async_redis() -> redis.asyncio.Redis:
+    """Create the shared asyncio pool (app startup; connections are bound to the running loop)"""
+    global _async_client
+    if _async_client is None:
+        _async_client = redis.asyncio.Redis(connection_pool=redis.asyncio.BlockingConnectionPool(**_pool_options()))
+    return _async_client
+
+
+def get_async_redis() -> redis.asyncio.Redis:
+    if _async_client is None:
+        raise RuntimeError("The async Redis pool is not open (open_async_redis runs at app startup)")
+    return _async_client
+
+
+async def close_async_redis():
+    """Close the shared asyncio pool (app shutdown)"""
+    global _async_client
+    if _async_client is not None:
+        client, _async_client = _async_client, None
+        await client.aclose()
@@ -1,14 +1,50 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, WebSocket, Query
 from fastapi.middleware.cors import CORSMiddleware
 from .core.config import settings
-from .core.database import engine, Base
+from .core.database import engine, Base, SessionLocal
+from .core.redis_client import open_async_redis, close_async_redis
 from .api.routes import auth, users, communities, markets, trading, portfolio, votes, messages
-from .api.websocket import websocket_endpoint
+from .api.websocket import websocket_endpoint, manager
+from .services.sequencer import sequencer
+from .services.journal import journal
+from .services.orderbook import recover_books_from_journal
+from .services.expiry import order_expiry
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title=settings.PROJECT_NAME)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One asyncio Redis pool for everything running on the event loop
+    await open_async_redis()
+    # Engine mode: replay the order journal and put back any book Redis has lost
+    if settings.MATCHING_MODE == "engine" and settings.JOURNAL_DIR:
+        restored = recover_books_from_journal()
+        if restored:
+            print(f"Restored {restored} resting orders from the order journal")
+    # Refill the expiry timer wheel and start advancing it
+    db = SessionLocal()
+    try:
+        order_expiry.load(db)
+    finally:
+        db.close()
+    expiry_task = asyncio.create_task(order_expiry.run())
+    # Relay WebSocket events published by any worker to this worker's sockets
+    subscriber_task = asyncio.create_task(manager.run_subscriber())
+    yield
+    expiry_task.cancel()
+    subscriber_task.cancel()
+    await asyncio.gather(expiry_task, subscriber_task, return_exceptions=True)
+    # Stop the per-market order workers
+    await sequencer.shutdown()
+    journal.close()
+    await close_async_redis()
+
+
+app = FastAPI(title=settings.PROJECT_NAME, lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Enum as SQLEnum, func, JSON
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, Enum as SQLEnum, func, JSON
 from sqlalchemy.orm import relationship
 import enum
 from ..core.database import Base
@@ -32,6 +32,7 @@ class Market(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     outcomes = Column(JSON, nullable=False, default=lambda: ["yes", "no"])  # List of outcome options
     image_url = Column(String, nullable=True)  # URL for market thumbnail/image
+    expire_orders_at_deadline = Column(Boolean, default=False, nullable=False)  # Cancel resting orders at resolution_deadline
 
     # Relationships
     community = relationship("Community", back_populates="markets")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Numeric, DateTime, Enum as SQLEnum, func
+from sqlalchemy import Column, Integer, String, ForeignKey, Numeric, DateTime, Enum as SQLEnum, Index, func
 from sqlalchemy.orm import relationship
 import enum
 from ..core.database import Base
@@ -21,8 +21,20 @@ class OrderStatus(str, enum.Enum):
     PARTIALLY_FILLED = "partially_filled"
 
 
+class TimeInForce(str, enum.Enum):
+    GTC = "gtc"  # Good til cancelled
+    GTT = "gtt"  # Good til time: expires at expires_at
+
+
 class Order(Base):
     __tablename__ = "orders"
+    __table_args__ = (
+        # Open-order lookups per user (mass cancel) and per market (halt) without a table scan
+        Index("ix_orders_user_id_status", "user_id", "status"),
+        Index("ix_orders_market_id_status", "market_id", "status"),
+    )
+    # Read created_at back in the INSERT (RETURNING), not with a later lazy load
+    __mapper_args__ = {"eager_defaults": True}
 
     id = Column(Integer, primary_key=True, index=True)
     market_id = Column(Integer, ForeignKey("markets.id"), nullable=False)
@@ -35,6 +47,8 @@ class Order(Base):
     filled_quantity = Column(Numeric(20, 4), default=0, nullable=False)
     order_type = Column(SQLEnum(OrderType), nullable=False)
     status = Column(SQLEnum(OrderStatus), default=OrderStatus.PENDING, nullable=False)
+    time_in_force = Column(SQLEnum(TimeInForce), default=TimeInForce.GTC, nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=True)  # Set for GTT orders
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     filled_at = Column(DateTime(timezone=True), nullable=True)
 
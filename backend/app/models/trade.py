@@ -5,6 +5,8 @@ from ..core.database import Base
 
 class Trade(Base):
     __tablename__ = "trades"
+    # Read executed_at back in the INSERT (RETURNING), not with a later lazy load
+    __mapper_args__ = {"eager_defaults": True}
 
     id = Column(Integer, primary_key=True, index=True)
     market_id = Column(Integer, ForeignKey("markets.id"), nullable=False)
@@ -13,6 +13,7 @@ class MarketCreate(BaseModel):
     outcomes: Optional[List[str]] = None  # List of outcome names, defaults to ["default"] for legacy
     image_url: Optional[str] = None  # URL for market thumbnail/image
     outcome_images: Optional[Dict[str, str]] = None  # Map of outcome_name -> image_url
+    expire_orders_at_deadline: bool = False  # Cancel all resting orders at resolution_deadline
 
 
 class MarketResponse(BaseModel):
@@ -37,6 +38,7 @@ class MarketResponse(BaseModel):
     image_url: Optional[str] = None  # URL for market thumbnail/image
     upvotes: Optional[int] = 0  # Number of upvotes
     downvotes: Optional[int] = 0  # Number of downvotes
+    expire_orders_at_deadline: Optional[bool] = False
 
     class Config:
         from_attributes = True
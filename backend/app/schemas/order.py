@@ -1,4 +1,4 @@
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, field_validator, model_validator
 from datetime import datetime
 from typing import Optional, List
 from decimal import Decimal
@@ -12,6 +12,8 @@ class OrderCreate(BaseModel):
     price: Optional[Decimal] = None  # Required for limit orders
     quantity: Decimal
     order_type: str  # "limit" or "market"
+    time_in_force: str = "gtc"  # "gtc" (good til cancelled) or "gtt" (good til expires_at)
+    expires_at: Optional[datetime] = None  # Required for "gtt"
     
     @field_validator('side')
     @classmethod
@@ -29,6 +31,14 @@ class OrderCreate(BaseModel):
         if v != int(v):
             raise ValueError('Quantity must be a whole number (no fractional contracts)')
         return Decimal(int(v))  # Convert to integer Decimal
+    
+    @model_validator(mode='after')
+    def validate_expiry(self):
+        if self.time_in_force not in ("gtc", "gtt"):
+            raise ValueError('Time in force must be "gtc" or "gtt"')
+        if (self.time_in_force == "gtt") != (self.expires_at is not None):
+            raise ValueError('expires_at is required for "gtt" orders and not allowed otherwise')
+        return self
 
 
 class OrderResponse(BaseModel):
@@ -43,6 +53,8 @@ class OrderResponse(BaseModel):
     filled_quantity: Decimal
     order_type: str
     status: str
+    time_in_force: str = "gtc"
+    expires_at: Optional[datetime] = None
     created_at: datetime
     filled_at: Optional[datetime]
 
@@ -55,6 +67,7 @@ class OrderBookEntry(BaseModel):
     quantity: Decimal
     order_id: Optional[int] = None
     user_id: Optional[int] = None
+    booked_at: Optional[datetime] = None  # When the order joined the book
 
 
 class OrderBookResponse(BaseModel):
@@ -64,3 +77,59 @@ class OrderBookResponse(BaseModel):
     buys: List[OrderBookEntry]
     sells: List[OrderBookEntry]
 
+
+class QuoteResponse(BaseModel):
+    market_id: int
+    outcome_name: str
+    outcome: str  # "yes" or "no"
+    bid: Optional[Decimal] = None  # Best resting buy of this outcome
+    bid_quantity: int
+    ask: Optional[Decimal] = None  # Implied by the opposite outcome's best buy (1 - price)
+    ask_quantity: int
+
+
+class DepthLevel(BaseModel):
+    price: Decimal
+    quantity: int  # Contracts resting at this price
+    orders: int  # Number of orders at this price
+    cumulative_quantity: int  # Contracts at this price or better
+
+
+class DepthResponse(BaseModel):
+    market_id: int
+    outcome_name: str
+    outcome: str  # "yes" or "no"
+    bids: List[DepthLevel]  # Best (highest) first
+    asks: List[DepthLevel]  # Implied by the opposite outcome, best (lowest) first
+
+
+class OrderBatchCreate(BaseModel):
+    orders: List[OrderCreate]  # All for the same market
+
+
+class OrderBatchResult(BaseModel):
+    index: int  # Position in the submitted batch
+    order: Optional[OrderResponse] = None  # Set when the order was accepted
+    error: Optional[str] = None  # Set when the order was rejected
+
+
+class OrderBatchResponse(BaseModel):
+    market_id: int
+    results: List[OrderBatchResult]
+
+
+class MassCancelResponse(BaseModel):
+    cancelled: int
+    order_ids: List[int]
+
+
+class ReconciliationResponse(BaseModel):
+    market_id: int
+    orders_checked: int
+    missing_from_book: List[int]  # Open in the database, not resting in Redis
+    orphaned_in_book: List[str]  # Resting in Redis, not open in the database
+    mismatched: List[int]  # Resting with the wrong price or remaining quantity
+    open_market_orders: List[int]  # Market orders never cancelled after matching
+    unbookable_orders: List[int]  # Open with a price or quantity that cannot be booked (fix by hand)
+    repaired: bool
+    in_sync: bool
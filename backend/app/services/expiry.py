@@ -0,0 +1,210 @@
+"""
+Good-til-time order expiry.
+
+Resting orders with an expires_at (time in force "gtt"), and every resting
+order of a market created with expire_orders_at_deadline, are put on an
+in-process hierarchical timer wheel. A background task started from the app
+lifespan advances the wheel once per tick and expires whatever fell due as one
+batch per market: one bulk UPDATE, one pipelined removal from the books (on the
+market's sequencer) and one broadcast per affected book.
+
+Entries are never removed early: an order that fills or is cancelled before it
+expires is simply skipped by the bulk UPDATE, which only touches open orders.
+The wheel lives in memory, so on startup it is refilled from the database.
+"""
+import asyncio
+import math
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Hashable, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from ..core.config import settings
+from ..core.database import SessionLocal
+from ..models.order import Order, OrderStatus
+from ..models.market import Market, MarketStatus
+from .orderbook import remove_orders_from_orderbook
+from .sequencer import sequencer
+from .trading import cancel_open_orders
+
+# Wheel entries: ("order", market_id, order_id) or ("market", market_id, None)
+ExpiryEntry = Tuple[str, int, Optional[int]]
+
+
+class TimerWheel:
+    """
+    Hierarchical timer wheel with `levels` wheels of `slots` buckets each.
+    A level-0 bucket covers one tick, a level-n bucket covers slots**n ticks.
+    An entry is filed on the lowest level whose higher digits (in base `slots`)
+    match the current tick's, and drops a level each time the wheel reaches its
+    bucket, so scheduling and firing are O(1) per entry however many are pending.
+    Deadlines beyond the top level wait in an overflow list until the top wraps.
+    """
+    def __init__(self, tick: float = 1.0, slots: int = 64, levels: int = 4, now: Optional[float] = None):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.current = int((time.time() if now is None else now) // tick)
+        self.wheels: List[List[List[Tuple[int, Hashable]]]] = [[[] for _ in range(slots)] for _ in range(levels)]
+        self.overflow: List[Tuple[int, Hashable]] = []
+        self.due: List[Hashable] = []
+        self.size = 0
+
+    def schedule(self, deadline: float, item: Hashable):
+        """Fire item at the first tick at or after deadline (a Unix timestamp)"""
+        self.size += 1
+        self._file(math.ceil(deadline / self.tick), item)
+
+    def _file(self, target: int, item: Hashable):
+        if target <= self.current:
+            self.due.append(item)
+            return
+        for level in range(self.levels):
+            span = self.slots ** (level + 1)
+            if target // span == self.current // span:
+                slot = (target // self.slots ** level) % self.slots
+                self.wheels[level][slot].append((target, item))
+                return
+        self.overflow.append((target, item))
+
+    def advance(self, now: float) -> List[Hashable]:
+        """Move the wheel up to now and return everything that fell due, in deadline order per tick"""
+        fired, self.due = self.due, []
+        target = int(now // self.tick)
+        while self.current < target:
+            self.current += 1
+            if self.current % self.slots ** self.levels == 0:
+                pending, self.overflow = self.overflow, []
+                for entry in pending:
+                    self._file(*entry)
+            # Cascade from the top down so entries land on the bucket they now belong to
+            for level in range(self.levels - 1, 0, -1):
+                if self.current % self.slots ** level == 0:
+                    bucket = self.wheels[level][(self.current // self.slots ** level) % self.slots]
+                    pending = bucket[:]
+                    bucket.clear()
+                    for entry in pending:
+                        self._file(*entry)
+            bucket = self.wheels[0][self.current % self.slots]
+            fired.extend(item for _, item in bucket)
+            bucket.clear()
+            fired.extend(self.due)
+            self.due = []
+        self.size -= len(fired)
+        return fired
+
+
+def _timestamp(value: datetime) -> float:
+    # Naive datetimes (e.g. read back from SQLite) are UTC
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def expire_orders(db: Session, market_id: int, order_ids: Optional[List[int]] = None) -> List[Tuple[int, int, str, str]]:
+    """
+    Cancel the given open orders of a market (all of them when order_ids is None) in one
+    UPDATE and take them off the books in one pipeline. Run it on the market's sequencer.
+    Returns the expired orders as (order_id, market_id, outcome_name, outcome).
+    """
+    cancelled = cancel_open_orders(db, market_id=market_id, order_ids=order_ids)
+    remove_orders_from_orderbook(cancelled)
+    return cancelled
+
+
+class OrderExpiry:
+    def __init__(self, tick: float = 1.0):
+        self.wheel = TimerWheel(tick)
+        # Orders are scheduled from request handlers and sequencer threads
+        self._lock = threading.Lock()
+
+    def schedule_order(self, order: Order):
+        """Expire a resting good-til-time order at its expires_at"""
+        if order.expires_at is None:
+            return
+        with self._lock:
+            self.wheel.schedule(_timestamp(order.expires_at), ("order", order.market_id, order.id))
+
+    def schedule_market(self, market: Market):
+        """Expire every resting order of the market at its resolution deadline"""
+        if not market.expire_orders_at_deadline:
+            return
+        with self._lock:
+            self.wheel.schedule(_timestamp(market.resolution_deadline), ("market", market.id, None))
+
+    def load(self, db: Session) -> int:
+        """Schedule everything already in the database (the wheel does not survive restarts)"""
+        orders = db.query(Order).filter(
+            Order.expires_at.isnot(None),
+            Order.status.in_([OrderStatus.PENDING, OrderStatus.PARTIALLY_FILLED])
+        ).all()
+        markets = db.query(Market).filter(
+            Market.expire_orders_at_deadline.is_(True),
+            Market.status == MarketStatus.ACTIVE
+        ).all()
+        for order in orders:
+            self.schedule_order(order)
+        for market in markets:
+            self.schedule_market(market)
+        return len(orders) + len(markets)
+
+    def pop_due(self, now: Optional[float] = None) -> Dict[int, Optional[List[int]]]:
+        """Advance the wheel and group what fell due per market ({market_id: order ids, or None for all})"""
+        with self._lock:
+            fired = self.wheel.advance(time.time() if now is None else now)
+        due: Dict[int, Optional[List[int]]] = {}
+        for kind, market_id, order_id in fired:
+            if kind == "market":
+                due[market_id] = None
+            elif market_id not in due or due[market_id] is not None:
+                due.setdefault(market_id, []).append(order_id)
+        return due
+
+    def retry(self, market_id: int, order_ids: Optional[List[int]], now: Optional[float] = None):
+        """Put a market's fired entries back on the wheel for the next tick (their expiry failed)"""
+        deadline = (time.time() if now is None else now) + self.wheel.tick
+        with self._lock:
+            if order_ids is None:
+                self.wheel.schedule(deadline, ("market", market_id, None))
+                return
+            for order_id in order_ids:
+                self.wheel.schedule(deadline, ("order", market_id, order_id))
+
+    async def expire_due(self, now: Optional[float] = None) -> int:
+        """Expire everything due, one batch per market. Returns how many orders were cancelled.
+        A market whose batch fails is retried on the next tick.
+        """
+        due = self.pop_due(now)
+        if not due:
+            return 0
+
+        from ..api.websocket import manager
+
+        expired = 0
+        for market_id, order_ids in due.items():
+            db = SessionLocal()
+            try:
+                cancelled = await sequencer.submit(market_id, expire_orders, db, market_id, order_ids)
+            except Exception as e:
+                print(f"Order expiry failed for market {market_id}, retrying next tick: {e}")
+                self.retry(market_id, order_ids, now)
+                continue
+            finally:
+                db.close()
+            expired += len(cancelled)
+
+            try:
+                for _, outcome_name, outcome in sorted({row[1:] for row in cancelled}):
+                    await manager.broadcast_orderbook_update(market_id, outcome_name, outcome)
+            except Exception as ws_error:
+                print(f"WebSocket broadcast error: {ws_error}")
+        return expired
+
+    async def run(self):
+        """Background task: advance the wheel every tick until cancelled"""
+        while True:
+            await asyncio.sleep(self.wheel.tick)
+            await self.expire_due()
+
+
+order_expiry = OrderExpiry(settings.EXPIRY_TICK_SECONDS)
@@ -0,0 +1,181 @@
+"""
+Append-only journal of orderbook changes, with compact snapshots.
+
+Every change to a resting order (accept, fill, cancel) is appended to
+journal.bin as a sequenced binary record. Every `snapshot_every` records the
+current set of resting orders is written to snapshot.bin and the journal is
+truncated, so startup only replays the snapshot plus a short tail.
+
+Record framing (little endian):
+    body length (uint32), CRC32 of body (uint32), body
+Body:
+    seq (uint64), kind (uint8), outcome (uint8, 0 = yes / 1 = no),
+    market_id (uint64), order_id (uint64), user_id (uint64, 0 = unknown),
+    tick (uint16), quantity (uint64), outcome_name (utf-8, rest of body)
+For FILL records quantity is what is left after the fill (0 = fully filled).
+
+A snapshot is a header (magic, seq of the last record it includes) followed by
+one ACCEPT record per resting order. A torn or corrupt record at the end of the
+journal (crash mid-write) ends replay and is cut off when the journal reopens.
+
+The journal is written by the matching engine (single API worker); in "lua"
+mode several workers share the Redis books and nothing is journaled.
+"""
+import os
+import struct
+import threading
+import zlib
+from typing import Dict, Iterator, List, Optional, Tuple
+from ..core.config import settings
+
+ACCEPT = 1
+FILL = 2
+CANCEL = 3
+
+_HEADER = struct.Struct("<II")
+_BODY = struct.Struct("<QBBQQQHQ")
+_SNAPSHOT_HEADER = struct.Struct("<4sQ")
+_SNAPSHOT_MAGIC = b"BTS1"
+_OUTCOMES = ("yes", "no")
+
+# order_id -> (market_id, outcome_name, outcome, user_id, tick, quantity)
+RestingState = Dict[int, Tuple[int, str, str, int, int, int]]
+
+
+def _encode(seq: int, kind: int, market_id: int, outcome_name: str, outcome: str, order_id: int, user_id: int, tick: int, quantity: int) -> bytes:
+    body = _BODY.pack(seq, kind, _OUTCOMES.index(outcome), market_id, order_id, user_id, tick, quantity) + outcome_name.encode("utf-8")
+    return _HEADER.pack(len(body), zlib.crc32(body)) + body
+
+
+def _decode(data: bytes, offset: int = 0) -> Iterator[Tuple[int, tuple]]:
+    """Yield (end offset, record) for each intact record, stopping at the first bad one"""
+    while offset + _HEADER.size <= len(data):
+        length, crc = _HEADER.unpack_from(data, offset)
+        start = offset + _HEADER.size
+        body = data[start:start + length]
+        if length < _BODY.size or len(body) < length or zlib.crc32(body) != crc:
+            return
+        seq, kind, outcome, market_id, order_id, user_id, tick, quantity = _BODY.unpack_from(body)
+        outcome_name = body[_BODY.size:].decode("utf-8")
+        offset = start + length
+        yield offset, (seq, kind, market_id, outcome_name, _OUTCOMES[outcome], order_id, user_id, tick, quantity)
+
+
+def _apply(state: RestingState, record: tuple):
+    seq, kind, market_id, outcome_name, outcome, order_id, user_id, tick, quantity = record
+    if kind == ACCEPT:
+        state[order_id] = (market_id, outcome_name, outcome, user_id, tick, quantity)
+    elif kind == FILL and quantity > 0 and order_id in state:
+        state[order_id] = state[order_id][:5] + (quantity,)
+    else:
+        state.pop(order_id, None)
+
+
+class OrderJournal:
+    def __init__(self, directory: str, snapshot_every: int = 10000, fsync: bool = False):
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self.journal_path = os.path.join(directory, "journal.bin")
+        self.snapshot_path = os.path.join(directory, "snapshot.bin")
+        self.state: RestingState = {}
+        self.seq = 0
+        self._since_snapshot = 0
+        self._file = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._file is not None
+
+    def open(self) -> RestingState:
+        """Replay snapshot + journal tail, then open the journal for appending.
+        Returns the resting orders as of the last intact record.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        state: RestingState = {}
+        snapshot_seq = 0
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "rb") as f:
+                data = f.read()
+            magic, snapshot_seq = _SNAPSHOT_HEADER.unpack_from(data)
+            if magic != _SNAPSHOT_MAGIC:
+                raise ValueError(f"{self.snapshot_path} is not an order journal snapshot")
+            for _, record in _decode(data, _SNAPSHOT_HEADER.size):
+                _apply(state, record)
+
+        seq = snapshot_seq
+        valid_end = 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "rb") as f:
+                data = f.read()
+            for valid_end, record in _decode(data):
+                # Records already folded into the snapshot (crash before truncation) are skipped
+                if record[0] > snapshot_seq:
+                    _apply(state, record)
+                    seq = record[0]
+                    self._since_snapshot += 1
+
+        self._file = open(self.journal_path, "ab")
+        # Drop a torn tail so new records follow the last intact one
+        self._file.truncate(valid_end)
+        self.state = state
+        self.seq = seq
+        return dict(state)
+
+    def record(self, kind: int, market_id: int, outcome_name: str, outcome: str, order_id: int,
+               user_id: Optional[int] = None, tick: int = 0, quantity: int = 0):
+        """Append one change (no-op until the journal is opened)"""
+        self.record_many([(kind, market_id, outcome_name, outcome, order_id, user_id, tick, quantity)])
+
+    def record_many(self, changes: List[tuple]):
+        """Append the changes of one unit of work with a single flush (and fsync).
+        changes are (kind, market_id, outcome_name, outcome, order_id, user_id, tick, quantity)
+        tuples, as taken by record(). This does file I/O (and may write a snapshot), so async
+        callers run it off the event loop.
+        """
+        if self._file is None or not changes:
+            return
+        with self._lock:
+            for kind, market_id, outcome_name, outcome, order_id, user_id, tick, quantity in changes:
+                self.seq += 1
+                record = (self.seq, kind, market_id, outcome_name, outcome, order_id, user_id or 0, tick, quantity)
+                self._file.write(_encode(*record))
+                _apply(self.state, record)
+                self._since_snapshot += 1
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            if self._since_snapshot >= self.snapshot_every:
+                self._snapshot()
+
+    def snapshot(self):
+        with self._lock:
+            if self._file is not None:
+                self._snapshot()
+
+    def _snapshot(self):
+        """Write the resting orders as of self.seq and truncate the journal (caller holds the lock)"""
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, self.seq))
+            for order_id, (market_id, outcome_name, outcome, user_id, tick, quantity) in self.state.items():
+                f.write(_encode(self.seq, ACCEPT, market_id, outcome_name, outcome, order_id, user_id, tick, quantity))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        self._file.truncate(0)
+        self._since_snapshot = 0
+
+    def close(self):
+        """Snapshot (so the next start has no tail to replay) and stop journaling"""
+        with self._lock:
+            if self._file is None:
+                return
+            self._snapshot()
+            self._file.close()
+            self._file = None
+
+
+# Records nothing until opened at startup (see orderbook.recover_books_from_journal)
+journal = OrderJournal(settings.JOURNAL_DIR, settings.JOURNAL_SNAPSHOT_EVERY, settings.JOURNAL_FSYNC)
@@ -0,0 +1,175 @@
+"""
+In-memory price-time-priority matching engine.
+
+Books are keyed by (market_id, outcome_name). In the buy-only model each book
+holds the resting buy orders for both the "yes" and the "no" side of that
+outcome; an incoming YES order matches against the NO side and vice versa.
+
+Each side is a fixed ladder of integer price ticks (see core.fixedpoint):
+arrays indexed by tick hold the total quantity and the FIFO queue of orders at
+that level, and the best tick is tracked incrementally. Quantities are whole
+contracts, so the book does integer arithmetic only. Insert, cancel and
+best-price lookup are O(1) (amortised, when the best level empties the next one
+is found by walking down the ladder), and depth queries cost O(levels) no
+matter how many orders rest. Redis stays the persistence layer: a book is
+loaded from Redis the first time it is touched (see
+orderbook.get_engine_book) and kept resident afterwards.
+"""
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+from ..core.fixedpoint import PRICE_SCALE
+
+
+@dataclass
+class RestingOrder:
+    order_id: int
+    tick: int
+    quantity: int  # whole contracts
+
+
+class BookSide:
+    """Resting buy orders for one outcome side, highest tick first"""
+
+    def __init__(self):
+        # tick -> FIFO queue of order_id -> RestingOrder (None when the level is empty)
+        self.queues: List[Optional["OrderedDict[int, RestingOrder]"]] = [None] * (PRICE_SCALE + 1)
+        # tick -> total resting quantity at that level
+        self.level_quantity: List[int] = [0] * (PRICE_SCALE + 1)
+        # order_id -> RestingOrder, for direct cancel/update
+        self.orders: Dict[int, RestingOrder] = {}
+        # Highest populated tick, -1 when the side is empty
+        self.best_tick = -1
+
+    def __len__(self) -> int:
+        return len(self.orders)
+
+    def __contains__(self, order_id: int) -> bool:
+        return order_id in self.orders
+
+    def add(self, order_id: int, tick: int, quantity: int) -> RestingOrder:
+        """Add an order at the back of its price level (re-adding replaces it)"""
+        if order_id in self.orders:
+            self.remove(order_id)
+        queue = self.queues[tick]
+        if queue is None:
+            queue = OrderedDict()
+            self.queues[tick] = queue
+        resting = RestingOrder(order_id=order_id, tick=tick, quantity=quantity)
+        queue[order_id] = resting
+        self.orders[order_id] = resting
+        self.level_quantity[tick] += quantity
+        if tick > self.best_tick:
+            self.best_tick = tick
+        return resting
+
+    def remove(self, order_id: int) -> Optional[RestingOrder]:
+        resting = self.orders.pop(order_id, None)
+        if resting is None:
+            return None
+        tick = resting.tick
+        queue = self.queues[tick]
+        del queue[order_id]
+        self.level_quantity[tick] -= resting.quantity
+        if not queue:
+            self.queues[tick] = None
+            self.level_quantity[tick] = 0
+            if tick == self.best_tick:
+                self.best_tick = self._next_below(tick)
+        return resting
+
+    def update(self, order_id: int, quantity: int) -> Optional[RestingOrder]:
+        """Change the remaining quantity in place, keeping time priority"""
+        resting = self.orders.get(order_id)
+        if resting is None:
+            return None
+        if quantity <= 0:
+            return self.remove(order_id)
+        self.level_quantity[resting.tick] += quantity - resting.quantity
+        resting.quantity = quantity
+        return resting
+
+    def best(self) -> Optional[int]:
+        """Best (highest) tick, or None if nothing rests on this side"""
+        return self.best_tick if self.best_tick >= 0 else None
+
+    def _next_below(self, tick: int) -> int:
+        tick -= 1
+        while tick >= 0 and self.queues[tick] is None:
+            tick -= 1
+        return tick
+
+    def iter_orders(self, min_tick: int = 0) -> Iterator[RestingOrder]:
+        """Yield resting orders best tick first, FIFO within a level, down to min_tick.
+        Safe to mutate the side while iterating.
+        """
+        tick = self.best_tick
+        while tick >= min_tick and tick >= 0:
+            queue = self.queues[tick]
+            if queue:
+                for resting in list(queue.values()):
+                    yield resting
+            tick = self._next_below(tick)
+
+    def iter_level(self, tick: int) -> Iterator[RestingOrder]:
+        """Yield the orders resting at exactly this tick, FIFO"""
+        if 0 <= tick <= PRICE_SCALE and self.queues[tick]:
+            for resting in list(self.queues[tick].values()):
+                yield resting
+
+    def depth(self, max_levels: int = 20, min_tick: int = 0, max_tick: int = PRICE_SCALE) -> List[Tuple[int, int, int]]:
+        """Aggregated levels best first, within [min_tick, max_tick]: (tick, total quantity, order count)"""
+        levels = []
+        tick = min(self.best_tick, max_tick)
+        while tick >= min_tick and tick >= 0 and len(levels) < max_levels:
+            queue = self.queues[tick]
+            if queue:
+                levels.append((tick, self.level_quantity[tick], len(queue)))
+            tick = self._next_below(tick)
+        return levels
+
+
+class OutcomeBook:
+    """Both YES and NO sides of one (market_id, outcome_name)"""
+
+    def __init__(self, market_id: int, outcome_name: str):
+        self.market_id = market_id
+        self.outcome_name = outcome_name
+        self.sides: Dict[str, BookSide] = {"yes": BookSide(), "no": BookSide()}
+
+    def side(self, outcome: str) -> BookSide:
+        return self.sides[outcome]
+
+
+class MatchingEngine:
+    """Registry of resident books"""
+
+    def __init__(self):
+        self.books: Dict[Tuple[int, str], OutcomeBook] = {}
+        self._lock = threading.Lock()
+
+    def peek_book(self, market_id: int, outcome_name: str) -> Optional[OutcomeBook]:
+        """Return the book only if it is already resident"""
+        return self.books.get((market_id, outcome_name))
+
+    def load_book(self, market_id: int, outcome_name: str, orders: Dict[str, List[Tuple[int, int, int]]]) -> OutcomeBook:
+        """Install a book from persisted (order_id, tick, quantity) rows per outcome.
+        Rows are placed in order_id order within a level, which is arrival order.
+        If another thread installed the book first, that book wins.
+        """
+        book = OutcomeBook(market_id, outcome_name)
+        for outcome, rows in orders.items():
+            side = book.side(outcome)
+            for order_id, tick, quantity in sorted(rows, key=lambda row: row[0]):
+                side.add(order_id, tick, quantity)
+        with self._lock:
+            return self.books.setdefault((market_id, outcome_name), book)
+
+    def evict(self, market_id: int, outcome_name: str):
+        """Drop a resident book so the next access reloads it from Redis"""
+        with self._lock:
+            self.books.pop((market_id, outcome_name), None)
+
+
+engine = MatchingEngine()
@@ -1,16 +1,197 @@
-import redis
-import json
+import asyncio
+import time
+from datetime import datetime, timezone
 from decimal import Decimal
 from typing import List, Dict, Tuple, Optional
-from sqlalchemy.orm import Session
 from ..core.config import settings
+from ..core.redis_client import redis_client, get_async_redis
+from ..core.fixedpoint import price_to_tick, tick_to_price, to_contracts, complement_tick, PRICE_SCALE
+from .matching_engine import engine, OutcomeBook
+from .journal import journal, ACCEPT, FILL, CANCEL
 
-redis_client = redis.Redis(
-    host=settings.REDIS_HOST,
-    port=settings.REDIS_PORT,
-    db=settings.REDIS_DB,
-    decode_responses=True
-)
+
+# Book layout in Redis (per orderbook key):
+#   {key}            sorted set, member = zero-padded order id, score = +/- price ticks
+#   {key}:qty        hash, member -> remaining quantity (whole contracts)
+#   {key}:meta       hash, member -> "user_id:booked_at_ms"
+#   orderbook:index  hash, order id -> orderbook key (for cancels that only know the id)
+#   bbo:{market_id}:{outcome_name}
+#                    hash, best buy tick and the quantity resting at it for each outcome
+#                    side (yes_tick, yes_qty, no_tick, no_qty; tick -1 when the side is empty)
+# Members are stable (they no longer embed the quantity), so cancels, amends and fills
+# address an order directly; zero-padding makes equal-price members sort by arrival.
+ORDER_INDEX_KEY = "orderbook:index"
+
+# Walks the opposite book best-first, claims fills for up to ARGV[1] contracts and
+# removes/shrinks the claimed orders, all in one atomic step.
+# KEYS: opposite outcome's buy book, its :qty hash, its :meta hash, the order index
+# ARGV[1]: quantity wanted
+# ARGV[2]: lowest price tick that may be matched (0 walks the whole book)
+# ARGV[3]: max members to examine per call
+# Returns a flat list: order_id, quantity, tick, meta, order_id, quantity, tick, meta, ...
+MATCH_SCRIPT = """
+local key, qty_key, meta_key, index_key = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local remaining = tonumber(ARGV[1])
+-- Buy scores are negative ticks, so "tick >= ARGV[2]" is "score <= -ARGV[2]", best first
+local members = redis.call('ZRANGEBYSCORE', key, '-inf', -tonumber(ARGV[2]), 'WITHSCORES', 'LIMIT', 0, tonumber(ARGV[3]))
+local fills = {}
+for i = 1, #members, 2 do
+    if remaining <= 0 then
+        break
+    end
+    local member = members[i]
+    local score = members[i + 1]
+    local quantity = tonumber(redis.call('HGET', qty_key, member))
+    local meta = redis.call('HGET', meta_key, member) or ""
+    local fill = 0
+    if quantity and quantity > 0 then
+        fill = math.min(remaining, quantity)
+    end
+    if fill > 0 and fill < quantity then
+        redis.call('HSET', qty_key, member, tostring(quantity - fill))
+    else
+        redis.call('ZREM', key, member)
+        redis.call('HDEL', qty_key, member)
+        redis.call('HDEL', meta_key, member)
+        redis.call('HDEL', index_key, tostring(tonumber(member)))
+    end
+    if fill > 0 then
+        remaining = remaining - fill
+        table.insert(fills, member)
+        table.insert(fills, tostring(fill))
+        table.insert(fills, tostring(-tonumber(score)))
+        table.insert(fills, meta)
+    end
+end
+return fills
+"""
+
+_match_script = redis_client.register_script(MATCH_SCRIPT)
+
+# Reads a slice of a book with each order's quantity and meta, in one round trip.
+# KEYS: the book, its :qty hash, its :meta hash
+# ARGV[1], ARGV[2]: ZRANGE start and stop
+# Returns a flat list: member, score, quantity, meta, member, score, quantity, meta, ...
+READ_SIDE_SCRIPT = """
+local members = redis.call('ZRANGE', KEYS[1], ARGV[1], ARGV[2], 'WITHSCORES')
+local rows = {}
+for i = 1, #members, 2 do
+    table.insert(rows, members[i])
+    table.insert(rows, members[i + 1])
+    table.insert(rows, redis.call('HGET', KEYS[2], members[i]) or "")
+    table.insert(rows, redis.call('HGET', KEYS[3], members[i]) or "")
+end
+return rows
+"""
+
+_read_side_script = redis_client.register_script(READ_SIDE_SCRIPT)
+
+# Sets a resting order's remaining quantity, unless it has left the book.
+# KEYS: the buy book, its :qty hash
+# ARGV[1]: member, ARGV[2]: quantity
+# Returns 1 if the order was resting, 0 otherwise
+SET_QUANTITY_SCRIPT = """
+if redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+    redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+# Gives claimed quantity back to a book: added to an order that is still resting, otherwise the
+# order is put back at its price. Atomic, so a claim made meanwhile by another worker is kept.
+# KEYS: the buy book, its :qty hash, its :meta hash, the order index
+# ARGV: member, tick, quantity, meta for each claim
+RESTORE_SCRIPT = """
+local key, qty_key, meta_key, index_key = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+for i = 1, #ARGV, 4 do
+    local member, quantity = ARGV[i], tonumber(ARGV[i + 2])
+    if redis.call('ZSCORE', key, member) then
+        local resting = tonumber(redis.call('HGET', qty_key, member)) or 0
+        redis.call('HSET', qty_key, member, tostring(resting + quantity))
+    else
+        redis.call('ZADD', key, -tonumber(ARGV[i + 1]), member)
+        redis.call('HSET', qty_key, member, tostring(quantity))
+        redis.call('HSET', meta_key, member, ARGV[i + 3])
+        redis.call('HSET', index_key, tostring(tonumber(member)), key)
+    end
+end
+return #ARGV / 4
+"""
+
+# Recomputes the top of book of one outcome (both sides) and stores it in its bbo hash.
+# KEYS: yes buy book, its :qty hash, no buy book, its :qty hash, the bbo hash
+# Returns yes_tick, yes_qty, no_tick, no_qty, 1 if anything changed (else 0)
+BBO_SCRIPT = """
+local values = {}
+for i = 0, 1 do
+    local book, qty_key = KEYS[i * 2 + 1], KEYS[i * 2 + 2]
+    local top = redis.call('ZRANGE', book, 0, 0, 'WITHSCORES')
+    local tick, quantity = -1, 0
+    if #top > 0 then
+        tick = -tonumber(top[2])
+        for _, member in ipairs(redis.call('ZRANGEBYSCORE', book, top[2], top[2])) do
+            quantity = quantity + (tonumber(redis.call('HGET', qty_key, member)) or 0)
+        end
+    end
+    table.insert(values, tick)
+    table.insert(values, quantity)
+end
+local fields = {'yes_tick', 'yes_qty', 'no_tick', 'no_qty'}
+local previous = redis.call('HMGET', KEYS[5], unpack(fields))
+local changed = 0
+for i = 1, 4 do
+    if tonumber(previous[i]) ~= values[i] then
+        changed = 1
+    end
+end
+if changed == 1 then
+    redis.call('HSET', KEYS[5], 'yes_tick', values[1], 'yes_qty', values[2], 'no_tick', values[3], 'no_qty', values[4])
+end
+table.insert(values, changed)
+return values
+"""
+
+_bbo_script = redis_client.register_script(BBO_SCRIPT)
+
+# Aggregates a price band of a buy book into levels, best first.
+# Walks level by level with a score cursor (each step starts just past the last level's score),
+# so every member in the returned levels is read once and nothing is rescanned.
+# KEYS: the buy book, its :qty hash
+# ARGV[1], ARGV[2]: lowest and highest tick of the band, ARGV[3]: max levels
+# Returns a flat list: tick, quantity, order count, tick, quantity, order count, ...
+DEPTH_SCRIPT = """
+local key, qty_key = KEYS[1], KEYS[2]
+local max_levels = tonumber(ARGV[3])
+-- Buy scores are negative ticks, so the band is [-max_tick, -min_tick], best first
+local cursor, high = -tonumber(ARGV[2]), -tonumber(ARGV[1])
+local levels = {}
+while #levels < max_levels * 3 do
+    local top = redis.call('ZRANGEBYSCORE', key, cursor, high, 'WITHSCORES', 'LIMIT', 0, 1)
+    if #top == 0 then
+        break
+    end
+    local score = top[2]
+    local quantity, orders = 0, 0
+    for _, member in ipairs(redis.call('ZRANGEBYSCORE', key, score, score)) do
+        quantity = quantity + (tonumber(redis.call('HGET', qty_key, member)) or 0)
+        orders = orders + 1
+    end
+    table.insert(levels, -tonumber(score))
+    table.insert(levels, quantity)
+    table.insert(levels, orders)
+    cursor = '(' .. score
+end
+return levels
+"""
+
+_depth_script = redis_client.register_script(DEPTH_SCRIPT)
+
+# In-process copy of the bbo hashes: (market_id, outcome_name) -> (yes_tick, yes_qty, no_tick, no_qty).
+# Every book change made through this module refreshes it, so reads never touch the sorted sets.
+# Only engine mode reads it: there this process owns the books. In Lua mode other workers change
+# them too, so reads go to the bbo hash (one HMGET).
+_bbo_cache: Dict[Tuple[int, str], Tuple[int, int, int, int]] = {}
 
 
 def get_orderbook_key(market_id: int, outcome_name: str, outcome: str, side: str) -> str:
@@ -22,115 +203,559 @@ def get_orderbook_key(market_id: int, outcome_name: str, outcome: str, side: str
     return f"orderbook:{market_id}:{outcome_name}:{outcome}:{side}"
 
 
-def add_order_to_orderbook(market_id: int, outcome_name: str, outcome: str, side: str, price: Decimal, quantity: Decimal, order_id: int):
-    """Add order to orderbook in Redis"""
-    key = get_orderbook_key(market_id, outcome_name, outcome, side)
-    # Use sorted set: score is price, value is order_id:quantity
-    # For buy orders: use negative price for descending order (highest first)
-    # For sell orders: use positive price for ascending order (lowest first)
-    if side == "buy":
-        score = float(price) * -1  # Negative for descending
-    else:
-        score = float(price)
+def get_bbo_key(market_id: int, outcome_name: str) -> str:
+    """Redis key of the top-of-book hash for both sides of an outcome"""
+    return f"bbo:{market_id}:{outcome_name}"
+
+
+def _member(order_id: int) -> str:
+    """Sorted-set member for an order (zero-padded so ties sort by arrival)"""
+    return f"{int(order_id):012d}"
+
+
+def _book_keys(key: str) -> List[str]:
+    return [key, f"{key}:qty", f"{key}:meta", ORDER_INDEX_KEY]
+
+
+def _queue_add(pipe, key: str, score: int, order_id: int, quantity: int, meta: str):
+    member = _member(order_id)
+    pipe.zadd(key, {member: score})
+    pipe.hset(f"{key}:qty", member, str(quantity))
+    pipe.hset(f"{key}:meta", member, meta)
+    pipe.hset(ORDER_INDEX_KEY, str(order_id), key)
+
+
+def _queue_remove(pipe, key: str, order_id: int):
+    member = _member(order_id)
+    pipe.zrem(key, member)
+    pipe.hdel(f"{key}:qty", member)
+    pipe.hdel(f"{key}:meta", member)
+    pipe.hdel(ORDER_INDEX_KEY, str(order_id))
+
+
+def _queue_book_updates(pipe, book_updates: list) -> List[Tuple[str, tuple, int]]:
+    """Queue the Redis side of deferred book changes on one pipeline.
+    book_updates are (action, payload) pairs as built by trading._book_update, with payload
+    (market_id, outcome_name, outcome, order_id, price, remaining contracts, user_id).
+    Every touched outcome gets its top of book recomputed at the end of the pipeline.
+    Returns (action, payload, index of the result that tells whether the order was resting),
+    followed by ("bbo", (market_id, outcome_name), index of the recomputed top of book).
+    """
+    queued = []
+    index = 0
+    booked_at_ms = int(time.time() * 1000)
+    touched = {}
+    for action, payload in book_updates:
+        touched[payload[0], payload[1]] = None
+        if action == "claim":
+            continue  # Already applied inside Redis by the match script
+        market_id, outcome_name, outcome, order_id, price, remaining, user_id = payload
+        key = get_orderbook_key(market_id, outcome_name, outcome, "buy")
+        queued.append((action, payload, index))
+        if action == "add":
+            # Buy scores are negative ticks, so the highest price sorts first
+            meta = f"{user_id if user_id is not None else ''}:{booked_at_ms}"
+            _queue_add(pipe, key, -price_to_tick(price), order_id, remaining, meta)
+            index += 4
+        elif action == "update" and remaining > 0:
+            # Only touch orders that are still resting
+            pipe.eval(SET_QUANTITY_SCRIPT, 2, key, f"{key}:qty", _member(order_id), str(remaining))
+            index += 1
+        else:
+            # A cancel, or a fill that leaves nothing
+            _queue_remove(pipe, key, order_id)
+            index += 4
+    for market_id, outcome_name in touched:
+        _queue_bbo(pipe, market_id, outcome_name)
+        queued.append(("bbo", (market_id, outcome_name), index))
+        index += 1
+    return queued
+
+
+def _queue_bbo(pipe, market_id: int, outcome_name: str):
+    yes_key = get_orderbook_key(market_id, outcome_name, "yes", "buy")
+    no_key = get_orderbook_key(market_id, outcome_name, "no", "buy")
+    keys = [yes_key, f"{yes_key}:qty", no_key, f"{no_key}:qty", get_bbo_key(market_id, outcome_name)]
+    pipe.eval(BBO_SCRIPT, len(keys), *keys)
+
+
+def _store_bbo(market_id: int, outcome_name: str, values) -> bool:
+    """Cache a BBO_SCRIPT result. Returns True if the top of book changed"""
+    _bbo_cache[market_id, outcome_name] = tuple(int(value) for value in values[:4])
+    return bool(int(values[4]))
+
+
+def _finish_book_updates(queued: List[Tuple[str, tuple, int]], results: list, sync_engine: bool) -> List[tuple]:
+    """Keep the resident matching books in step with what Redis applied.
+    Returns the journal records for those changes, for the caller to write (journal.record_many).
+    """
+    records = []
+    for action, payload, index in queued:
+        if action == "bbo":
+            _store_bbo(*payload, results[index])
+            continue
+        market_id, outcome_name, outcome, order_id, price, remaining, user_id = payload
+        if action == "add":
+            records.append((ACCEPT, market_id, outcome_name, outcome, order_id, user_id, price_to_tick(price), remaining))
+        elif results[index]:
+            if action == "update":
+                records.append((FILL, market_id, outcome_name, outcome, order_id, None, 0, remaining))
+            else:
+                records.append((CANCEL, market_id, outcome_name, outcome, order_id, None, 0, 0))
+        
+        # The resident book is loaded from Redis on first use; until then there is nothing to update
+        book = engine.peek_book(market_id, outcome_name) if sync_engine else None
+        if not book:
+            continue
+        if action == "add":
+            book.side(outcome).add(order_id, price_to_tick(price), remaining)
+        elif action == "update":
+            book.side(outcome).update(order_id, remaining)
+        else:
+            book.side(outcome).remove(order_id)
+    return records
+
+
+def apply_book_updates(book_updates: list, sync_engine: bool = True):
+    """Apply every book change of one unit of work (adds, fills, cancels) in a single Redis pipeline.
+    sync_engine=False writes Redis only, for changes already applied to the resident books.
+    """
+    pipe = redis_client.pipeline()
+    queued = _queue_book_updates(pipe, book_updates)
+    if queued:
+        journal.record_many(_finish_book_updates(queued, pipe.execute(), sync_engine))
+
+
+async def apply_book_updates_async(book_updates: list, sync_engine: bool = True):
+    """apply_book_updates on the shared asyncio Redis pool"""
+    pipe = get_async_redis().pipeline()
+    queued = _queue_book_updates(pipe, book_updates)
+    if queued:
+        records = _finish_book_updates(queued, await pipe.execute(), sync_engine)
+        if records and journal.is_open:
+            # File writes (and every so often a full snapshot with fsync) would stall the loop.
+            # Callers run on the market's sequencer, so a market's records still go in order.
+            await asyncio.to_thread(journal.record_many, records)
+
+
+def add_order_to_orderbook(market_id: int, outcome_name: str, outcome: str, side: str, price: Decimal, quantity, order_id: int, user_id: Optional[int] = None, sync_engine: bool = True):
+    """Add order to orderbook in Redis
+    Every order is a buy in the buy-only model, so side must be "buy".
+    sync_engine=False skips the resident book (the caller has already applied the change there).
+    """
+    if side != "buy":
+        raise ValueError("Only buy orders rest in the book")
+    apply_book_updates([("add", (market_id, outcome_name, outcome, order_id, price, to_contracts(quantity), user_id))], sync_engine)
+
+
+def remove_order_from_orderbook(market_id: int, outcome_name: str, outcome: str, side: str, order_id: int, sync_engine: bool = True):
+    """Remove order from orderbook (a cancel; fills go through update_order_in_orderbook)"""
+    apply_book_updates([("remove", (market_id, outcome_name, outcome, order_id, None, 0, None))], sync_engine)
+
+
+def remove_order_by_id(order_id: int) -> bool:
+    """Remove an order when only its id is known, using the order index.
+    Returns False if the order was not in any book.
+    """
+    key = redis_client.hget(ORDER_INDEX_KEY, str(order_id))
+    if not key:
+        return False
+    remove_order_from_orderbook(*split_book_key(key), order_id)
+    return True
+
+
+def remove_orders_from_orderbook(orders: List[Tuple[int, int, str, str]]):
+    """Remove many orders at once: (order_id, market_id, outcome_name, outcome) rows.
+    All Redis removals go out in one pipeline.
+    """
+    apply_book_updates([
+        ("remove", (market_id, outcome_name, outcome, order_id, None, 0, None))
+        for order_id, market_id, outcome_name, outcome in orders
+    ])
+
+
+def update_order_in_orderbook(market_id: int, outcome_name: str, outcome: str, side: str, order_id: int, new_quantity, sync_engine: bool = True):
+    """Update order quantity in orderbook after a fill (price and time priority are unchanged).
+    A quantity of 0 means the order is fully filled and leaves the book.
+    """
+    apply_book_updates([("update", (market_id, outcome_name, outcome, order_id, None, to_contracts(new_quantity), None))], sync_engine)
+
+
+def _parse_quantity(value: str) -> int:
+    """Quantity from Redis (entries written before quantities were integers look like "10.0000")"""
+    try:
+        return int(value)
+    except ValueError:
+        return to_contracts(Decimal(value))
+
+
+def _parse_rows(flat: list) -> List[Tuple[int, int, int, str]]:
+    """Rows from READ_SIDE_SCRIPT's flat reply (member, score, quantity, meta, ...)"""
+    rows = []
+    for i in range(0, len(flat), 4):
+        try:
+            rows.append((int(flat[i]), int(float(flat[i + 1])), _parse_quantity(flat[i + 2]), flat[i + 3] or ""))
+        except (ValueError, TypeError, ArithmeticError):
+            continue  # Skip invalid entries
+    return rows
+
+
+def _read_side(key: str, start: int = 0, end: int = -1) -> List[Tuple[int, int, int, str]]:
+    """Read (order_id, score, quantity, meta) rows from one book, in book order (one round trip)"""
+    return _parse_rows(_read_side_script(keys=[key, f"{key}:qty", f"{key}:meta"], args=[start, end]))
+
+
+async def _read_side_async(key: str, start: int = 0, end: int = -1) -> List[Tuple[int, int, int, str]]:
+    """_read_side on the shared asyncio Redis pool"""
+    script = get_async_redis().register_script(READ_SIDE_SCRIPT)
+    return _parse_rows(await script(keys=[key, f"{key}:qty", f"{key}:meta"], args=[start, end]))
+
+
+def _parse_meta(meta: str) -> Tuple[Optional[int], Optional[datetime]]:
+    """(user_id, booked_at) from a "user_id:booked_at_ms" meta value (either part may be empty)"""
+    user_id, _, booked_at_ms = meta.partition(":")
+    return (
+        int(user_id) if user_id else None,
+        datetime.fromtimestamp(int(booked_at_ms) / 1000, tz=timezone.utc) if booked_at_ms else None
+    )
+
+
+def _format_side(rows: List[Tuple[int, int, int, str]]) -> List[Dict]:
+    entries = []
+    for order_id, score, quantity, meta in rows:
+        user_id, booked_at = _parse_meta(meta)
+        entries.append({
+            "price": tick_to_price(abs(score)),  # Buy scores are negative
+            "quantity": quantity,
+            "order_id": order_id,
+            "user_id": user_id,
+            "booked_at": booked_at
+        })
+    return entries
+
+
+def read_book(key: str) -> Tuple[Dict[int, Tuple[int, int]], Dict[int, str], List[str]]:
+    """Read a whole buy book without skipping anything.
+    Returns ({order_id: (tick, quantity)}, {order_id: meta}, members that could not be parsed).
+    """
+    members = redis_client.zrange(key, 0, -1, withscores=True)
+    if not members:
+        return {}, {}, []
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hmget(f"{key}:qty", [member for member, _ in members])
+    pipe.hmget(f"{key}:meta", [member for member, _ in members])
+    quantities, metas = pipe.execute()
+    
+    orders, meta_by_order, invalid = {}, {}, []
+    for (member, score), quantity, meta in zip(members, quantities, metas):
+        try:
+            orders[int(member)] = (abs(int(score)), _parse_quantity(quantity))
+            meta_by_order[int(member)] = meta or ""
+        except (ValueError, TypeError, ArithmeticError):
+            invalid.append(member)
+    return orders, meta_by_order, invalid
+
+
+def rebuild_book(key: str, orders: Dict[int, Tuple[int, int, str]], dropped_order_ids: List[int]):
+    """Replace a buy book with {order_id: (tick, quantity, meta)} in one MULTI/EXEC.
+    dropped_order_ids are removed from the order index as well.
+    The resident engine book is not touched; evict it so it reloads.
+    """
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.delete(key, f"{key}:qty", f"{key}:meta")
+    for order_id in dropped_order_ids:
+        pipe.hdel(ORDER_INDEX_KEY, str(order_id))
+    for order_id, (tick, quantity, meta) in orders.items():
+        _queue_add(pipe, key, -tick, order_id, quantity, meta)
+    market_id, outcome_name, _, _ = split_book_key(key)
+    _queue_bbo(pipe, market_id, outcome_name)
+    _store_bbo(market_id, outcome_name, pipe.execute()[-1])
+
+
+def split_book_key(key: str) -> Tuple[int, str, str, str]:
+    """(market_id, outcome_name, outcome, side) of an orderbook key (see get_orderbook_key)"""
+    _, market_id, rest = key.split(":", 2)
+    outcome_name, outcome, side = rest.rsplit(":", 2)
+    return int(market_id), outcome_name, outcome, side
+
+
+def market_book_keys(market_id: int) -> List[str]:
+    """Buy book keys that currently exist in Redis for a market"""
+    return list(redis_client.scan_iter(match=f"orderbook:{market_id}:*:buy", count=500))
+
+
+def get_engine_book(market_id: int, outcome_name: str) -> OutcomeBook:
+    """Get the resident matching book for an outcome, loading it from Redis on first use"""
+    book = engine.peek_book(market_id, outcome_name)
+    if book:
+        return book
     
-    value = f"{order_id}:{quantity}"
-    redis_client.zadd(key, {value: score})
-
-
-def remove_order_from_orderbook(market_id: int, outcome_name: str, outcome: str, side: str, order_id: int):
-    """Remove order from orderbook"""
-    key = get_orderbook_key(market_id, outcome_name, outcome, side)
-    # Find and remove the order
-    orders = redis_client.zrange(key, 0, -1)
-    for order in orders:
-        if order.startswith(f"{order_id}:"):
-            redis_client.zrem(key, order)
-            break
-
-
-def update_order_in_orderbook(market_id: int, outcome_name: str, outcome: str, side: str, order_id: int, new_quantity: Decimal):
-    """Update order quantity in orderbook"""
-    key = get_orderbook_key(market_id, outcome_name, outcome, side)
-    # Find the order and get its score (price) before removing
-    orders_with_scores = redis_client.zrange(key, 0, -1, withscores=True)
-    for order_str, score in orders_with_scores:
-        if order_str.startswith(f"{order_id}:"):
-            # Get the price from the score
-            redis_client.zrem(key, order_str)
-            # Re-add with new quantity but same price (score)
-            value = f"{order_id}:{new_quantity}"
-            redis_client.zadd(key, {value: score})
-            break
-
-
-def get_orderbook(market_id: int, outcome_name: str, outcome: str, limit: int = 20, db: Session = None) -> Dict:
-    """Get orderbook for a market outcome with order and user information"""
-    from ..models.order import Order
+    orders = {}
+    for outcome in ["yes", "no"]:
+        key = get_orderbook_key(market_id, outcome_name, outcome, "buy")
+        orders[outcome] = [(order_id, abs(score), quantity) for order_id, score, quantity, _ in _read_side(key)]
+    return engine.load_book(market_id, outcome_name, orders)
+
+
+async def get_engine_book_async(market_id: int, outcome_name: str) -> OutcomeBook:
+    """get_engine_book, loading the book on the shared asyncio Redis pool"""
+    book = engine.peek_book(market_id, outcome_name)
+    if book:
+        return book
     
+    orders = {}
+    for outcome in ["yes", "no"]:
+        key = get_orderbook_key(market_id, outcome_name, outcome, "buy")
+        orders[outcome] = [(order_id, abs(score), quantity) for order_id, score, quantity, _ in await _read_side_async(key)]
+    return engine.load_book(market_id, outcome_name, orders)
+
+
+def _parse_claims(result: list) -> List[Tuple[int, int, int, str]]:
+    """(order_id, tick, filled_quantity, meta) tuples from a MATCH_SCRIPT result"""
+    claims = []
+    for i in range(0, len(result), 4):
+        try:
+            claims.append((
+                int(result[i]),
+                int(result[i + 2]),
+                _parse_quantity(result[i + 1]),
+                result[i + 3]
+            ))
+        except (ValueError, TypeError, ArithmeticError):
+            continue  # Skip invalid entries
+    return claims
+
+
+def claim_orders(market_id: int, outcome_name: str, outcome: str, quantity: int, min_tick: int = 0, max_orders: int = 100) -> List[Tuple[int, int, int, str]]:
+    """Atomically claim up to `quantity` contracts from the buy book of `outcome`.
+    Levels are taken best first, down to min_tick (the lowest price a limit order crosses).
+    Claimed orders are already removed/reduced in Redis when this returns.
+    Returns (order_id, tick, filled_quantity, meta) tuples, best first.
+    """
+    key = get_orderbook_key(market_id, outcome_name, outcome, "buy")
+    return _parse_claims(_match_script(keys=_book_keys(key), args=[str(quantity), min_tick, max_orders]))
+
+
+async def claim_orders_async(market_id: int, outcome_name: str, outcome: str, quantity: int, min_tick: int = 0, max_orders: int = 100) -> List[Tuple[int, int, int, str]]:
+    """claim_orders on the shared asyncio Redis pool"""
+    key = get_orderbook_key(market_id, outcome_name, outcome, "buy")
+    script = get_async_redis().register_script(MATCH_SCRIPT)
+    return _parse_claims(await script(keys=_book_keys(key), args=[str(quantity), min_tick, max_orders]))
+
+
+def restore_claimed_orders(market_id: int, outcome_name: str, outcome: str, claims: List[Tuple[int, int, int, str]]):
+    """Give claimed quantity back to the book (used when the DB side of a match fails).
+    The hand-back and the top-of-book refresh run in one MULTI/EXEC.
+    """
+    if not claims:
+        return
+    key = get_orderbook_key(market_id, outcome_name, outcome, "buy")
+    args = []
+    for order_id, tick, quantity, meta in claims:
+        args.extend([_member(order_id), tick, quantity, meta])
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.eval(RESTORE_SCRIPT, 4, *_book_keys(key), *args)
+    _queue_bbo(pipe, market_id, outcome_name)
+    _store_bbo(market_id, outcome_name, pipe.execute()[-1])
+
+
+async def restore_claimed_orders_async(market_id: int, outcome_name: str, outcome: str, claims: List[Tuple[int, int, int, str]]):
+    """restore_claimed_orders on the shared asyncio Redis pool"""
+    if not claims:
+        return
+    key = get_orderbook_key(market_id, outcome_name, outcome, "buy")
+    args = []
+    for order_id, tick, quantity, meta in claims:
+        args.extend([_member(order_id), tick, quantity, meta])
+    pipe = get_async_redis().pipeline(transaction=True)
+    pipe.eval(RESTORE_SCRIPT, 4, *_book_keys(key), *args)
+    _queue_bbo(pipe, market_id, outcome_name)
+    _store_bbo(market_id, outcome_name, (await pipe.execute())[-1])
+
+
+def get_orderbook(market_id: int, outcome_name: str, outcome: str, limit: int = 20) -> Dict:
+    """Get orderbook for a market outcome with order and user information.
+    Owner and booking time come from the book's meta hash: one Redis round trip per side, no SQL.
+    """
     buy_key = get_orderbook_key(market_id, outcome_name, outcome, "buy")
     sell_key = get_orderbook_key(market_id, outcome_name, outcome, "sell")
-    
-    # Get buy orders (highest price first - already negative in score)
-    buy_orders = redis_client.zrange(buy_key, 0, limit - 1, withscores=True)
-    # Get sell orders (lowest price first)
-    sell_orders = redis_client.zrange(sell_key, 0, limit - 1, withscores=True)
-    
-    def parse_orders(orders, side):
-        result = []
-        for order_str, score in orders:
-            # Split by colon - format is "order_id:quantity"
-            parts = order_str.split(":")
-            if len(parts) != 2:
-                continue  # Skip invalid entries
-            order_id_str, quantity_str = parts
-            try:
-                order_id = int(order_id_str)
-                quantity = Decimal(quantity_str)
-            except (ValueError, TypeError):
-                continue  # Skip invalid entries
-            
-            if side == "buy":
-                price = Decimal(abs(score))  # Convert back from negative
-            else:
-                price = Decimal(score)
-            
-            # Get user_id from database if db session provided
-            user_id = None
-            if db:
-                order = db.query(Order).filter(Order.id == order_id).first()
-                if order:
-                    user_id = order.user_id
-            
-            result.append({
-                "price": price,
-                "quantity": quantity,
-                "order_id": order_id,
-                "user_id": user_id
-            })
-        return result
-    
-    buys = parse_orders(buy_orders, "buy")
-    sells = parse_orders(sell_orders, "sell")
-    
-    return {"buys": buys, "sells": sells}
+    return {
+        # Buy orders: highest price first (scores are negative ticks)
+        "buys": _format_side(_read_side(buy_key, 0, limit - 1)),
+        # Sell orders: lowest price first
+        "sells": _format_side(_read_side(sell_key, 0, limit - 1)),
+    }
+
+
+async def get_orderbook_async(market_id: int, outcome_name: str, outcome: str, limit: int = 20) -> Dict:
+    """get_orderbook on the shared asyncio Redis pool"""
+    buy_key = get_orderbook_key(market_id, outcome_name, outcome, "buy")
+    sell_key = get_orderbook_key(market_id, outcome_name, outcome, "sell")
+    return {
+        "buys": _format_side(await _read_side_async(buy_key, 0, limit - 1)),
+        "sells": _format_side(await _read_side_async(sell_key, 0, limit - 1)),
+    }
+
+
+def refresh_bbo(market_id: int, outcome_name: str) -> Tuple[int, int, int, int]:
+    """Recompute an outcome's top of book from its sorted sets (for changes made outside apply_book_updates)"""
+    yes_key = get_orderbook_key(market_id, outcome_name, "yes", "buy")
+    no_key = get_orderbook_key(market_id, outcome_name, "no", "buy")
+    _store_bbo(market_id, outcome_name, _bbo_script(
+        keys=[yes_key, f"{yes_key}:qty", no_key, f"{no_key}:qty", get_bbo_key(market_id, outcome_name)]
+    ))
+    return _bbo_cache[market_id, outcome_name]
+
+
+def _load_bbo(market_id: int, outcome_name: str) -> Tuple[int, int, int, int]:
+    """(yes_tick, yes_qty, no_tick, no_qty): cached in engine mode, otherwise from the bbo hash
+    (or the books, when the hash is missing)
+    """
+    cached = _bbo_cache.get((market_id, outcome_name)) if settings.MATCHING_MODE == "engine" else None
+    if cached is not None:
+        return cached
+    values = redis_client.hmget(get_bbo_key(market_id, outcome_name), ["yes_tick", "yes_qty", "no_tick", "no_qty"])
+    if None in values:
+        return refresh_bbo(market_id, outcome_name)
+    cached = tuple(int(value) for value in values)
+    _bbo_cache[market_id, outcome_name] = cached
+    return cached
+
+
+def get_top_of_book(market_id: int, outcome_name: str, outcome: str) -> Dict:
+    """Best bid and implied best ask for one outcome side, in O(1) from the top-of-book cache.
+    The bid is the best resting buy of `outcome`; the ask is what the opposite side's best
+    buy implies (a NO bid at p is a YES offer at 1 - p). Prices are None when nothing rests.
+    """
+    yes_tick, yes_qty, no_tick, no_qty = _load_bbo(market_id, outcome_name)
+    bid_tick, bid_qty, opposite_tick, opposite_qty = (
+        (yes_tick, yes_qty, no_tick, no_qty) if outcome == "yes" else (no_tick, no_qty, yes_tick, yes_qty)
+    )
+    return {
+        "bid": tick_to_price(bid_tick) if bid_tick >= 0 else None,
+        "bid_quantity": bid_qty,
+        "ask": tick_to_price(complement_tick(opposite_tick)) if opposite_tick >= 0 else None,
+        "ask_quantity": opposite_qty,
+    }
+
+
+def _side_depth(market_id: int, outcome_name: str, outcome: str, levels: int, min_tick: int, max_tick: int) -> List[Tuple[int, int, int]]:
+    """(tick, quantity, order count) levels of one buy book within [min_tick, max_tick], best first"""
+    if min_tick > max_tick:
+        return []
+    # The resident book keeps per-level totals, so this is O(levels). Only use one that is already
+    # loaded: this runs outside the market's sequencer, and a book loaded here could miss an
+    # order's post-commit update and stay stale for matching.
+    book = engine.peek_book(market_id, outcome_name) if settings.MATCHING_MODE == "engine" else None
+    if book:
+        return book.side(outcome).depth(levels, min_tick, max_tick)
+    key = get_orderbook_key(market_id, outcome_name, outcome, "buy")
+    flat = _depth_script(keys=[key, f"{key}:qty"], args=[min_tick, max_tick, levels])
+    return [(int(flat[i]), int(flat[i + 1]), int(flat[i + 2])) for i in range(0, len(flat), 3)]
+
+
+def _format_levels(levels: List[Tuple[int, int, int]], to_price) -> List[Dict]:
+    entries = []
+    cumulative = 0
+    for tick, quantity, orders in levels:
+        cumulative += quantity
+        entries.append({
+            "price": to_price(tick),
+            "quantity": quantity,
+            "orders": orders,
+            "cumulative_quantity": cumulative
+        })
+    return entries
+
+
+def get_depth(market_id: int, outcome_name: str, outcome: str, levels: int = 20,
+              min_price: Optional[Decimal] = None, max_price: Optional[Decimal] = None) -> Dict:
+    """Level-aggregated (L2) depth for one outcome side, best level first, with running totals.
+    Bids are the outcome's resting buys; asks are implied by the opposite side's buys at 1 - price.
+    min_price/max_price bound both sides in this outcome's prices.
+    """
+    min_tick = price_to_tick(min_price) if min_price is not None else 0
+    max_tick = price_to_tick(max_price) if max_price is not None else PRICE_SCALE
+    opposite = "no" if outcome == "yes" else "yes"
+    bids = _side_depth(market_id, outcome_name, outcome, levels, min_tick, max_tick)
+    # An ask at p is an opposite buy at 1 - p, so the band flips
+    asks = _side_depth(market_id, outcome_name, opposite, levels, complement_tick(max_tick), complement_tick(min_tick))
+    return {
+        "bids": _format_levels(bids, tick_to_price),
+        "asks": _format_levels(asks, lambda tick: tick_to_price(complement_tick(tick))),
+    }
+
+
+async def get_orderbooks_async(books: List[Tuple[int, str, str]], limit: int = 20) -> List[Dict]:
+    """get_orderbook_async for many (market_id, outcome_name, outcome) books in one pipelined round trip"""
+    pipe = get_async_redis().pipeline(transaction=False)
+    for market_id, outcome_name, outcome in books:
+        for side in ["buy", "sell"]:
+            key = get_orderbook_key(market_id, outcome_name, outcome, side)
+            pipe.eval(READ_SIDE_SCRIPT, 3, key, f"{key}:qty", f"{key}:meta", 0, limit - 1)
+    results = await pipe.execute()
+    return [
+        {"buys": _format_side(_parse_rows(buys)), "sells": _format_side(_parse_rows(sells))}
+        for buys, sells in zip(results[0::2], results[1::2])
+    ]
+
+
+def get_best_tick(market_id: int, outcome_name: str, outcome: str, side: str) -> Optional[int]:
+    """Get best available price for a side, in ticks, from the top-of-book cache.
+    "buy" is the best resting buy of the outcome; "sell" is the implied best offer
+    (the complement of the opposite side's best buy).
+    """
+    yes_tick, _, no_tick, _ = _load_bbo(market_id, outcome_name)
+    own_tick, opposite_tick = (yes_tick, no_tick) if outcome == "yes" else (no_tick, yes_tick)
+    if side == "buy":
+        return own_tick if own_tick >= 0 else None
+    return complement_tick(opposite_tick) if opposite_tick >= 0 else None
 
 
 def get_best_price(market_id: int, outcome_name: str, outcome: str, side: str) -> Decimal:
     """Get best available price for a side"""
-    key = get_orderbook_key(market_id, outcome_name, outcome, side)
-    if side == "buy":
-        # Highest buy price (first in sorted set with negative scores)
-        orders = redis_client.zrange(key, 0, 0, withscores=True)
-    else:
-        # Lowest sell price (first in sorted set)
-        orders = redis_client.zrange(key, 0, 0, withscores=True)
+    tick = get_best_tick(market_id, outcome_name, outcome, side)
+    return tick_to_price(tick) if tick is not None else None
+
+
+def recover_books_from_journal() -> int:
+    """Open the order journal and put back any journaled book that Redis has lost.
+    Books Redis still holds are left alone (Redis is written before the journal, so it is
+    never behind). On first use the journal is seeded from what Redis currently holds.
+    Returns the number of orders restored to Redis.
+    """
+    resting = journal.open()
+    if not resting and journal.seq == 0:
+        for key in set(redis_client.hvals(ORDER_INDEX_KEY)):
+            market_id, outcome_name, outcome, side = split_book_key(key)
+            if side != "buy":
+                continue
+            for order_id, score, quantity, meta in _read_side(key):
+                user_id = meta.split(":")[0]
+                journal.record(ACCEPT, market_id, outcome_name, outcome, order_id,
+                               int(user_id) if user_id else None, abs(score), quantity)
+        journal.snapshot()
+        return 0
     
-    if not orders:
-        return None
+    books: Dict[str, List[Tuple[int, int, int, int]]] = {}
+    for order_id, (market_id, outcome_name, outcome, user_id, tick, quantity) in resting.items():
+        key = get_orderbook_key(market_id, outcome_name, outcome, "buy")
+        books.setdefault(key, []).append((order_id, user_id, tick, quantity))
     
-    _, score = orders[0]
-    if side == "buy":
-        return Decimal(abs(score))
-    else:
-        return Decimal(score)
+    pipe = redis_client.pipeline(transaction=False)
+    for key in books:
+        pipe.exists(key)
+    missing = [key for key, exists in zip(books, pipe.execute()) if not exists]
+    
+    restored = 0
+    pipe = redis_client.pipeline()
+    for key in missing:
+        for order_id, user_id, tick, quantity in books[key]:
+            # The original booking time is not journaled; priority comes from the order id anyway
+            _queue_add(pipe, key, -tick, order_id, quantity, f"{user_id or ''}:{int(time.time() * 1000)}")
+            restored += 1
+    for market_id, outcome_name in {split_book_key(key)[:2] for key in missing}:
+        _queue_bbo(pipe, market_id, outcome_name)
+    pipe.execute()
+    return restored
 
@@ -5,11 +5,12 @@ from ..models.position import Position
 from ..models.market import Market, MarketStatus
 
 
-def update_position(db: Session, user_id: int, market_id: int, outcome_name: str, outcome: str, quantity_delta: Decimal, price: Decimal):
+def update_position(db: Session, user_id: int, market_id: int, outcome_name: str, outcome: str, quantity_delta: Decimal, price: Decimal, commit: bool = True):
     """
     Update user position after a trade.
     NEW MODEL: All positions are positive (buy-only model).
     quantity_delta is always positive (we're always buying).
+    commit=False leaves the change in the caller's transaction (e.g. trade execution).
     """
     position = db.query(Position).filter(
         Position.user_id == user_id,
@@ -53,7 +54,8 @@ def update_position(db: Session, user_id: int, market_id: int, outcome_name: str
         
         position.quantity = new_quantity
     
-    db.commit()
+    if commit:
+        db.commit()
     return position
 
 
@@ -146,7 +148,7 @@ def calculate_position_value(db: Session, position: Position) -> dict:
         # Market is active - calculate current value based on market price
         # IMPORTANT: Use the same price for both long and short positions to avoid double-counting
         # Use last traded price if available, otherwise calculate mid-price from orderbook
-        from .orderbook import get_best_price
+        from .orderbook import get_top_of_book
         from ..models.trade import Trade
         from sqlalchemy import desc
         
@@ -161,9 +163,10 @@ def calculate_position_value(db: Session, position: Position) -> dict:
             # Use last traded price for both sides (ensures positions cancel out)
             market_price = last_trade.price
         else:
-            # Fallback: calculate mid-price from orderbook
-            best_buy = get_best_price(position.market_id, position.outcome_name, position.outcome, "buy")
-            best_sell = get_best_price(position.market_id, position.outcome_name, position.outcome, "sell")
+            # Fallback: calculate mid-price from the cached top of book (best bid, implied best ask)
+            top = get_top_of_book(position.market_id, position.outcome_name, position.outcome)
+            best_buy = top["bid"]
+            best_sell = top["ask"]
             
             if best_buy and best_sell:
                 # Mid-price
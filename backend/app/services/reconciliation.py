@@ -0,0 +1,160 @@
+"""
+Reconcile the Redis orderbooks of a market with the orders table.
+
+Postgres is the source of truth: every PENDING / PARTIALLY_FILLED limit order
+should rest in its book with its remaining quantity, and nothing else should.
+reconcile_market streams the market's open orders book by book (server-side
+cursor ordered by book, so only the book being checked is held in memory),
+compares each with what Redis holds as soon as its rows are read and reports
+the differences in both directions. With repair=True each book that differs is
+rewritten from the database in one MULTI/EXEC pipeline, open market orders are
+cancelled, and the resident engine books are dropped so they reload from the
+repaired Redis books. Open orders that cannot be booked as they are (legacy
+rows with fractional contracts or off-grid prices) are reported and left alone.
+
+Run it on the market's sequencer (see the /markets/{id}/reconcile route) so it
+cannot interleave with order entry on that market; other markets carry on.
+That only holds within one process: in "lua" mode other workers keep matching
+against the shared Redis books, and a rebuild could drop an order one of them
+just rested or hand back quantity one of them just claimed. There, repair is
+refused and reconciliation only reports.
+"""
+import time
+from dataclasses import dataclass, field
+from itertools import groupby
+from typing import Dict, Iterator, List, Set, Tuple
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from ..models.order import Order, OrderStatus, OrderType
+from ..core.config import settings
+from ..core.fixedpoint import price_to_tick, to_contracts
+from .orderbook import get_orderbook_key, read_book, rebuild_book, market_book_keys, split_book_key
+from .matching_engine import engine
+from .journal import journal, ACCEPT, CANCEL
+
+OPEN_STATUSES = [OrderStatus.PENDING, OrderStatus.PARTIALLY_FILLED]
+
+
+@dataclass
+class ReconciliationReport:
+    market_id: int
+    orders_checked: int = 0
+    # Open in Postgres but not resting in Redis
+    missing_from_book: List[int] = field(default_factory=list)
+    # Resting in Redis but not open in Postgres, or not a valid entry at all
+    orphaned_in_book: List[str] = field(default_factory=list)
+    # Resting with a different remaining quantity or price
+    mismatched: List[int] = field(default_factory=list)
+    # Market orders left open (they never rest, so they should have been cancelled)
+    open_market_orders: List[int] = field(default_factory=list)
+    # Open, but with a price or remaining quantity that cannot be booked (needs a manual fix)
+    unbookable_orders: List[int] = field(default_factory=list)
+    repaired: bool = False
+
+    @property
+    def in_sync(self) -> bool:
+        return not (self.missing_from_book or self.orphaned_in_book or self.mismatched
+                    or self.open_market_orders or self.unbookable_orders)
+
+
+def _stream_books(db: Session, market_id: int, report: ReconciliationReport, batch_size: int) -> Iterator[Tuple[str, Dict[int, Tuple[int, int, int]], Set[int]]]:
+    """Stream the market's open orders one book at a time.
+    Yields (book key, {order_id: (tick, quantity, user_id)}, ids of unbookable orders) as each
+    book's rows finish; market orders and unbookable rows are recorded in the report.
+    """
+    rows = db.query(
+        Order.id, Order.outcome_name, Order.outcome, Order.price,
+        Order.quantity, Order.filled_quantity, Order.user_id, Order.order_type
+    ).filter(
+        Order.market_id == market_id,
+        Order.status.in_(OPEN_STATUSES)
+    ).order_by(Order.outcome_name, Order.outcome, Order.id).execution_options(yield_per=batch_size)
+    
+    for (outcome_name, outcome), book_rows in groupby(rows, key=lambda row: (row.outcome_name, row.outcome)):
+        wanted: Dict[int, Tuple[int, int, int]] = {}
+        unbookable: Set[int] = set()
+        for order_id, _, _, price, quantity, filled_quantity, user_id, order_type in book_rows:
+            report.orders_checked += 1
+            if order_type == OrderType.MARKET:
+                report.open_market_orders.append(order_id)
+                continue
+            try:
+                wanted[order_id] = (price_to_tick(price), to_contracts(quantity - filled_quantity), user_id)
+            except ValueError:
+                report.unbookable_orders.append(order_id)
+                unbookable.add(order_id)
+        yield get_orderbook_key(market_id, outcome_name, outcome, "buy"), wanted, unbookable
+
+
+def reconcile_market(db: Session, market_id: int, repair: bool = False, batch_size: int = 1000) -> ReconciliationReport:
+    """Compare (and with repair=True, rebuild) every orderbook of one market against Postgres.
+    Raises ValueError for repair=True in "lua" mode (see the module docstring).
+    """
+    if repair and settings.MATCHING_MODE == "lua":
+        raise ValueError("Repair is not available in lua matching mode: other workers share the books")
+    report = ReconciliationReport(market_id=market_id)
+    keys = []
+    for key, wanted, unbookable in _stream_books(db, market_id, report, batch_size):
+        _reconcile_book(report, key, wanted, unbookable, repair)
+        keys.append(key)
+    # Books still in Redis with no open orders at all
+    for key in sorted(set(market_book_keys(market_id)) - set(keys)):
+        _reconcile_book(report, key, {}, set(), repair)
+        keys.append(key)
+    
+    if repair:
+        if report.open_market_orders:
+            # Market orders are immediate-or-cancel: whatever did not fill is cancelled
+            db.execute(
+                update(Order).where(
+                    Order.id.in_(report.open_market_orders),
+                    Order.status.in_(OPEN_STATUSES)
+                ).values(status=OrderStatus.CANCELLED),
+                execution_options={"synchronize_session": False}
+            )
+            db.commit()
+        # Resident books reload from the repaired Redis books on next use
+        for key in keys:
+            engine.evict(market_id, split_book_key(key)[1])
+        report.repaired = True
+    
+    return report
+
+
+def _reconcile_book(report: ReconciliationReport, key: str, wanted: Dict[int, Tuple[int, int, int]], unbookable: Set[int], repair: bool):
+    """Compare one book with its open orders, report the differences and rebuild it if asked"""
+    resting, meta_by_order, invalid = read_book(key)
+    
+    missing = [order_id for order_id in wanted if order_id not in resting]
+    orphans = [order_id for order_id in resting if order_id not in wanted and order_id not in unbookable]
+    mismatched = [
+        order_id for order_id, (tick, quantity, _) in wanted.items()
+        if order_id in resting and resting[order_id] != (tick, quantity)
+    ]
+    report.missing_from_book.extend(missing)
+    report.orphaned_in_book.extend([str(order_id) for order_id in orphans] + invalid)
+    report.mismatched.extend(mismatched)
+    
+    if repair and (missing or orphans or mismatched or invalid):
+        now_ms = int(time.time() * 1000)
+        orders = {
+            # Keep the original booking time where Redis still has it
+            order_id: (tick, quantity, meta_by_order.get(order_id) or f"{user_id}:{now_ms}")
+            for order_id, (tick, quantity, user_id) in wanted.items()
+        }
+        # Unbookable orders keep whatever Redis has for them until they are fixed by hand
+        for order_id in unbookable:
+            if order_id in resting:
+                orders[order_id] = resting[order_id] + (meta_by_order[order_id],)
+        rebuild_book(key, orders, orphans)
+        _journal_repair(key, wanted, missing + mismatched, orphans)
+
+
+def _journal_repair(key: str, wanted: Dict[int, Tuple[int, int, int]], rebooked: List[int], orphans: List[int]):
+    """Record a rebuild in the order journal so a replay ends up with the same book"""
+    market_id, outcome_name, outcome, _ = split_book_key(key)
+    for order_id in orphans:
+        journal.record(CANCEL, market_id, outcome_name, outcome, order_id)
+    for order_id in rebooked:
+        tick, quantity, user_id = wanted[order_id]
+        journal.record(ACCEPT, market_id, outcome_name, outcome, order_id, user_id, tick, quantity)
@@ -0,0 +1,115 @@
+"""
+Per-market single-writer order sequencer.
+
+Every order-entry operation for a market (place, cancel, ...) is queued on that
+market's asyncio queue and executed by one worker task, strictly in arrival
+order. Different markets have different workers and run in parallel. The
+synchronous order-entry functions run in a worker thread so they never block
+the event loop; callers just await the result.
+
+When several requests for the same market are waiting, the worker drains them
+as one burst and runs the whole burst in a single thread hop.
+"""
+import asyncio
+import inspect
+from typing import Any, Callable, Dict, List, Tuple
+
+
+class OrderSequencer:
+    def __init__(self, idle_timeout: float = 30.0, max_burst: int = 64):
+        # Workers exit after idle_timeout seconds without work and are recreated on demand
+        self.idle_timeout = idle_timeout
+        self.max_burst = max_burst
+        self.queues: Dict[int, asyncio.Queue] = {}
+        self.workers: Dict[int, asyncio.Task] = {}
+
+    async def submit(self, market_id: int, func: Callable, *args, **kwargs) -> Any:
+        """Run func(*args, **kwargs) after all work already queued for this market.
+        func may be a plain function (run in a thread) or a coroutine function.
+        Exceptions raised by func are re-raised to the caller.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        queue = self.queues.get(market_id)
+        if queue is None:
+            queue = asyncio.Queue()
+            self.queues[market_id] = queue
+        queue.put_nowait((func, args, kwargs, future))
+        worker = self.workers.get(market_id)
+        if worker is None or worker.done():
+            self.workers[market_id] = asyncio.create_task(self._worker(market_id, queue))
+        return await future
+
+    async def _worker(self, market_id: int, queue: asyncio.Queue):
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=self.idle_timeout)
+            except asyncio.TimeoutError:
+                if queue.empty():
+                    # Nothing arrived while idle; no await between here and return, so no race with submit
+                    self.queues.pop(market_id, None)
+                    self.workers.pop(market_id, None)
+                    return
+                continue
+
+            burst = [item]
+            while len(burst) < self.max_burst and not queue.empty():
+                burst.append(queue.get_nowait())
+
+            # Work whose caller has gone away is dropped
+            burst = [entry for entry in burst if not entry[3].cancelled()]
+            index = 0
+            while index < len(burst):
+                if inspect.iscoroutinefunction(burst[index][0]):
+                    await self._run_async(burst[index])
+                    index += 1
+                    continue
+                # Consecutive sync calls share one thread hop
+                end = index
+                while end < len(burst) and not inspect.iscoroutinefunction(burst[end][0]):
+                    end += 1
+                group = burst[index:end]
+                results = await asyncio.to_thread(self._run_burst, group)
+                for (_, _, _, future), (ok, value) in zip(group, results):
+                    if future.cancelled():
+                        continue
+                    if ok:
+                        future.set_result(value)
+                    else:
+                        future.set_exception(value)
+                index = end
+
+    @staticmethod
+    async def _run_async(entry: Tuple):
+        func, args, kwargs, future = entry
+        try:
+            result = await func(*args, **kwargs)
+        except Exception as e:
+            if not future.cancelled():
+                future.set_exception(e)
+        else:
+            if not future.cancelled():
+                future.set_result(result)
+
+    @staticmethod
+    def _run_burst(burst: List[Tuple]) -> List[Tuple[bool, Any]]:
+        """Run a burst of sync calls in order (in a worker thread)"""
+        results = []
+        for func, args, kwargs, _ in burst:
+            try:
+                results.append((True, func(*args, **kwargs)))
+            except Exception as e:
+                results.append((False, e))
+        return results
+
+    async def shutdown(self):
+        """Cancel all workers (called on app shutdown)"""
+        workers = list(self.workers.values())
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        self.workers.clear()
+        self.queues.clear()
+
+
+sequencer = OrderSequencer()
@@ -3,18 +3,20 @@ from decimal import Decimal
 from ..models.user import User
 
 
-def update_token_balance(db: Session, user_id: int, amount: Decimal):
+def update_token_balance(db: Session, user_id: int, amount: Decimal, commit: bool = True):
     """Update user's token balance
     Note: token_balance is Numeric(20, 2) which rounds to 2 decimal places.
     We round the amount to avoid precision issues.
+    commit=False leaves the change in the caller's transaction (e.g. trade execution).
     """
     user = db.query(User).filter(User.id == user_id).first()
     if user:
         # Round to 2 decimal places to match database precision
         rounded_amount = round(amount, 2)
         user.token_balance += rounded_amount
-        db.commit()
-        db.refresh(user)
+        if commit:
+            db.commit()
+            db.refresh(user)
         return user.token_balance
     return None
 
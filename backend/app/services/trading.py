@@ -1,32 +1,290 @@
+from datetime import datetime, timezone
+from sqlalchemy import update
 from sqlalchemy.orm import Session
-from decimal import Decimal
-from typing import Optional, List, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional, List, Tuple, Dict
 from ..models.order import Order, OrderStatus, OrderSide
 from ..models.trade import Trade
 from ..models.market import Market, MarketStatus
 from ..models.position import Position
 from .orderbook import (
-    add_order_to_orderbook, remove_order_from_orderbook,
-    update_order_in_orderbook, get_best_price, get_orderbook_key
+    apply_book_updates, apply_book_updates_async, remove_orders_from_orderbook, get_engine_book,
+    get_engine_book_async, get_best_tick, claim_orders, claim_orders_async, restore_claimed_orders,
+    restore_claimed_orders_async
 )
+from .matching_engine import engine
 from .token import update_token_balance, has_sufficient_balance
 from .positions import update_position
-import redis
 from ..core.config import settings
-
-redis_client = redis.Redis(
-    host=settings.REDIS_HOST,
-    port=settings.REDIS_PORT,
-    db=settings.REDIS_DB,
-    decode_responses=True
+from ..core.fixedpoint import (
+    price_to_tick, tick_to_price, complement_tick, to_contracts, trade_cost_cents, cents_to_amount, CENTS_PER_UNIT
 )
 
 
-def match_order(db: Session, order: Order) -> List[Trade]:
+def _take_batch(resting_orders, quantity: int) -> List[Tuple[int, int, int]]:
+    """Pull resting orders (best first) until their combined quantity covers `quantity`"""
+    batch = []
+    covered = 0
+    for resting in resting_orders:
+        batch.append((resting.order_id, resting.tick, resting.quantity))
+        covered += resting.quantity
+        if covered >= quantity:
+            break
+    return batch
+
+
+def _load_counterparties(db: Session, order_ids: List[int]) -> Dict[int, Order]:
+    """Load and lock a batch of resting orders in one query.
+    In engine mode rows another transaction is already matching against are skipped rather
+    than waited on. In Lua mode the batch was claimed in Redis, so no one else can be filling
+    it and every row is waited on: skipping one would lose the quantity already taken off the book.
+    """
+    rows = db.query(Order).filter(
+        Order.id.in_(order_ids)
+    ).with_for_update(skip_locked=settings.MATCHING_MODE != "lua").populate_existing().all()
+    return {row.id: row for row in rows}
+
+
+def _fill_candidates(db: Session, order: Order, opposite_outcome: str, next_batch, remaining_quantity: int, book_updates: list) -> Tuple[List[Trade], int]:
+    """Execute trades against the book in priority order.
+    Quantities are whole contracts, prices ticks and costs cents (see core.fixedpoint).
+    next_batch(quantity) returns the next (order_id, tick, quantity) candidates that could
+    cover `quantity`, or an empty list when the book has nothing more to offer.
+    Counterparty book changes are appended to book_updates (not applied).
+    """
+    trades = []
+    while remaining_quantity > 0:
+        batch = next_batch(remaining_quantity)
+        if not batch:
+            break
+        
+        # One query for the whole batch instead of one per resting order
+        opposite_orders = _load_counterparties(db, [candidate[0] for candidate in batch])
+        
+        for candidate in batch:
+            if remaining_quantity <= 0:
+                break
+            opposite_order_id, opposite_tick, opposite_quantity = candidate[:3]
+            
+            # Calculate implied price for the order's outcome
+            # If opposite is NO at price p, then YES is at price (1-p)
+            # If opposite is YES at price p, then NO is at price (1-p)
+            implied_tick = complement_tick(opposite_tick)
+            
+            opposite_order = opposite_orders.get(opposite_order_id)
+            if not opposite_order or opposite_order.status not in [OrderStatus.PENDING, OrderStatus.PARTIALLY_FILLED]:
+                continue
+            
+            # Validate opposite order matches expected outcome and outcome_name
+            if (opposite_order.outcome_name != order.outcome_name or 
+                opposite_order.outcome != opposite_outcome or
+                opposite_order.side != OrderSide.BUY):
+                continue  # Skip if mismatch
+            
+            # Execute trade, never for more than the counterparty still has open (the book
+            # can drift from the orders table, see services.reconciliation)
+            open_quantity = to_contracts(opposite_order.quantity - opposite_order.filled_quantity)
+            trade_quantity = min(remaining_quantity, opposite_quantity, open_quantity)
+            if trade_quantity <= 0:
+                continue
+            
+            # Trade price: the resting order's price, seen from the incoming order's outcome
+            # If the resting order is "Buy NO at q", the incoming YES order trades at 1 - q,
+            # which is at or better than its own limit (price improvement goes to the taker)
+            trade_price = tick_to_price(implied_tick)
+            
+            # Create trade record
+            # In the new model: one user buys YES, the other buys NO (both are buyers)
+            # For Trade model, we need buyer_id and seller_id, but conceptually:
+            # - order.user_id is buying their outcome (YES or NO)
+            # - opposite_order.user_id is buying the opposite outcome
+            buyer_id = order.user_id  # Buying their outcome
+            seller_id = opposite_order.user_id  # Buying opposite outcome (receives tokens conceptually)
+            
+            trade = Trade(
+                market_id=order.market_id,
+                buyer_id=buyer_id,
+                seller_id=seller_id,
+                outcome_name=order.outcome_name,
+                outcome=order.outcome,  # The outcome being traded
+                price=trade_price,
+                quantity=trade_quantity
+            )
+            db.add(trade)
+            trades.append(trade)
+            
+            # Update token balances
+            # Order user pays: trade_price * quantity (for their outcome)
+            # Opposite order user pays: (1 - trade_price) * quantity (for their outcome)
+            # Both pay for their respective outcomes
+            
+            # Order user pays for their outcome, in whole cents (balances have 2 decimal places)
+            order_user_cents = trade_cost_cents(implied_tick, trade_quantity)
+            update_token_balance(db, buyer_id, -cents_to_amount(order_user_cents), commit=False)
+            
+            # Opposite order user pays for their outcome (1 - price)
+            opposite_price_actual = tick_to_price(opposite_tick)
+            # The opposite cost is whatever is left of the 1.0 payout per contract,
+            # so cash is conserved exactly: p*q + (1-p)*q = q
+            opposite_user_cents = trade_quantity * CENTS_PER_UNIT - order_user_cents
+            update_token_balance(db, seller_id, -cents_to_amount(opposite_user_cents), commit=False)
+            
+            # Update positions
+            # Check if users have opposite positions that should be closed
+            # Order user: check if they have opposite outcome position
+            opposite_position = db.query(Position).filter(
+                Position.user_id == buyer_id,
+                Position.market_id == order.market_id,
+                Position.outcome_name == order.outcome_name,
+                Position.outcome == opposite_outcome
+            ).first()
+            
+            if opposite_position and opposite_position.quantity > 0:
+                # User has opposite position, reduce it (closing position)
+                close_amount = min(trade_quantity, opposite_position.quantity)
+                # Calculate cost per unit before modifying quantity
+                cost_per_unit = opposite_position.total_cost / opposite_position.quantity
+                opposite_position.quantity -= close_amount
+                # Adjust cost basis proportionally
+                opposite_position.total_cost -= close_amount * cost_per_unit
+                if opposite_position.quantity <= 0:
+                    db.delete(opposite_position)
+                else:
+                    # Update average price
+                    if opposite_position.quantity > 0:
+                        opposite_position.average_price = opposite_position.total_cost / opposite_position.quantity
+            
+                # Always create/update position for the outcome being bought
+                # Even if we fully closed the opposite position, we still bought this outcome
+                update_position(db, buyer_id, order.market_id, order.outcome_name, order.outcome, trade_quantity, trade_price, commit=False)
+            else:
+                # No opposite position, just add to same outcome
+                update_position(db, buyer_id, order.market_id, order.outcome_name, order.outcome, trade_quantity, trade_price, commit=False)
+            
+            # Opposite order user: check if they have opposite outcome position
+            opposite_position_other = db.query(Position).filter(
+                Position.user_id == seller_id,
+                Position.market_id == order.market_id,
+                Position.outcome_name == order.outcome_name,
+                Position.outcome == order.outcome  # Opposite of their order's outcome
+            ).first()
+            
+            if opposite_position_other and opposite_position_other.quantity > 0:
+                # User has opposite position, reduce it (closing position)
+                close_amount = min(trade_quantity, opposite_position_other.quantity)
+                # Calculate cost per unit before modifying quantity
+                cost_per_unit = opposite_position_other.total_cost / opposite_position_other.quantity
+                opposite_position_other.quantity -= close_amount
+                # Adjust cost basis proportionally
+                opposite_position_other.total_cost -= close_amount * cost_per_unit
+                if opposite_position_other.quantity <= 0:
+                    db.delete(opposite_position_other)
+                else:
+                    # Update average price
+                    if opposite_position_other.quantity > 0:
+                        opposite_position_other.average_price = opposite_position_other.total_cost / opposite_position_other.quantity
+                remaining_to_add = trade_quantity - close_amount
+                if remaining_to_add > 0:
+                    # Add remaining quantity to same outcome position
+                    update_position(db, seller_id, order.market_id, order.outcome_name, opposite_outcome, remaining_to_add, opposite_price_actual, commit=False)
+            else:
+                # No opposite position, just add to same outcome
+                update_position(db, seller_id, order.market_id, order.outcome_name, opposite_outcome, trade_quantity, opposite_price_actual, commit=False)
+            
+            # Update order quantities
+            order.filled_quantity += trade_quantity
+            opposite_order.filled_quantity += trade_quantity
+            
+            # Update or remove opposite order (Lua mode has already done this in Redis)
+            if opposite_order.filled_quantity >= opposite_order.quantity:
+                opposite_order.status = OrderStatus.FILLED
+            else:
+                opposite_order.status = OrderStatus.PARTIALLY_FILLED
+            if settings.MATCHING_MODE != "lua":
+                # Remaining quantity 0 takes a fully filled order off the book
+                book_updates.append(_book_update("update", opposite_order))
+            
+            remaining_quantity -= trade_quantity
+            
+            # Flush so positions created by this fill are visible to the next one
+            db.flush()
+    
+    return trades, remaining_quantity
+
+
+def _book_update(action: str, order: Order) -> tuple:
+    """Capture a deferred orderbook change for an order.
+    Values are copied now because committed ORM objects would reload on attribute access.
+    """
+    # All orders are on the "buy" side of their outcome
+    return (action, (
+        order.market_id, order.outcome_name, order.outcome, order.id,
+        order.price, to_contracts(order.quantity - order.filled_quantity), order.user_id
+    ))
+
+
+def _discard_book_updates(book_updates: list):
+    """Undo the book side effects of a failed transaction.
+    Deferred updates are simply dropped; quantity already claimed by the Lua script goes back.
+    """
+    for action, payload in book_updates:
+        if action == "claim":
+            restore_claimed_orders(*payload)
+
+
+async def _discard_book_updates_async(book_updates: list):
+    """_discard_book_updates on the shared asyncio Redis pool"""
+    for action, payload in book_updates:
+        if action == "claim":
+            await restore_claimed_orders_async(*payload)
+
+
+def _claimed_ahead(book_updates: list) -> Optional[list]:
+    """Claim batches made for an order before its transaction (see _prepare_order_async), best
+    first and ending in an empty batch if the book ran out. None if the order was not claimed ahead.
+    """
+    batches = [payload[3] for action, payload in book_updates if action == "claim"]
+    return batches or None
+
+
+async def _prepare_order_async(order: Order) -> list:
+    """Do an order's Redis reads on the shared asyncio Redis pool, before its transaction runs
+    (in db.run_sync, on the event loop thread, where a blocking Redis call would stall every request).
+    Engine mode loads the resident book; the market's sequencer keeps anything else from touching
+    it until the order is done. Lua mode claims the fills and returns them as "claim" book updates,
+    to pass on as the order's book_updates: match_order takes them first, and discarding the
+    updates hands them back if the order is rejected.
+    """
+    if settings.MATCHING_MODE != "lua":
+        await get_engine_book_async(order.market_id, order.outcome_name)
+        return []
+    
+    opposite_outcome = "no" if order.outcome == "yes" else "yes"
+    min_tick = complement_tick(price_to_tick(order.price)) if order.order_type.value == "limit" else 0
+    book_updates = []
+    # Not flushed yet, so column defaults are still unset
+    remaining_quantity = to_contracts(order.quantity - (order.filled_quantity or 0))
+    while remaining_quantity > 0:
+        batch = await claim_orders_async(order.market_id, order.outcome_name, opposite_outcome, remaining_quantity, min_tick)
+        book_updates.append(("claim", (order.market_id, order.outcome_name, opposite_outcome, batch)))
+        if not batch:
+            break
+        remaining_quantity -= sum(quantity for _, _, quantity, _ in batch)
+    return book_updates
+
+
+def match_order(db: Session, order: Order, book_updates: Optional[list] = None) -> List[Trade]:
     """
     Match an order against the orderbook and execute trades.
     NEW MODEL: All orders are BUY orders. "Buy YES" matches against "Buy NO" with price constraint.
-    Price constraint: if YES is at price p, NO must be at price (1-p).
+    Price constraint: a YES limit at p crosses every NO order at (1-p) or higher (i.e. YES at p
+    or cheaper), best level first, and each fill executes at the resting order's price.
+    Market orders sweep the opposite side from the best level down.
+    
+    Unit of work: when book_updates is given, nothing is committed; the trades, balance and
+    position changes are only flushed and the orderbook changes are appended to book_updates
+    for the caller to apply after its commit (see place_order). Without it the match is
+    committed and applied here.
     """
     if order.status != OrderStatus.PENDING:
         return []
@@ -35,195 +293,66 @@ def match_order(db: Session, order: Order) -> List[Trade]:
     if order.side != OrderSide.BUY:
         return []  # Should not happen, but safety check
     
-    trades = []
-    remaining_quantity = order.quantity - order.filled_quantity
+    if book_updates is None:
+        book_updates = []
+        try:
+            trades = match_order(db, order, book_updates)
+            db.commit()
+        except Exception:
+            db.rollback()
+            _discard_book_updates(book_updates)
+            raise
+        apply_book_updates(book_updates)
+        return trades
+    
+    remaining_quantity = to_contracts(order.quantity - order.filled_quantity)
     
     # Determine opposite outcome (YES matches NO, NO matches YES)
     opposite_outcome = "no" if order.outcome == "yes" else "yes"
     
-    # Get the opposite outcome's orderbook (all orders are "buy" in new model)
-    opposite_key = get_orderbook_key(order.market_id, order.outcome_name, opposite_outcome, "buy")
+    # Lowest opposite level a limit order crosses: YES at price p takes NO at (1-p) or higher,
+    # and vice versa. Walking stops at the first level below it.
+    min_tick = complement_tick(price_to_tick(order.price)) if order.order_type.value == "limit" else 0
     
-    # Get matching orders from opposite outcome's orderbook
-    # All orders are "buy" orders, stored with negative scores (highest price first)
-    matching_orders = redis_client.zrange(opposite_key, 0, -1, withscores=True)
-    
-    for order_str, score in matching_orders:
-        if remaining_quantity <= 0:
-            break
-        
-        # Split by colon - format is "order_id:quantity"
-        parts = order_str.split(":")
-        if len(parts) != 2:
-            continue  # Skip invalid entries
-        order_id_str, quantity_str = parts
-        try:
-            opposite_order_id = int(order_id_str)
-            opposite_quantity = Decimal(quantity_str)
-        except (ValueError, TypeError):
-            continue  # Skip invalid entries
-        
-        # Get price from score (buy orders use negative scores, so convert back)
-        opposite_price = Decimal(abs(score))
-        
-        # Calculate implied price for the order's outcome
-        # If opposite is NO at price p, then YES is at price (1-p)
-        # If opposite is YES at price p, then NO is at price (1-p)
-        implied_price = Decimal("1.0") - opposite_price
-        
-        # For limit orders: validate price constraint
-        if order.order_type.value == "limit":
-            # For YES orders: order.price should match (1 - opposite_price)
-            # For NO orders: order.price should match (1 - opposite_price)
-            # Allow small tolerance for floating point precision
-            price_tolerance = Decimal("0.0001")
-            if abs(order.price - implied_price) > price_tolerance:
-                continue  # Price doesn't match constraint, skip this order
-        
-        # Get opposite order from database
-        opposite_order = db.query(Order).filter(Order.id == opposite_order_id).first()
-        if not opposite_order or opposite_order.status != OrderStatus.PENDING:
-            continue
-        
-        # Validate opposite order matches expected outcome and outcome_name
-        if (opposite_order.outcome_name != order.outcome_name or 
-            opposite_order.outcome != opposite_outcome or
-            opposite_order.side != OrderSide.BUY):
-            continue  # Skip if mismatch
-        
-        # Execute trade
-        trade_quantity = min(remaining_quantity, opposite_quantity)
+    if settings.MATCHING_MODE == "lua":
+        # Redis claims the fills atomically; the book is already updated for them,
+        # so only remember the claims in case the transaction fails.
+        # Fills claimed ahead are taken first. Unless the book ran out, more is claimed here
+        # when they fall short (a claimed order the orders table no longer has open)
+        claimed = list(_claimed_ahead(book_updates) or [])
+        book_exhausted = bool(claimed) and not claimed[-1]
         
-        # Trade price: use the price from the order's outcome perspective
-        # If order is "Buy YES at implied_price", trade executes at implied_price
-        # The opposite order is "Buy NO at opposite_price", where implied_price + opposite_price = 1
-        trade_price = implied_price  # Use the price from the incoming order's perspective
+        def next_batch(quantity):
+            while claimed:
+                batch = claimed.pop(0)
+                if batch:
+                    return batch
+            if book_exhausted:
+                return []
+            batch = claim_orders(order.market_id, order.outcome_name, opposite_outcome, quantity, min_tick)
+            if batch:
+                book_updates.append(("claim", (order.market_id, order.outcome_name, opposite_outcome, batch)))
+            return batch
+    else:
+        # Candidates come from the resident book for this outcome (all orders are "buy" in new model),
+        # best price first and FIFO within a price level
+        book = get_engine_book(order.market_id, order.outcome_name)
+        resting_orders = book.side(opposite_outcome).iter_orders(min_tick=min_tick)
         
-        # Create trade record
-        # In the new model: one user buys YES, the other buys NO (both are buyers)
-        # For Trade model, we need buyer_id and seller_id, but conceptually:
-        # - order.user_id is buying their outcome (YES or NO)
-        # - opposite_order.user_id is buying the opposite outcome
-        buyer_id = order.user_id  # Buying their outcome
-        seller_id = opposite_order.user_id  # Buying opposite outcome (receives tokens conceptually)
-        
-        trade = Trade(
-            market_id=order.market_id,
-            buyer_id=buyer_id,
-            seller_id=seller_id,
-            outcome_name=order.outcome_name,
-            outcome=order.outcome,  # The outcome being traded
-            price=trade_price,
-            quantity=trade_quantity
-        )
-        db.add(trade)
-        trades.append(trade)
-        
-        # Update token balances
-        # Order user pays: trade_price * quantity (for their outcome)
-        # Opposite order user pays: (1 - trade_price) * quantity (for their outcome)
-        # Both pay for their respective outcomes
-        
-        # Order user pays for their outcome
-        # Round to avoid precision issues (database uses 2 decimal places)
-        order_user_cost = Decimal(str(round(float(trade_price * trade_quantity), 2)))
-        update_token_balance(db, buyer_id, -order_user_cost)
-        
-        # Opposite order user pays for their outcome (1 - price)
-        opposite_price_actual = Decimal("1.0") - trade_price
-        # Calculate opposite cost and ensure total equals exactly trade_quantity
-        # This ensures cash conservation: p*q + (1-p)*q = q exactly
-        opposite_user_cost = Decimal(str(round(float(trade_quantity), 2))) - order_user_cost
-        # Ensure it's positive and rounded to 2 decimal places
-        opposite_user_cost = Decimal(str(round(float(opposite_user_cost), 2)))
-        update_token_balance(db, seller_id, -opposite_user_cost)
-        
-        # Update positions
-        # Check if users have opposite positions that should be closed
-        # Order user: check if they have opposite outcome position
-        opposite_position = db.query(Position).filter(
-            Position.user_id == buyer_id,
-            Position.market_id == order.market_id,
-            Position.outcome_name == order.outcome_name,
-            Position.outcome == opposite_outcome
-        ).first()
-        
-        if opposite_position and opposite_position.quantity > 0:
-            # User has opposite position, reduce it (closing position)
-            close_amount = min(trade_quantity, opposite_position.quantity)
-            # Calculate cost per unit before modifying quantity
-            cost_per_unit = opposite_position.total_cost / opposite_position.quantity
-            opposite_position.quantity -= close_amount
-            # Adjust cost basis proportionally
-            opposite_position.total_cost -= close_amount * cost_per_unit
-            if opposite_position.quantity <= 0:
-                db.delete(opposite_position)
-            else:
-                # Update average price
-                if opposite_position.quantity > 0:
-                    opposite_position.average_price = opposite_position.total_cost / opposite_position.quantity
-            
-            # Always create/update position for the outcome being bought
-            # Even if we fully closed the opposite position, we still bought this outcome
-            update_position(db, buyer_id, order.market_id, order.outcome_name, order.outcome, trade_quantity, trade_price)
-        else:
-            # No opposite position, just add to same outcome
-            update_position(db, buyer_id, order.market_id, order.outcome_name, order.outcome, trade_quantity, trade_price)
-        
-        # Opposite order user: check if they have opposite outcome position
-        opposite_position_other = db.query(Position).filter(
-            Position.user_id == seller_id,
-            Position.market_id == order.market_id,
-            Position.outcome_name == order.outcome_name,
-            Position.outcome == order.outcome  # Opposite of their order's outcome
-        ).first()
-        
-        if opposite_position_other and opposite_position_other.quantity > 0:
-            # User has opposite position, reduce it (closing position)
-            close_amount = min(trade_quantity, opposite_position_other.quantity)
-            # Calculate cost per unit before modifying quantity
-            cost_per_unit = opposite_position_other.total_cost / opposite_position_other.quantity
-            opposite_position_other.quantity -= close_amount
-            # Adjust cost basis proportionally
-            opposite_position_other.total_cost -= close_amount * cost_per_unit
-            if opposite_position_other.quantity <= 0:
-                db.delete(opposite_position_other)
-            else:
-                # Update average price
-                if opposite_position_other.quantity > 0:
-                    opposite_position_other.average_price = opposite_position_other.total_cost / opposite_position_other.quantity
-            remaining_to_add = trade_quantity - close_amount
-            if remaining_to_add > 0:
-                # Add remaining quantity to same outcome position
-                update_position(db, seller_id, order.market_id, order.outcome_name, opposite_outcome, remaining_to_add, opposite_price_actual)
-        else:
-            # No opposite position, just add to same outcome
-            update_position(db, seller_id, order.market_id, order.outcome_name, opposite_outcome, trade_quantity, opposite_price_actual)
-        
-        # Update order quantities
-        order.filled_quantity += trade_quantity
-        opposite_order.filled_quantity += trade_quantity
-        
-        # Update or remove opposite order
-        if opposite_order.filled_quantity >= opposite_order.quantity:
-            opposite_order.status = OrderStatus.FILLED
-            remove_order_from_orderbook(order.market_id, order.outcome_name, opposite_outcome, "buy", opposite_order_id)
-        else:
-            new_quantity = opposite_order.quantity - opposite_order.filled_quantity
-            update_order_in_orderbook(order.market_id, order.outcome_name, opposite_outcome, "buy", opposite_order_id, new_quantity)
-        
-        remaining_quantity -= trade_quantity
+        def next_batch(quantity):
+            return _take_batch(resting_orders, quantity)
+    
+    trades, remaining_quantity = _fill_candidates(db, order, opposite_outcome, next_batch, remaining_quantity, book_updates)
     
     # Update order status
     if order.filled_quantity >= order.quantity:
         order.status = OrderStatus.FILLED
-        remove_order_from_orderbook(order.market_id, order.outcome_name, order.outcome, "buy", order.id)
+        book_updates.append(_book_update("remove", order))
     elif order.filled_quantity > 0:
         order.status = OrderStatus.PARTIALLY_FILLED
-        new_quantity = order.quantity - order.filled_quantity
-        update_order_in_orderbook(order.market_id, order.outcome_name, order.outcome, "buy", order.id, new_quantity)
+        book_updates.append(_book_update("update", order))
     
-    db.commit()
+    db.flush()
     
     # Note: WebSocket broadcasts are handled by the API layer
     # after trade execution to properly handle async context
@@ -231,15 +360,25 @@ def match_order(db: Session, order: Order) -> List[Trade]:
     return trades
 
 
-def place_order(db: Session, order: Order) -> List[Trade]:
-    """
-    Place an order and match it against existing orders.
-    Returns list of executed trades.
-    """
-    # Validate market is active
-    market = db.query(Market).filter(Market.id == order.market_id).first()
+def _check_deadline(market: Market):
+    """Markets whose orders expire at the resolution deadline stop taking orders once it has passed"""
+    if not market.expire_orders_at_deadline:
+        return
+    deadline = market.resolution_deadline
+    if deadline.tzinfo is None:
+        deadline = deadline.replace(tzinfo=timezone.utc)
+    if datetime.now(timezone.utc) >= deadline:
+        raise ValueError("Market has passed its resolution deadline")
+
+
+def _check_market_open(db: Session, order: Order):
+    """Raise ValueError unless the order's market and outcome are open for trading"""
+    # Validate market is active. The route may have loaded the market before the order was
+    # queued on the sequencer, so overwrite that copy: a halt committed since must be seen
+    market = db.query(Market).filter(Market.id == order.market_id).populate_existing().first()
     if not market or market.status != MarketStatus.ACTIVE:
         raise ValueError("Market is not active")
+    _check_deadline(market)
     
     # Check if outcome is resolved (cannot trade on resolved outcomes)
     from ..models.market_outcome import MarketOutcome, OutcomeStatus
@@ -250,45 +389,360 @@ def place_order(db: Session, order: Order) -> List[Trade]:
     
     if market_outcome and market_outcome.status == OutcomeStatus.RESOLVED:
         raise ValueError(f"Cannot trade on resolved outcome '{order.outcome_name}'. This outcome has already been resolved.")
-    
+
+
+def _execute_order(db: Session, order: Order, book_updates: list) -> List[Trade]:
+    """Price, fund-check, insert and match one order without committing.
+    Orderbook changes are appended to book_updates for the caller to apply after its commit.
+    """
     # For market orders, check if there are matching orders available
     # In buy-only model: match against opposite outcome
     if order.order_type.value == "market":
         opposite_outcome = "no" if order.outcome == "yes" else "yes"
         # Get best price for opposite outcome (all are "buy" orders now)
-        best_opposite_price = get_best_price(order.market_id, order.outcome_name, opposite_outcome, "buy")
-        if not best_opposite_price:
+        claimed = _claimed_ahead(book_updates) if settings.MATCHING_MODE == "lua" else None
+        if claimed is not None:
+            # Claims are best first
+            best_opposite_tick = claimed[0][0][1] if claimed[0] else None
+        elif settings.MATCHING_MODE == "lua":
+            best_opposite_tick = get_best_tick(order.market_id, order.outcome_name, opposite_outcome, "buy")
+        else:
+            book = get_engine_book(order.market_id, order.outcome_name)
+            best_opposite_tick = book.side(opposite_outcome).best()
+        if best_opposite_tick is None:
             raise ValueError("No matching orders available for market order")
         # Calculate implied price for this outcome: if opposite is at p, this is at (1-p)
-        implied_price = Decimal("1.0") - best_opposite_price
         # Set price for balance check (will be used during matching)
-        order.price = implied_price
+        order.price = tick_to_price(complement_tick(best_opposite_tick))
     
     # Check sufficient balance for buy orders (after price is set for market orders)
     # In buy-only model, all orders are buy orders
-    total_cost = order.price * order.quantity
+    total_cost = cents_to_amount(trade_cost_cents(price_to_tick(order.price), to_contracts(order.quantity)))
     if not has_sufficient_balance(db, order.user_id, total_cost):
         raise ValueError("Insufficient token balance")
     
-    # Add order to database
+    # Add order to database (flush only, to get an id for the book)
     db.add(order)
-    db.commit()
-    db.refresh(order)
+    db.flush()
     
     # Match the order first (market orders match immediately, limit orders may match partially)
-    trades = match_order(db, order)
+    trades = match_order(db, order, book_updates)
     
-    # Add to orderbook only if limit order and not fully filled
-    # All orders go to "buy" side of their outcome
-    if order.order_type.value == "limit" and order.status == OrderStatus.PENDING:
-        add_order_to_orderbook(
-            order.market_id,
-            order.outcome_name,
-            order.outcome,
-            "buy",  # All orders are "buy" in new model
-            order.price,
-            order.quantity - order.filled_quantity,  # Only add remaining quantity
-            order.id
-        )
+    # Rest the remainder of a limit order that did not fully fill (it no longer crosses anything)
+    if order.order_type.value == "limit" and order.status in [OrderStatus.PENDING, OrderStatus.PARTIALLY_FILLED]:
+        book_updates.append(_book_update("add", order))
+    # Market orders never rest: whatever the book could not fill is cancelled
+    elif order.order_type.value == "market" and order.status != OrderStatus.FILLED:
+        order.status = OrderStatus.CANCELLED
     
     return trades
+
+
+def place_order(db: Session, order: Order) -> List[Trade]:
+    """
+    Place an order and match it against existing orders.
+    The order, its trades, balance and position changes are committed in one transaction;
+    the orderbook is only touched after that commit succeeds.
+    Returns list of executed trades.
+    """
+    book_updates = []
+    try:
+        trades = _commit_order(db, order, book_updates)
+    except Exception:
+        _discard_book_updates(book_updates)
+        raise
+    apply_book_updates(book_updates)
+    return trades
+
+
+def _commit_order(db: Session, order: Order, book_updates: list) -> List[Trade]:
+    """Check, execute and commit one order. Returns its trades; the book changes still to apply
+    are appended to book_updates. On failure the transaction is rolled back and the caller
+    discards book_updates.
+    """
+    try:
+        _check_market_open(db, order)
+        trades = _execute_order(db, order, book_updates)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return trades
+
+
+async def place_order_async(db: AsyncSession, order: Order) -> List[Trade]:
+    """
+    place_order on an AsyncSession: the same unit of work, but every database round trip
+    is awaited on the event loop instead of blocking it (or occupying a thread).
+    Run it through the market's sequencer like place_order.
+    Redis is only used on the shared asyncio pool: the book is read or claimed before the
+    transaction and the order's book changes go out in one pipeline after it.
+    """
+    book_updates = await _prepare_order_async(order)
+    try:
+        trades = await db.run_sync(_commit_order, order, book_updates)
+    except Exception:
+        await _discard_book_updates_async(book_updates)
+        raise
+    await apply_book_updates_async(book_updates)
+    return trades
+
+
+def _apply_engine_updates(book_updates: list):
+    """Apply deferred changes to the resident matching books only (Redis is written later)"""
+    for action, payload in book_updates:
+        if action == "claim":
+            continue
+        market_id, outcome_name, outcome, order_id, price, remaining, user_id = payload
+        book = engine.peek_book(market_id, outcome_name)
+        if not book:
+            continue
+        if action == "add":
+            book.side(outcome).add(order_id, price_to_tick(price), remaining)
+        elif action == "update":
+            book.side(outcome).update(order_id, remaining)
+        elif action == "remove":
+            book.side(outcome).remove(order_id)
+
+
+def place_orders(db: Session, orders: List[Order]) -> List[Tuple[Optional[List[Trade]], Optional[str]]]:
+    """
+    Place a batch of orders for one market in a single transaction.
+    The market and its outcomes are read once. Each order runs inside a savepoint, so an
+    order that is rejected (e.g. insufficient balance) is rolled back on its own and the
+    rest of the batch still goes through; everything accepted is committed together.
+    In engine mode later orders in the batch see the book as the earlier ones left it: the
+    resident books are updated as each order is accepted, and Redis is written once the commit
+    succeeds. In Lua mode matching reads Redis, which does not have the batch's resting orders
+    yet, so an order that would cross one of them is rejected.
+    Returns one (trades, error) pair per order, in input order.
+    Raises ValueError if the market is not open; any other failure rolls back the whole batch.
+    """
+    results, book_updates = _commit_orders(db, orders)
+    # Resident books are already current, only Redis is behind
+    apply_book_updates(book_updates, sync_engine=settings.MATCHING_MODE == "lua")
+    return results
+
+
+def _open_batch(db: Session, orders: List[Order]) -> set:
+    """Check that a batch's market is open. Returns the names of its resolved outcomes"""
+    market_id = orders[0].market_id
+    if any(order.market_id != market_id for order in orders):
+        raise ValueError("All orders in a batch must be for the same market")
+    
+    # Fresh read, as in _check_market_open
+    market = db.query(Market).filter(Market.id == market_id).populate_existing().first()
+    if not market or market.status != MarketStatus.ACTIVE:
+        raise ValueError("Market is not active")
+    _check_deadline(market)
+    
+    from ..models.market_outcome import MarketOutcome, OutcomeStatus
+    return {
+        name for (name,) in db.query(MarketOutcome.name).filter(
+            MarketOutcome.market_id == market_id,
+            MarketOutcome.status == OutcomeStatus.RESOLVED
+        ).all()
+    }
+
+
+def _execute_batch_order(db: Session, order: Order, book_updates: list) -> Tuple[Optional[List[Trade]], Optional[str]]:
+    """Execute one order of a batch in a savepoint. A rejected order is rolled back on its own and
+    its error returned; the caller discards its book_updates then.
+    """
+    savepoint = db.begin_nested()
+    try:
+        trades = _execute_order(db, order, book_updates)
+        savepoint.commit()
+    except ValueError as e:
+        savepoint.rollback()
+        return None, str(e)
+    return trades, None
+
+
+def _accept_batch_order(book_updates: list, accepted_updates: list):
+    """Take an executed batch order's book changes into the batch's"""
+    if settings.MATCHING_MODE != "lua":
+        _apply_engine_updates(book_updates)
+    accepted_updates.extend(book_updates)
+
+
+def _batch_order_error(order: Order, resolved_outcomes: set, accepted_updates: list) -> Optional[str]:
+    """Why a batch order is rejected before it runs, or None.
+    In Lua mode the batch's resting orders only reach Redis once it commits, so matching cannot
+    see them: an order that would cross one of them is rejected instead of resting crossed.
+    """
+    if order.outcome_name in resolved_outcomes:
+        return f"Cannot trade on resolved outcome '{order.outcome_name}'. This outcome has already been resolved."
+    if settings.MATCHING_MODE == "lua":
+        opposite_outcome = "no" if order.outcome == "yes" else "yes"
+        min_tick = complement_tick(price_to_tick(order.price)) if order.order_type.value == "limit" else 0
+        for action, payload in accepted_updates:
+            if action != "add":
+                continue
+            market_id, outcome_name, outcome, order_id, price = payload[:5]
+            if outcome_name == order.outcome_name and outcome == opposite_outcome and price_to_tick(price) >= min_tick:
+                return f"Order would cross order {order_id} placed earlier in this batch"
+    return None
+
+
+def _commit_orders(db: Session, orders: List[Order]) -> Tuple[List[Tuple[Optional[List[Trade]], Optional[str]]], list]:
+    """Check, execute and commit a batch. Returns its results and the book changes still to apply"""
+    if not orders:
+        return [], []
+    resolved_outcomes = _open_batch(db, orders)
+    
+    results = []
+    accepted_updates = []
+    try:
+        for order in orders:
+            error = _batch_order_error(order, resolved_outcomes, accepted_updates)
+            if error is not None:
+                results.append((None, error))
+                continue
+            
+            book_updates = []
+            try:
+                trades, error = _execute_batch_order(db, order, book_updates)
+            except Exception:
+                # Hand this order's Lua claims to the batch-wide cleanup below
+                accepted_updates.extend(book_updates)
+                raise
+            if error is None:
+                _accept_batch_order(book_updates, accepted_updates)
+            else:
+                _discard_book_updates(book_updates)
+            results.append((trades, error))
+        
+        db.commit()
+    except Exception:
+        db.rollback()
+        _discard_book_updates(accepted_updates)
+        # Resident books may hold changes that never committed; reload them from Redis on next use
+        for order in orders:
+            engine.evict(order.market_id, order.outcome_name)
+        raise
+    
+    return results, accepted_updates
+
+
+async def place_orders_async(db: AsyncSession, orders: List[Order]) -> List[Tuple[Optional[List[Trade]], Optional[str]]]:
+    """place_orders on an AsyncSession (see place_order_async). Run it through the market's sequencer.
+    Each order's Redis reads happen between its database steps, all in the one transaction.
+    """
+    if not orders:
+        return []
+    resolved_outcomes = await db.run_sync(_open_batch, orders)
+    
+    results = []
+    accepted_updates = []
+    try:
+        for order in orders:
+            error = _batch_order_error(order, resolved_outcomes, accepted_updates)
+            if error is not None:
+                results.append((None, error))
+                continue
+            
+            book_updates = await _prepare_order_async(order)
+            try:
+                trades, error = await db.run_sync(_execute_batch_order, order, book_updates)
+            except Exception:
+                accepted_updates.extend(book_updates)
+                raise
+            if error is None:
+                _accept_batch_order(book_updates, accepted_updates)
+            else:
+                await _discard_book_updates_async(book_updates)
+            results.append((trades, error))
+        
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        await _discard_book_updates_async(accepted_updates)
+        for order in orders:
+            engine.evict(order.market_id, order.outcome_name)
+        raise
+    
+    await apply_book_updates_async(accepted_updates, sync_engine=settings.MATCHING_MODE == "lua")
+    return results
+
+
+def cancel_resting_order(db: Session, order: Order) -> Order:
+    """
+    Cancel an open order and take it off the orderbook (after the commit).
+    Re-reads the order first: when run through the sequencer a fill may have landed since the caller looked.
+    """
+    apply_book_updates([_commit_cancel(db, order)])
+    return order
+
+
+def _commit_cancel(db: Session, order: Order) -> tuple:
+    """Re-check and commit a cancel. Returns the book change still to apply"""
+    # When run through the sequencer a fill may have landed since the caller looked
+    db.refresh(order)
+    if order.status not in [OrderStatus.PENDING, OrderStatus.PARTIALLY_FILLED]:
+        raise ValueError("Order cannot be cancelled")
+    
+    order.status = OrderStatus.CANCELLED
+    book_update = _book_update("remove", order)
+    db.commit()
+    return book_update
+
+
+async def cancel_resting_order_async(db: AsyncSession, order: Order) -> Order:
+    """cancel_resting_order on an AsyncSession (the book change goes out on the asyncio Redis pool)"""
+    book_update = await db.run_sync(_commit_cancel, order)
+    await apply_book_updates_async([book_update])
+    return order
+
+
+def cancel_open_orders(db: Session, user_id: Optional[int] = None, market_id: Optional[int] = None,
+                       outcome_name: Optional[str] = None, outcome: Optional[str] = None,
+                       order_ids: Optional[List[int]] = None) -> List[Tuple[int, int, str, str]]:
+    """
+    Cancel every open order matching the filters in one UPDATE and commit it.
+    The orderbook is not touched; pass the result to remove_orders_from_orderbook
+    (through the market's sequencer) once this returns.
+    Returns (order_id, market_id, outcome_name, outcome) for each cancelled order.
+    """
+    query = update(Order).where(
+        Order.status.in_([OrderStatus.PENDING, OrderStatus.PARTIALLY_FILLED])
+    )
+    if user_id is not None:
+        query = query.where(Order.user_id == user_id)
+    if market_id is not None:
+        query = query.where(Order.market_id == market_id)
+    if outcome_name is not None:
+        query = query.where(Order.outcome_name == outcome_name)
+    if outcome is not None:
+        query = query.where(Order.outcome == outcome)
+    if order_ids is not None:
+        query = query.where(Order.id.in_(order_ids))
+    
+    result = db.execute(
+        query.values(status=OrderStatus.CANCELLED).returning(
+            Order.id, Order.market_id, Order.outcome_name, Order.outcome
+        ),
+        execution_options={"synchronize_session": False}
+    )
+    cancelled = [tuple(row) for row in result]
+    db.commit()
+    return cancelled
+
+
+def halt_market(db: Session, market_id: int) -> List[Tuple[int, int, str, str]]:
+    """
+    Close a market to trading and cancel every resting order in it.
+    Run it on the market's sequencer: placements queued behind it then see the closed market,
+    and no order can land between the status change and the cancel.
+    Returns the cancelled orders as (order_id, market_id, outcome_name, outcome).
+    """
+    market = db.query(Market).filter(Market.id == market_id).first()
+    if not market or market.status != MarketStatus.ACTIVE:
+        raise ValueError("Market is not active")
+    
+    market.status = MarketStatus.CLOSED
+    # The market status change commits together with the cancels
+    cancelled = cancel_open_orders(db, market_id=market_id)
+    remove_orders_from_orderbook(cancelled)
+    return cancelled
+
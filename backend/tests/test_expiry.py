@@ -0,0 +1,53 @@
+"""
+Tests for the order expiry timer wheel (no database or Redis needed)
+"""
+from app.services.expiry import TimerWheel, OrderExpiry
+
+
+def test_fires_at_deadline():
+    """Entries fire on the first tick at or after their deadline, not before"""
+    wheel = TimerWheel(tick=1.0, slots=4, levels=2, now=0)
+    wheel.schedule(3, "a")
+    wheel.schedule(2.5, "b")
+    assert wheel.advance(1) == []
+    assert wheel.advance(2) == []
+    assert sorted(wheel.advance(3)) == ["a", "b"]
+    assert wheel.size == 0
+
+
+def test_cascades_across_levels():
+    """Deadlines on higher levels and in the overflow list still fire on time"""
+    wheel = TimerWheel(tick=1.0, slots=4, levels=2, now=0)
+    deadlines = [1, 3, 4, 5, 7, 15, 16, 17, 40, 63, 64, 100]
+    for deadline in deadlines:
+        wheel.schedule(deadline, deadline)
+    fired = {}
+    for now in range(1, 101):
+        for item in wheel.advance(now):
+            fired[item] = now
+    assert fired == {deadline: deadline for deadline in deadlines}
+
+
+def test_late_advance_and_past_deadlines():
+    """A late advance fires everything overdue, and past deadlines fire on the next advance"""
+    wheel = TimerWheel(tick=1.0, slots=4, levels=2, now=0)
+    wheel.schedule(2, "a")
+    wheel.schedule(30, "b")
+    assert sorted(wheel.advance(50)) == ["a", "b"]
+    wheel.schedule(10, "c")
+    assert wheel.advance(50) == ["c"]
+
+
+def test_failed_expiry_is_retried():
+    """Entries of a market whose expiry failed fire again on the next tick"""
+    expiry = OrderExpiry(tick=1.0)
+    expiry.wheel = TimerWheel(tick=1.0, slots=4, levels=2, now=0)
+    expiry.wheel.schedule(2, ("order", 1, 10))
+    expiry.wheel.schedule(2, ("market", 2, None))
+    due = expiry.pop_due(2)
+    assert due == {1: [10], 2: None}
+
+    for market_id, order_ids in due.items():
+        expiry.retry(market_id, order_ids, 2)
+    assert expiry.pop_due(2) == {}
+    assert expiry.pop_due(3) == {1: [10], 2: None}
@@ -0,0 +1,78 @@
+"""
+Tests for the order journal (no database or Redis needed)
+"""
+import os
+from app.services.journal import OrderJournal, ACCEPT, FILL, CANCEL
+
+
+def test_replay_after_restart(tmp_path):
+    """Accepts, fills and cancels replay to the same resting orders"""
+    journal = OrderJournal(str(tmp_path))
+    assert journal.open() == {}
+    journal.record(ACCEPT, 1, "Team A", "yes", 10, 7, 4000, 5)
+    journal.record(ACCEPT, 1, "Team A", "no", 11, 8, 6000, 3)
+    journal.record(ACCEPT, 2, "default", "yes", 12, 7, 5000, 9)
+    journal.record(FILL, 1, "Team A", "yes", 10, quantity=2)
+    journal.record(FILL, 1, "Team A", "no", 11, quantity=0)
+    journal.record(CANCEL, 2, "default", "yes", 12)
+    journal._file.close()
+    journal._file = None
+
+    reopened = OrderJournal(str(tmp_path))
+    assert reopened.open() == {10: (1, "Team A", "yes", 7, 4000, 2)}
+    assert reopened.seq == 6
+
+
+def test_snapshot_compacts_journal(tmp_path):
+    """A snapshot replaces the journal and replay continues from its sequence number"""
+    journal = OrderJournal(str(tmp_path), snapshot_every=3)
+    journal.open()
+    for order_id in range(3):
+        journal.record(ACCEPT, 1, "default", "yes", order_id, None, 5000, 1)
+    # The third record triggered a snapshot
+    assert os.path.getsize(journal.journal_path) == 0
+    journal.record(CANCEL, 1, "default", "yes", 0)
+    journal.close()
+
+    reopened = OrderJournal(str(tmp_path))
+    assert sorted(reopened.open()) == [1, 2]
+    assert reopened.seq == 4
+
+
+def test_torn_tail_is_ignored(tmp_path):
+    """A half-written last record is dropped and new records follow the last good one"""
+    journal = OrderJournal(str(tmp_path))
+    journal.open()
+    journal.record(ACCEPT, 1, "default", "yes", 1, None, 5000, 1)
+    journal.record(ACCEPT, 1, "default", "yes", 2, None, 5000, 1)
+    journal._file.close()
+    journal._file = None
+    with open(journal.journal_path, "r+b") as f:
+        f.truncate(os.path.getsize(journal.journal_path) - 3)
+
+    reopened = OrderJournal(str(tmp_path))
+    assert list(reopened.open()) == [1]
+    reopened.record(ACCEPT, 1, "default", "no", 3, None, 5000, 1)
+    reopened._file.close()
+    reopened._file = None
+
+    assert sorted(OrderJournal(str(tmp_path)).open()) == [1, 3]
+
+
+def test_record_many_is_one_batch(tmp_path):
+    """A unit of work's changes are appended together and snapshot once past the threshold"""
+    journal = OrderJournal(str(tmp_path), snapshot_every=3)
+    journal.open()
+    journal.record_many([
+        (ACCEPT, 1, "default", "yes", 1, 7, 5000, 4),
+        (ACCEPT, 1, "default", "no", 2, 8, 5000, 4),
+        (FILL, 1, "default", "yes", 1, None, 0, 1),
+        (CANCEL, 1, "default", "no", 2, None, 0, 0),
+    ])
+    assert journal.seq == 4
+    # The batch crossed snapshot_every, so it was folded into a snapshot
+    assert os.path.getsize(journal.journal_path) == 0
+    journal.close()
+
+    reopened = OrderJournal(str(tmp_path))
+    assert reopened.open() == {1: (1, "default", "yes", 7, 5000, 1)}
@@ -0,0 +1,102 @@
+"""
+Tests for the in-memory matching engine (no database or Redis needed)
+"""
+import pytest
+from decimal import Decimal, ROUND_HALF_UP
+from app.core.fixedpoint import price_to_tick, tick_to_price, complement_tick, trade_cost_cents, cents_to_amount
+from app.services.matching_engine import BookSide, MatchingEngine
+
+
+def test_tick_conversion():
+    """Prices map to exact integer ticks and back"""
+    assert price_to_tick(Decimal("0.35")) == 3500
+    assert price_to_tick(Decimal("0.3500")) == 3500
+    assert price_to_tick(1) == 10000
+    assert tick_to_price(3500) == Decimal("0.35")
+    assert str(tick_to_price(3500)) == "0.3500"
+    assert complement_tick(price_to_tick(Decimal("0.65"))) == 3500
+
+    with pytest.raises(ValueError):
+        price_to_tick(Decimal("0.12345"))
+    with pytest.raises(ValueError):
+        price_to_tick(Decimal("1.5"))
+
+
+def test_trade_cost_in_cents():
+    """Costs are whole cents and agree with exact Decimal arithmetic rounded half-up"""
+    assert trade_cost_cents(6000, 4) == 240
+    assert trade_cost_cents(3333, 1) == 33
+    assert trade_cost_cents(5050, 1) == 51
+    assert cents_to_amount(240) == Decimal("2.40")
+    for tick in range(1, 10000, 37):
+        for quantity in [1, 3, 7, 100]:
+            exact = (tick_to_price(tick) * quantity).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+            assert cents_to_amount(trade_cost_cents(tick, quantity)) == exact
+
+
+def test_best_price_and_price_time_priority():
+    """Orders come out highest tick first, then in arrival order"""
+    side = BookSide()
+    side.add(1, 4000, 10)
+    side.add(2, 5500, 5)
+    side.add(3, 4000, 7)
+    side.add(4, 5500, 1)
+
+    assert side.best() == 5500
+    assert [o.order_id for o in side.iter_orders()] == [2, 4, 1, 3]
+    assert [o.order_id for o in side.iter_orders(min_tick=5000)] == [2, 4]
+    assert [o.order_id for o in side.iter_level(4000)] == [1, 3]
+    assert side.depth() == [(5500, 6, 2), (4000, 17, 2)]
+
+
+def test_cancel_and_update():
+    """Cancelling the last order at the best level moves the best tick down; updates keep priority"""
+    side = BookSide()
+    side.add(1, 5500, 5)
+    side.add(2, 5500, 5)
+    side.add(3, 3000, 5)
+
+    side.update(1, 2)
+    assert [(o.order_id, o.quantity) for o in side.iter_level(5500)] == [(1, 2), (2, 5)]
+    assert side.level_quantity[5500] == 7
+
+    side.remove(1)
+    side.remove(2)
+    assert side.best() == 3000
+    assert side.queues[5500] is None
+    assert side.level_quantity[5500] == 0
+    assert side.remove(99) is None
+    assert len(side) == 1
+
+    side.remove(3)
+    assert side.best() is None
+
+
+def test_mutation_during_iteration():
+    """Filling orders while walking the book does not break iteration"""
+    side = BookSide()
+    for order_id, tick in [(1, 6000), (2, 6000), (3, 5000)]:
+        side.add(order_id, tick, 1)
+
+    seen = []
+    for resting in side.iter_orders():
+        seen.append(resting.order_id)
+        side.remove(resting.order_id)
+
+    assert seen == [1, 2, 3]
+    assert side.best() is None
+
+
+def test_load_book_orders_by_arrival():
+    """Loaded rows are queued by order id within a level"""
+    engine = MatchingEngine()
+    book = engine.load_book(7, "default", {
+        "yes": [(12, 5000, 1), (9, 5000, 1)],
+        "no": [],
+    })
+
+    assert engine.peek_book(7, "default") is book
+    assert [o.order_id for o in book.side("yes").iter_orders()] == [9, 12]
+
+    engine.evict(7, "default")
+    assert engine.peek_book(7, "default") is None
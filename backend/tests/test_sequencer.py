@@ -0,0 +1,71 @@
+"""
+Tests for the per-market order sequencer
+"""
+import asyncio
+import threading
+import time
+import pytest
+from app.services.sequencer import OrderSequencer
+
+
+def test_same_market_runs_in_arrival_order():
+    """Work for one market never overlaps and keeps submission order"""
+    sequencer = OrderSequencer()
+    log = []
+    active = []
+
+    def work(i):
+        active.append(i)
+        assert len(active) == 1, "two orders for one market ran at once"
+        time.sleep(0.001)
+        log.append(i)
+        active.remove(i)
+        return i * 10
+
+    async def main():
+        results = await asyncio.gather(*(sequencer.submit(1, work, i) for i in range(20)))
+        await sequencer.shutdown()
+        return results
+
+    assert asyncio.run(main()) == [i * 10 for i in range(20)]
+    assert log == list(range(20))
+
+
+def test_markets_run_in_parallel_and_errors_propagate():
+    """A slow market does not hold up another, and exceptions reach the caller"""
+    sequencer = OrderSequencer()
+    release = threading.Event()
+
+    def slow():
+        assert release.wait(timeout=5)
+        return "slow"
+
+    def fast():
+        release.set()
+        return "fast"
+
+    def fail():
+        raise ValueError("Market is not active")
+
+    async def main():
+        results = await asyncio.gather(sequencer.submit(1, slow), sequencer.submit(2, fast))
+        with pytest.raises(ValueError):
+            await sequencer.submit(1, fail)
+        await sequencer.shutdown()
+        return results
+
+    assert asyncio.run(main()) == ["slow", "fast"]
+
+
+def test_idle_worker_exits():
+    """Workers go away after the idle timeout and come back on demand"""
+    sequencer = OrderSequencer(idle_timeout=0.01)
+
+    async def main():
+        assert await sequencer.submit(5, lambda: 1) == 1
+        await asyncio.sleep(0.05)
+        assert 5 not in sequencer.workers
+        assert await sequencer.submit(5, lambda: 2) == 2
+        await sequencer.shutdown()
+
+    asyncio.run(main())
@@ -9,7 +9,7 @@ from app.models.market import Market, MarketStatus, MarketType
 from app.models.market_outcome import MarketOutcome, OutcomeStatus
 from app.models.user import User
 from app.models.community import Community
-from app.services.trading import place_order, match_order
+from app.services.trading import place_order, place_orders, match_order, cancel_open_orders, halt_market
 from app.services.token import update_token_balance
 
 
@@ -96,6 +96,21 @@ def sample_users(db: Session):
     return user1, user2
 
 
+def limit_order(market, user, outcome, price, quantity, **fields) -> Order:
+    """An unsaved limit buy on the market's "default" outcome (extra fields, e.g. expiry, pass through)"""
+    return Order(
+        market_id=market.id,
+        user_id=user.id,
+        side=OrderSide.BUY,
+        outcome_name="default",
+        outcome=outcome,
+        price=Decimal(price),
+        quantity=Decimal(quantity),
+        order_type=OrderType.LIMIT,
+        **fields
+    )
+
+
 def test_cash_conservation(db: Session, sample_market, sample_users):
     """Test that cash is conserved when trades execute"""
     user1, user2 = sample_users
@@ -288,3 +303,452 @@ def test_position_closing(db: Session, sample_market, sample_users):
     assert no_position is not None, "NO position should be created"
     assert abs(float(no_position.quantity) - 50.0) < 0.01, f"NO position should be 50, got {no_position.quantity}"
 
+
+def test_batch_orders(db: Session, sample_market, sample_users):
+    """Test that a batch commits accepted orders together and reports rejected ones"""
+    user1, user2 = sample_users
+    
+    # user1 quotes NO; user2's batch lifts it twice, then asks for more than they can afford
+    place_order(db, limit_order(sample_market, user1, "no", "0.40", "10"))
+    batch = [
+        limit_order(sample_market, user2, "yes", "0.60", "4"),
+        limit_order(sample_market, user2, "yes", "0.60", "4"),
+        limit_order(sample_market, user2, "yes", "0.90", "5000"),
+    ]
+    results = place_orders(db, batch)
+    
+    assert len(results[0][0]) == 1 and results[0][1] is None
+    # The second order sees the quantity the first one left behind
+    assert len(results[1][0]) == 1 and results[1][1] is None
+    assert results[2] == (None, "Insufficient token balance")
+    
+    assert batch[0].status == OrderStatus.FILLED
+    assert batch[1].status == OrderStatus.FILLED
+    assert batch[2].id is None, "Rejected order should not be saved"
+    
+    db.refresh(user2)
+    assert abs(float(user2.token_balance) - (1000.0 - 8 * 0.60)) < 0.01
+
+
+def test_batch_crossing_itself_lua(db: Session, sample_market, sample_users, monkeypatch):
+    """Test that in Lua mode a batch order crossing an earlier resting one of the batch is rejected"""
+    from app.core.config import settings
+    from app.services.orderbook import get_orderbook
+    user1, _ = sample_users
+    monkeypatch.setattr(settings, "MATCHING_MODE", "lua")
+    
+    batch = [
+        limit_order(sample_market, user1, "yes", "0.60", "5"),
+        limit_order(sample_market, user1, "no", "0.30", "5"),
+        limit_order(sample_market, user1, "no", "0.40", "5"),
+    ]
+    results = place_orders(db, batch)
+    
+    assert results[0] == ([], None)
+    assert results[1] == ([], None)
+    assert results[2] == (None, f"Order would cross order {batch[0].id} placed earlier in this batch")
+    assert [entry["order_id"] for entry in get_orderbook(sample_market.id, "default", "no")["buys"]] == [batch[1].id]
+
+
+def test_mass_cancel_and_halt(db: Session, sample_market, sample_users):
+    """Test that bulk cancel only touches the caller's open orders and halting closes the market"""
+    from app.services.orderbook import get_engine_book, remove_orders_from_orderbook
+    user1, user2 = sample_users
+    
+    orders = []
+    for user, outcome in [(user1, "yes"), (user1, "no"), (user2, "yes")]:
+        order = limit_order(sample_market, user, outcome, "0.30", "10")
+        place_order(db, order)
+        orders.append(order)
+    
+    cancelled = cancel_open_orders(db, user_id=user1.id, outcome="yes")
+    remove_orders_from_orderbook(cancelled)
+    assert [row[0] for row in cancelled] == [orders[0].id]
+    
+    book = get_engine_book(sample_market.id, "default")
+    assert orders[0].id not in book.side("yes")
+    assert orders[2].id in book.side("yes")
+    
+    cancelled = halt_market(db, sample_market.id)
+    assert sorted(row[0] for row in cancelled) == [orders[1].id, orders[2].id]
+    assert len(book.side("yes")) == 0 and len(book.side("no")) == 0
+    
+    db.refresh(sample_market)
+    assert sample_market.status == MarketStatus.CLOSED
+    for order in orders:
+        db.refresh(order)
+        assert order.status == OrderStatus.CANCELLED
+
+
+def test_crossing_with_price_improvement(db: Session, sample_market, sample_users):
+    """Test that a limit order sweeps every level it crosses at resting prices and rests the remainder"""
+    from app.services.orderbook import get_orderbook
+    user1, user2 = sample_users
+    
+    def resting(outcome):
+        book = get_orderbook(sample_market.id, "default", outcome)
+        return [(entry["price"], entry["quantity"]) for entry in book["buys"]]
+    
+    place_order(db, limit_order(sample_market, user1, "no", "0.30", "10"))
+    place_order(db, limit_order(sample_market, user1, "no", "0.40", "10"))
+    
+    # YES at 0.65 crosses NO at 0.40 (YES 0.60) but not NO at 0.30 (YES 0.70)
+    taker = limit_order(sample_market, user2, "yes", "0.65", "25")
+    trades = place_order(db, taker)
+    assert [(trade.price, trade.quantity) for trade in trades] == [(Decimal("0.6"), 10)]
+    assert taker.status == OrderStatus.PARTIALLY_FILLED
+    assert resting("no") == [(Decimal("0.3"), 10)]
+    assert resting("yes") == [(Decimal("0.65"), 15)]
+    
+    # The rested remainder is itself a valid counterparty
+    trades = place_order(db, limit_order(sample_market, user1, "no", "0.40", "5"))
+    assert [(trade.price, trade.quantity) for trade in trades] == [(Decimal("0.35"), 5)]
+    assert resting("yes") == [(Decimal("0.65"), 10)]
+
+
+def test_reconcile_market(db: Session, sample_market, sample_users, monkeypatch):
+    """Test that reconciliation reports books that drifted from the database and repairs them"""
+    from app.core.config import settings
+    from app.core.redis_client import redis_client
+    from app.services.orderbook import get_orderbook, get_orderbook_key, remove_order_by_id
+    from app.services.reconciliation import reconcile_market
+    user1, user2 = sample_users
+    # Repair is single-process only (refused in lua mode)
+    monkeypatch.setattr(settings, "MATCHING_MODE", "engine")
+    
+    orders = []
+    for user, outcome in [(user1, "yes"), (user2, "yes"), (user2, "no")]:
+        order = limit_order(sample_market, user, outcome, "0.30", "10")
+        place_order(db, order)
+        orders.append(order)
+    assert reconcile_market(db, sample_market.id).in_sync
+    
+    # Lose one resting order and leave a stale entry behind for another
+    remove_order_by_id(orders[1].id)
+    orders[2].status = OrderStatus.CANCELLED
+    db.commit()
+    
+    report = reconcile_market(db, sample_market.id)
+    assert report.orders_checked == 2
+    assert report.missing_from_book == [orders[1].id]
+    assert report.orphaned_in_book == [str(orders[2].id)]
+    assert not report.repaired
+    
+    report = reconcile_market(db, sample_market.id, repair=True)
+    assert report.repaired
+    assert reconcile_market(db, sample_market.id).in_sync
+    
+    yes_book = get_orderbook(sample_market.id, "default", "yes")
+    assert [entry["order_id"] for entry in yes_book["buys"]] == [orders[0].id, orders[1].id]
+    assert get_orderbook(sample_market.id, "default", "no")["buys"] == []
+    assert not redis_client.exists(get_orderbook_key(sample_market.id, "default", "no", "buy"))
+    
+    # A legacy row with fractional contracts is reported, not booked (and not a crash)
+    legacy = limit_order(sample_market, user1, "no", "0.30", "2.5")
+    db.add(legacy)
+    db.commit()
+    report = reconcile_market(db, sample_market.id, repair=True)
+    assert report.unbookable_orders == [legacy.id]
+    assert not report.in_sync and report.missing_from_book == []
+    
+    monkeypatch.setattr(settings, "MATCHING_MODE", "lua")
+    with pytest.raises(ValueError, match="lua"):
+        reconcile_market(db, sample_market.id, repair=True)
+
+
+def test_order_expiry(db: Session, sample_market, sample_users):
+    """Test that expiring orders cancels only open ones and takes them off the book"""
+    from datetime import datetime, timedelta, timezone
+    from app.models.order import TimeInForce
+    from app.services.orderbook import get_orderbook
+    from app.services.expiry import expire_orders
+    user1, user2 = sample_users
+    
+    orders = []
+    for user, outcome in [(user1, "yes"), (user2, "yes"), (user2, "no")]:
+        order = limit_order(sample_market, user, outcome, "0.30", "10", time_in_force=TimeInForce.GTT,
+                            expires_at=datetime.now(timezone.utc) + timedelta(minutes=5))
+        place_order(db, order)
+        orders.append(order)
+    
+    expired = expire_orders(db, sample_market.id, [orders[0].id, orders[2].id])
+    assert sorted(row[0] for row in expired) == [orders[0].id, orders[2].id]
+    # Already expired: nothing left to do
+    assert expire_orders(db, sample_market.id, [orders[0].id]) == []
+    
+    yes_book = get_orderbook(sample_market.id, "default", "yes")
+    assert [entry["order_id"] for entry in yes_book["buys"]] == [orders[1].id]
+    assert get_orderbook(sample_market.id, "default", "no")["buys"] == []
+    
+    # Expiring the whole market (resolution deadline) takes the rest
+    assert [row[0] for row in expire_orders(db, sample_market.id)] == [orders[1].id]
+    for order in orders:
+        db.refresh(order)
+        assert order.status == OrderStatus.CANCELLED
+
+
+def test_place_order_async(db: Session, sample_market, sample_users):
+    """Test that the AsyncSession order-entry path matches, commits and cancels like the sync one"""
+    import asyncio
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    from app.core.database import async_database_url
+    from app.core.redis_client import open_async_redis, close_async_redis
+    from app.services.trading import place_order_async, cancel_resting_order_async
+    user1, user2 = sample_users
+    url = async_database_url(db.get_bind().url.render_as_string(hide_password=False))
+    
+    async def main():
+        async_engine = create_async_engine(url)
+        await open_async_redis()
+        try:
+            async with async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)() as async_db:
+                maker = limit_order(sample_market, user1, "no", "0.40", "10")
+                await place_order_async(async_db, maker)
+                taker = limit_order(sample_market, user2, "yes", "0.60", "4")
+                trades = await place_order_async(async_db, taker)
+                await cancel_resting_order_async(async_db, maker)
+                return maker, taker, trades
+        finally:
+            await close_async_redis()
+            await async_engine.dispose()
+    
+    maker, taker, trades = asyncio.run(main())
+    assert [(trade.price, trade.quantity) for trade in trades] == [(Decimal("0.6"), 4)]
+    assert trades[0].executed_at is not None
+    assert taker.status == OrderStatus.FILLED
+    assert maker.status == OrderStatus.CANCELLED
+    assert maker.filled_quantity == 4
+
+
+def test_orderbook_owner_from_book(db: Session, sample_market, sample_users):
+    """Test that orderbook entries carry their owner and booking time without a database lookup"""
+    from app.services.orderbook import get_orderbook
+    user1, user2 = sample_users
+    
+    for user, price in [(user1, "0.30"), (user2, "0.35")]:
+        place_order(db, limit_order(sample_market, user, "yes", price, "10"))
+    
+    buys = get_orderbook(sample_market.id, "default", "yes")["buys"]
+    assert [(entry["price"], entry["user_id"]) for entry in buys] == [
+        (Decimal("0.35"), user2.id), (Decimal("0.3"), user1.id)
+    ]
+    assert all(entry["booked_at"] is not None for entry in buys)
+
+
+def test_top_of_book_cache(db: Session, sample_market, sample_users):
+    """Test that the top-of-book record follows adds, fills and cancels"""
+    from app.core.redis_client import redis_client
+    from app.services.orderbook import get_top_of_book, get_best_tick, get_bbo_key, _bbo_cache
+    from app.services.trading import cancel_resting_order
+    user1, user2 = sample_users
+    
+    place_order(db, limit_order(sample_market, user1, "yes", "0.40", "10"))
+    place_order(db, limit_order(sample_market, user1, "yes", "0.40", "5"))
+    no_order = limit_order(sample_market, user2, "no", "0.55", "8")
+    place_order(db, no_order)
+    
+    top = get_top_of_book(sample_market.id, "default", "yes")
+    assert (top["bid"], top["bid_quantity"]) == (Decimal("0.4"), 15)
+    assert (top["ask"], top["ask_quantity"]) == (Decimal("0.45"), 8)
+    assert get_best_tick(sample_market.id, "default", "no", "sell") == 6000
+    
+    # A fill shrinks the best level
+    place_order(db, limit_order(sample_market, user2, "no", "0.60", "6"))
+    assert get_top_of_book(sample_market.id, "default", "yes")["bid_quantity"] == 9
+    
+    # Cancelling the only NO order leaves YES without an offer
+    cancel_resting_order(db, no_order)
+    top = get_top_of_book(sample_market.id, "default", "yes")
+    assert (top["ask"], top["ask_quantity"]) == (None, 0)
+    
+    # The Redis hash matches the in-process copy, which is rebuilt from it on a miss
+    assert redis_client.hget(get_bbo_key(sample_market.id, "default"), "yes_qty") == "9"
+    _bbo_cache.clear()
+    assert get_top_of_book(sample_market.id, "default", "no")["ask"] == Decimal("0.6")
+
+
+def test_orderbook_depth(db: Session, sample_market, sample_users):
+    """Test level-aggregated depth with cumulative totals and a price band"""
+    from app.services.matching_engine import engine
+    from app.services.orderbook import get_depth
+    user1, user2 = sample_users
+    
+    for user, outcome, price, quantity in [
+        (user1, "yes", "0.40", "10"), (user2, "yes", "0.40", "5"), (user1, "yes", "0.35", "4"),
+        (user1, "yes", "0.20", "7"), (user2, "no", "0.50", "3"), (user2, "no", "0.45", "2"),
+    ]:
+        place_order(db, limit_order(sample_market, user, outcome, price, quantity))
+    
+    depth = get_depth(sample_market.id, "default", "yes", levels=2)
+    assert [(level["price"], level["quantity"], level["orders"], level["cumulative_quantity"])
+            for level in depth["bids"]] == [(Decimal("0.4"), 15, 2, 15), (Decimal("0.35"), 4, 1, 19)]
+    # NO buys at 0.50 and 0.45 are YES offers at 0.50 and 0.55
+    assert [(level["price"], level["cumulative_quantity"]) for level in depth["asks"]] == [
+        (Decimal("0.5"), 3), (Decimal("0.55"), 5)
+    ]
+    
+    band = get_depth(sample_market.id, "default", "yes", min_price=Decimal("0.30"), max_price=Decimal("0.52"))
+    assert [level["price"] for level in band["bids"]] == [Decimal("0.4"), Decimal("0.35")]
+    assert [level["price"] for level in band["asks"]] == [Decimal("0.5")]
+    
+    # A book that is not resident is read from Redis, and not loaded by the read
+    engine.evict(sample_market.id, "default")
+    assert get_depth(sample_market.id, "default", "yes", levels=2) == depth
+    assert engine.peek_book(sample_market.id, "default") is None
+
+
+def test_fill_capped_by_open_quantity(db: Session, sample_market, sample_users):
+    """Test that a book showing more than an order has left never overfills it"""
+    from app.core.redis_client import redis_client
+    from app.services.matching_engine import engine
+    from app.services.orderbook import get_orderbook, get_orderbook_key, _member
+    user1, user2 = sample_users
+    
+    maker = limit_order(sample_market, user1, "no", "0.40", "10")
+    place_order(db, maker)
+    # Drift: the book thinks the order still has 50 contracts
+    key = get_orderbook_key(sample_market.id, "default", "no", "buy")
+    redis_client.hset(f"{key}:qty", _member(maker.id), "50")
+    engine.evict(sample_market.id, "default")
+    
+    taker = limit_order(sample_market, user2, "yes", "0.60", "30")
+    trades = place_order(db, taker)
+    assert [trade.quantity for trade in trades] == [10]
+    db.refresh(maker)
+    assert maker.status == OrderStatus.FILLED and maker.filled_quantity == 10
+    assert [(entry["order_id"], entry["quantity"]) for entry in get_orderbook(sample_market.id, "default", "yes")["buys"]] == [(taker.id, 20)]
+
+
+def test_halt_seen_by_queued_order(db: Session, sample_market, sample_users):
+    """Test that an order whose session loaded the market before a halt is still rejected"""
+    from sqlalchemy.orm import Session as OrmSession
+    user1, _ = sample_users
+    
+    # The route has the market in its session (still ACTIVE) when the order is queued
+    assert db.get(Market, sample_market.id).status == MarketStatus.ACTIVE
+    with OrmSession(bind=db.get_bind()) as other:
+        halt_market(other, sample_market.id)
+    
+    with pytest.raises(ValueError, match="Market is not active"):
+        place_order(db, limit_order(sample_market, user1, "yes", "0.30", "10"))
+    with pytest.raises(ValueError, match="Market is not active"):
+        place_orders(db, [limit_order(sample_market, user1, "yes", "0.30", "10")])
+
+
+def test_top_of_book_from_other_workers(db: Session, sample_market, sample_users, monkeypatch):
+    """Test that in Lua mode the top of book follows changes this process did not make"""
+    from app.core.config import settings
+    from app.core.redis_client import redis_client
+    from app.services.orderbook import get_best_tick, get_bbo_key
+    user1, _ = sample_users
+    monkeypatch.setattr(settings, "MATCHING_MODE", "lua")
+    
+    place_order(db, limit_order(sample_market, user1, "yes", "0.40", "10"))
+    assert get_best_tick(sample_market.id, "default", "yes", "buy") == 4000
+    
+    # Another worker improves the bid
+    redis_client.hset(get_bbo_key(sample_market.id, "default"), mapping={"yes_tick": 4500, "yes_qty": 3})
+    assert get_best_tick(sample_market.id, "default", "yes", "buy") == 4500
+
+
+def test_restore_claimed_orders(db: Session, sample_market, sample_users):
+    """Test that handing claims back keeps claims made since and re-adds orders that left the book"""
+    from app.services.orderbook import claim_orders, restore_claimed_orders, get_orderbook, get_best_tick
+    user1, user2 = sample_users
+    
+    first = limit_order(sample_market, user1, "no", "0.40", "10")
+    second = limit_order(sample_market, user2, "no", "0.30", "5")
+    place_order(db, first)
+    place_order(db, second)
+    
+    claims = claim_orders(sample_market.id, "default", "no", 4)
+    # Another worker claims from the same order before the first claim is handed back
+    claim_orders(sample_market.id, "default", "no", 3)
+    restore_claimed_orders(sample_market.id, "default", "no", claims)
+    
+    def resting():
+        return [(entry["order_id"], entry["quantity"]) for entry in get_orderbook(sample_market.id, "default", "no")["buys"]]
+    assert resting() == [(first.id, 7), (second.id, 5)]
+    
+    # A claim that took the whole order puts it back at its price
+    claims = claim_orders(sample_market.id, "default", "no", 12)
+    assert resting() == []
+    restore_claimed_orders(sample_market.id, "default", "no", claims)
+    assert resting() == [(first.id, 7), (second.id, 5)]
+    assert get_best_tick(sample_market.id, "default", "no", "buy") == 4000
+
+
+def test_naive_expiry_is_utc(sample_users):
+    """Test that a naive expires_at is stored as the UTC time it was validated as"""
+    from datetime import datetime, timedelta, timezone
+    from app.api.routes.trading import _build_order
+    from app.schemas.order import OrderCreate
+    user1, _ = sample_users
+    
+    expires_at = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(minutes=5)
+    order = _build_order(OrderCreate(
+        market_id=1, outcome_name="default", outcome="yes", price=Decimal("0.30"), quantity=Decimal("10"),
+        order_type="limit", time_in_force="gtt", expires_at=expires_at
+    ), user1, "default")
+    assert order.expires_at == expires_at.replace(tzinfo=timezone.utc)
+
+
+def test_depth_script_walks_levels(db: Session):
+    """Test that the Redis depth walk aggregates large levels and stops at the level limit"""
+    from app.core.redis_client import redis_client
+    from app.services.orderbook import get_orderbook_key, _member, _depth_script
+    key = get_orderbook_key(99, "default", "yes", "buy")
+    pipe = redis_client.pipeline()
+    for order_id in range(1, 601):
+        # 300 orders at each of 0.40 and 0.30, then one at 0.20
+        tick = 4000 if order_id <= 300 else 3000
+        pipe.zadd(key, {_member(order_id): -tick})
+        pipe.hset(f"{key}:qty", _member(order_id), "2")
+    pipe.zadd(key, {_member(601): -2000})
+    pipe.hset(f"{key}:qty", _member(601), "5")
+    pipe.execute()
+    
+    assert _depth_script(keys=[key, f"{key}:qty"], args=[0, 10000, 2]) == [4000, 600, 300, 3000, 600, 300]
+    assert _depth_script(keys=[key, f"{key}:qty"], args=[1000, 3500, 5]) == [3000, 600, 300, 2000, 5, 1]
+
+
+def test_place_order_async_claims_ahead(db: Session, sample_market, sample_users, monkeypatch):
+    """Test that in Lua mode the async path claims on the asyncio pool and hands back a rejected order's claims"""
+    import asyncio
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    from app.core.config import settings
+    from app.core.database import async_database_url
+    from app.core.redis_client import open_async_redis, close_async_redis
+    from app.services import trading
+    from app.services.orderbook import get_orderbook
+    user1, user2 = sample_users
+    url = async_database_url(db.get_bind().url.render_as_string(hide_password=False))
+    monkeypatch.setattr(settings, "MATCHING_MODE", "lua")
+    maker = limit_order(sample_market, user1, "no", "0.40", "10")
+    place_order(db, maker)
+    
+    def blocking(*args, **kwargs):
+        raise AssertionError("Blocking Redis call on the event loop")
+    monkeypatch.setattr(trading, "claim_orders", blocking)
+    monkeypatch.setattr(trading, "get_best_tick", blocking)
+    
+    async def main():
+        async_engine = create_async_engine(url)
+        await open_async_redis()
+        try:
+            async with async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)() as async_db:
+                taker = Order(
+                    market_id=sample_market.id, user_id=user2.id, side=OrderSide.BUY, outcome_name="default",
+                    outcome="yes", price=Decimal(0), quantity=Decimal("4"), order_type=OrderType.MARKET
+                )
+                fills = [(trade.price, trade.quantity) for trade in await trading.place_order_async(async_db, taker)]
+                # Claims the rest of the maker, then fails the balance check
+                with pytest.raises(ValueError, match="Insufficient token balance"):
+                    await trading.place_order_async(async_db, limit_order(sample_market, user2, "yes", "0.60", "5000"))
+                return fills
+        finally:
+            await close_async_redis()
+            await async_engine.dispose()
+    
+    assert asyncio.run(main()) == [(Decimal("0.6"), 4)]
+    assert [(entry["order_id"], entry["quantity"]) for entry in get_orderbook(sample_market.id, "default", "no")["buys"]] == [(maker.id, 6)]
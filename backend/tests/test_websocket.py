@@ -0,0 +1,220 @@
+"""
+Tests for orderbook delta messages
+"""
+import asyncio
+import json
+from decimal import Decimal
+from app.api.websocket import _diff_side, encode_message, ConnectionManager
+from app.core.config import settings
+
+
+def test_diff_side():
+    """Test that a delta carries changed and new entries, and removals as quantity 0"""
+    old = [
+        {"price": 0.4, "quantity": 10.0, "order_id": 1, "user_id": 7},
+        {"price": 0.35, "quantity": 4.0, "order_id": 2, "user_id": 8},
+        {"price": 0.3, "quantity": 2.0, "order_id": 3, "user_id": 7},
+    ]
+    new = [
+        {"price": 0.4, "quantity": 6.0, "order_id": 1, "user_id": 7},
+        {"price": 0.3, "quantity": 2.0, "order_id": 3, "user_id": 7},
+        {"price": 0.25, "quantity": 5.0, "order_id": 4, "user_id": 9},
+    ]
+    
+    changes = _diff_side(old, new)
+    assert sorted((entry["order_id"], entry["quantity"]) for entry in changes) == [(1, 6.0), (2, 0.0), (4, 5.0)]
+    assert _diff_side(new, new) == []
+
+
+
+def test_encode_message():
+    """Test that Decimal prices are encoded as JSON numbers"""
+    frame = encode_message({"type": "orderbook_delta", "buys": [{"price": Decimal("0.4500"), "quantity": 3}]})
+    assert json.loads(frame) == {"type": "orderbook_delta", "buys": [{"price": 0.45, "quantity": 3}]}
+
+
+class _Socket:
+    """Records what is sent; sends block until `released` is set"""
+    def __init__(self):
+        self.sent = []
+        self.released = asyncio.Event()
+        self.closed = False
+    
+    async def send_text(self, message):
+        await self.released.wait()
+        self.sent.append(json.loads(message))
+    
+    async def close(self, code=1000, reason=None):
+        self.closed = True
+
+
+async def _subscribe(manager, socket, outcome_name, outcome, seq=0):
+    """Subscribe a socket to a book whose view is already known (so no Redis read is needed)"""
+    manager.book_views.setdefault((1, outcome_name, outcome), {"buys": [], "sells": []})
+    manager.book_seq[1, outcome_name, outcome] = seq
+    return await manager.subscribe(socket, 1, [(outcome_name, outcome)])
+
+
+def test_slow_client_does_not_hold_up_others(monkeypatch):
+    """Test that broadcasts only enqueue, an overflowing client resyncs and a stuck one is dropped"""
+    monkeypatch.setattr(settings, "WS_SEND_QUEUE_SIZE", 2)
+    monkeypatch.setattr(settings, "WS_SEND_TIMEOUT", 0.05)
+    
+    async def scenario():
+        manager = ConnectionManager()
+        fast, slow = _Socket(), _Socket()
+        fast.released.set()
+        await manager.connect(fast, 1, 10)
+        await manager.connect(slow, 1, 11)
+        
+        for i in range(5):
+            manager._fan_out_frame([fast, slow], encode_message({"trade_id": i}))
+            await asyncio.sleep(0.005)
+        await asyncio.sleep(0.01)
+        assert [message["trade_id"] for message in fast.sent] == [0, 1, 2, 3, 4]
+        
+        # The slow client's backlog overflowed and was dropped, and it never takes the message it is on
+        await asyncio.sleep(0.1)
+        assert slow.sent == [] and slow.closed
+        assert slow not in manager.active_connections[1] and fast in manager.active_connections[1]
+        
+        slow.released.set()
+        manager.disconnect(fast, 1)
+        await asyncio.sleep(0)
+    
+    asyncio.run(scenario())
+
+
+def test_overflowing_client_resyncs(monkeypatch):
+    """Test that a client that overflows its queue gets a snapshot instead of the stale backlog"""
+    monkeypatch.setattr(settings, "WS_SEND_QUEUE_SIZE", 2)
+    
+    async def scenario():
+        manager = ConnectionManager()
+        socket = _Socket()
+        await manager.connect(socket, 1, 10)
+        # The view of a subscribed book is what a resync snapshot is built from
+        await _subscribe(manager, socket, "default", "yes", seq=7)
+        
+        for i in range(6):
+            manager._fan_out_frame([socket], encode_message({"trade_id": i}))
+        socket.released.set()
+        await asyncio.sleep(0.01)
+        
+        assert len(socket.sent) == 2
+        assert socket.sent[0]["type"] == "orderbook_update" and socket.sent[0]["seq"] == 7
+        assert [message["trade_id"] for message in socket.sent[1:]] == [5]
+        manager.disconnect(socket, 1)
+        await asyncio.sleep(0)
+    
+    asyncio.run(scenario())
+
+
+def test_relay_published_trade():
+    """Test that a trade frame published by any worker reaches this worker's subscribers of that outcome, unchanged"""
+    async def scenario():
+        manager = ConnectionManager()
+        socket = _Socket()
+        socket.released.set()
+        await manager.connect(socket, 1, 10)
+        await _subscribe(manager, socket, "Team A", "no")
+        socket.sent.clear()
+        
+        frame = encode_message({"type": "trades", "market_id": 1, "trades": [{"price": 0.45}]})
+        await manager._relay("ws:market:1:trades:Team A", frame)
+        await manager._relay("ws:market:1:trades:Team B", frame)  # Not subscribed: ignored
+        await manager._relay("ws:market:2:trades:Team A", frame)  # No local connections: ignored
+        await asyncio.sleep(0.01)
+        
+        assert socket.sent == [{"type": "trades", "market_id": 1, "trades": [{"price": 0.45}]}]
+        manager.disconnect(socket, 1)
+        await asyncio.sleep(0)
+    
+    asyncio.run(scenario())
+
+
+def test_broadcasts_coalesce_per_tick(monkeypatch):
+    """Test that one tick's trades go out as one batch and each changed book is delivered once"""
+    monkeypatch.setattr(settings, "WS_COALESCE_MS", 20)
+    
+    async def scenario():
+        manager = ConnectionManager()
+        socket = _Socket()
+        socket.released.set()
+        await manager.connect(socket, 1, 10)
+        await _subscribe(manager, socket, "default", "yes")
+        await asyncio.sleep(0.01)
+        socket.sent.clear()
+        delivered = []
+        
+        async def deliver(market_id, outcome_name, outcome):
+            delivered.append((market_id, outcome_name, outcome))
+        manager.deliver_orderbook_update = deliver
+        
+        for i in range(15):
+            await manager.broadcast_trade(1, {"trade_id": i, "outcome_name": "default"})
+            await manager.broadcast_orderbook_update(1, "default", "no")
+        await manager.broadcast_orderbook_update(1, "default", "yes")
+        await asyncio.sleep(0.05)
+        
+        assert delivered == [(1, "default", "no"), (1, "default", "yes")]
+        assert len(socket.sent) == 1 and socket.sent[0]["type"] == "trades"
+        assert [trade["trade_id"] for trade in socket.sent[0]["trades"]] == list(range(15))
+        
+        # The next change starts a new tick
+        await manager.broadcast_orderbook_update(1, "default", "yes")
+        await asyncio.sleep(0.05)
+        assert delivered[-1] == (1, "default", "yes") and len(delivered) == 3
+        manager.disconnect(socket, 1)
+        await asyncio.sleep(0)
+    
+    asyncio.run(scenario())
+
+
+def test_subscriptions_route_deltas(monkeypatch):
+    """Test that snapshots cover the subscribed books and deltas only reach their subscribers"""
+    import app.api.websocket as websocket
+    reads = []
+    
+    async def read_books(books):
+        reads.append(list(books))
+        return [{"buys": [{"price": Decimal("0.4"), "quantity": 5, "order_id": 1, "user_id": 7}], "sells": []} for _ in books]
+    
+    async def read_book(market_id, outcome_name, outcome):
+        return {"buys": [{"price": Decimal("0.4"), "quantity": 3, "order_id": 1, "user_id": 7}], "sells": []}
+    monkeypatch.setattr(websocket, "get_orderbooks_async", read_books)
+    monkeypatch.setattr(websocket, "get_orderbook_async", read_book)
+    
+    async def scenario():
+        manager = ConnectionManager()
+        team_a, team_b = _Socket(), _Socket()
+        team_a.released.set()
+        team_b.released.set()
+        await manager.connect(team_a, 1, 10)
+        await manager.connect(team_b, 1, 11)
+        
+        snapshots = await manager.subscribe(team_a, 1, [("Team A", "yes"), ("Team A", "no")])
+        await manager.subscribe(team_b, 1, [("Team B", "yes")])
+        # One pipelined read per subscribe, covering exactly the new books
+        assert reads == [[(1, "Team A", "yes"), (1, "Team A", "no")], [(1, "Team B", "yes")]]
+        assert [(snapshot["outcome_name"], snapshot["outcome"]) for snapshot in snapshots] == [("Team A", "yes"), ("Team A", "no")]
+        
+        await manager.deliver_orderbook_update(1, "Team A", "no")
+        await asyncio.sleep(0.01)
+        assert [message["type"] for message in team_a.sent] == ["orderbook_delta"]
+        assert team_a.sent[0]["seq"] == 1 and team_a.sent[0]["buys"][0]["quantity"] == 3
+        assert team_b.sent == []
+        
+        # Unsubscribing the last socket from a book drops its view
+        manager.unsubscribe(team_a, 1, [("Team A", "no")])
+        assert (1, "Team A", "no") not in manager.book_views
+        await manager.deliver_orderbook_update(1, "Team A", "no")
+        await asyncio.sleep(0.01)
+        assert len(team_a.sent) == 1
+        
+        manager.disconnect(team_a, 1)
+        manager.disconnect(team_b, 1)
+        assert manager.book_subscribers == {} and manager.book_views == {}
+        await asyncio.sleep(0)
+    
+    asyncio.run(scenario())
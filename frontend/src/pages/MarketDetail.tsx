@@ -52,6 +52,36 @@ interface OrderBook {
   sells: OrderBookEntry[];
 }
 
+// Apply an orderbook_delta: each entry replaces the order with the same id, quantity 0 removes it
+const applyOrderbookDelta = (book: OrderBook, data: any): OrderBook => {
+  const merge = (entries: OrderBookEntry[], changes: any[], descending: boolean) => {
+    const byId = new Map(entries.map(entry => [entry.order_id, entry]));
+    for (const change of changes) {
+      const quantity = typeof change.quantity === 'number' ? change.quantity : parseFloat(change.quantity || '0');
+      if (quantity > 0) {
+        byId.set(change.order_id, {
+          price: typeof change.price === 'number' ? change.price : parseFloat(change.price || '0'),
+          quantity,
+          order_id: change.order_id || null,
+          user_id: change.user_id || null,
+        });
+      } else {
+        byId.delete(change.order_id);
+      }
+    }
+    // Best price first, then arrival (order id) within a price
+    return Array.from(byId.values()).sort((a, b) => {
+      const diff = Number(a.price) - Number(b.price);
+      if (diff !== 0) return descending ? -diff : diff;
+      return (a.order_id || 0) - (b.order_id || 0);
+    });
+  };
+  return {
+    buys: merge(book.buys, data.buys || [], true),
+    sells: merge(book.sells, data.sells || [], false),
+  };
+};
+
 export default function MarketDetail() {
   const { id } = useParams<{ id: string }>();
   const user = store((state) => state.user);
@@ -63,6 +93,11 @@ export default function MarketDetail() {
   const [yesOrderbook, setYesOrderbook] = useState<OrderBook>({ buys: [], sells: [] });
   const [noOrderbook, setNoOrderbook] = useState<OrderBook>({ buys: [], sells: [] });
   const wsClientRef = useRef<WebSocketClient | null>(null);
+  // Last seq seen per "outcome_name:outcome" book, to spot missed deltas
+  const bookSeqRef = useRef<Record<string, number>>({});
+  // The socket handler outlives renders, so it reads the selection through a ref
+  const selectedOutcomeNameRef = useRef(selectedOutcomeName);
+  selectedOutcomeNameRef.current = selectedOutcomeName;
   const chatRef = useRef<HTMLDivElement>(null);
   const [chatExpanded, setChatExpanded] = useState(false);
 
@@ -124,6 +159,7 @@ export default function MarketDetail() {
         wsClientRef.current.disconnect();
       }
       
+      bookSeqRef.current = {}; // Sequence numbers are per connection's snapshots
       const client = new WebSocketClient(parseInt(id));
       client.connect(
         (data) => {
@@ -141,6 +177,9 @@ export default function MarketDetail() {
             // Handle orderbook updates for specific outcome_name and outcome
             const outcomeName = data.outcome_name || 'default';
             const outcome = data.outcome;
+            if (data.seq !== undefined) {
+              bookSeqRef.current[`${outcomeName}:${outcome}`] = data.seq;
+            }
             
             if (outcome === 'yes' || outcome === 'no') {
               const convertedData = {
@@ -149,8 +188,7 @@ export default function MarketDetail() {
               };
               
               // Update the separate YES/NO orderbooks if this is the selected outcome_name
-              // Always update regardless of which outcome_name (for simplicity)
-              if (outcomeName === selectedOutcomeName) {
+              if (outcomeName === selectedOutcomeNameRef.current) {
                 if (outcome === 'yes') {
                   setYesOrderbook(convertedData);
                 } else if (outcome === 'no') {
@@ -158,6 +196,28 @@ export default function MarketDetail() {
                 }
               }
             }
+          } else if (data.type === 'orderbook_delta') {
+            const outcomeName = data.outcome_name || 'default';
+            const outcome = data.outcome;
+            const bookKey = `${outcomeName}:${outcome}`;
+            const lastSeq = bookSeqRef.current[bookKey];
+            if (lastSeq !== undefined && data.seq <= lastSeq) {
+              return; // Already part of the snapshot we resynced from
+            }
+            if (lastSeq === undefined || data.seq !== lastSeq + 1) {
+              // Missed a delta (or never had a snapshot of this book): resync from a snapshot
+              client.send({ type: 'snapshot', outcome_name: outcomeName, outcome });
+              return;
+            }
+            bookSeqRef.current[bookKey] = data.seq;
+            
+            if (outcomeName === selectedOutcomeNameRef.current) {
+              if (outcome === 'yes') {
+                setYesOrderbook(book => applyOrderbookDelta(book, data));
+              } else if (outcome === 'no') {
+                setNoOrderbook(book => applyOrderbookDelta(book, data));
+              }
+            }
           }
         },
         (error) => {
@@ -166,6 +226,10 @@ export default function MarketDetail() {
           if (target && target.readyState !== WebSocket.CLOSED) {
             console.error('WebSocket error:', error);
           }
+        },
+        () => {
+          // A new connection numbers its books afresh; the client re-requests their snapshots
+          bookSeqRef.current = {};
         }
       );
       wsClientRef.current = client;
@@ -178,6 +242,21 @@ export default function MarketDetail() {
     }
   }, [id]);
 
+  useEffect(() => {
+    // Only the selected outcome's books are streamed: swap the subscription when it changes
+    const client = wsClientRef.current;
+    if (!client || !selectedOutcomeName) return;
+    client.setBooks([
+      { outcome_name: selectedOutcomeName, outcome: 'yes' },
+      { outcome_name: selectedOutcomeName, outcome: 'no' },
+    ]);
+    for (const bookKey of Object.keys(bookSeqRef.current)) {
+      if (!bookKey.startsWith(`${selectedOutcomeName}:`)) {
+        delete bookSeqRef.current[bookKey];
+      }
+    }
+  }, [id, selectedOutcomeName]);
+
   const fetchMarket = async () => {
     try {
       const response = await api.get(`/markets/${id}`);
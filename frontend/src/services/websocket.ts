@@ -1,18 +1,41 @@
+export interface BookRef {
+  outcome_name: string;
+  outcome: 'yes' | 'no';
+}
+
+// Books the server subscribes every new connection to
+const INITIAL_BOOKS: BookRef[] = [
+  { outcome_name: 'default', outcome: 'yes' },
+  { outcome_name: 'default', outcome: 'no' },
+];
+
+const bookId = (book: BookRef) => `${book.outcome_name}:${book.outcome}`;
+
+// Close codes that mean "don't come back": normal closure and unauthorized
+const FINAL_CLOSE_CODES = [1000, 1008];
+
 export class WebSocketClient {
   private ws: WebSocket | null = null;
   private marketId: number;
   private reconnectAttempts = 0;
-  private maxReconnectAttempts = 5;
+  private maxReconnectAttempts = 10;
   private reconnectDelay = 1000;
+  private maxReconnectDelay = 30000;
+  private reconnectTimer: ReturnType<typeof setTimeout> | null = null;
   private isConnecting = false;
   private onMessageCallback: ((data: any) => void) | null = null;
   private onErrorCallback: ((error: Event) => void) | null = null;
+  private onReconnectCallback: (() => void) | null = null;
+  // Messages sent before the socket opened (e.g. subscriptions), flushed on open
+  private pendingMessages: string[] = [];
+  // Books this client wants streamed; restored on every reconnect
+  private books: BookRef[] = INITIAL_BOOKS;
 
   constructor(marketId: number) {
     this.marketId = marketId;
   }
 
-  connect(onMessage: (data: any) => void, onError?: (error: Event) => void) {
+  connect(onMessage: (data: any) => void, onError?: (error: Event) => void, onReconnect?: () => void) {
     // Don't connect if already connected or connecting
     if (this.ws && (this.ws.readyState === WebSocket.OPEN || this.ws.readyState === WebSocket.CONNECTING)) {
       return;
@@ -25,7 +48,11 @@ export class WebSocketClient {
 
     this.onMessageCallback = onMessage;
     this.onErrorCallback = onError || null;
+    this.onReconnectCallback = onReconnect || null;
+    this.open(false);
+  }
 
+  private open(isReconnect: boolean) {
     const token = localStorage.getItem('access_token');
     if (!token) {
       console.error('No access token found');
@@ -43,6 +70,15 @@ export class WebSocketClient {
       console.log('WebSocket connected');
       this.reconnectAttempts = 0;
       this.isConnecting = false;
+      if (isReconnect) {
+        // A new connection starts on the server's initial books: restore ours and resync them
+        this.onReconnectCallback?.();
+        this.restoreSubscriptions();
+      }
+      for (const message of this.pendingMessages) {
+        this.ws?.send(message);
+      }
+      this.pendingMessages = [];
     };
 
     this.ws.onmessage = (event) => {
@@ -67,28 +103,61 @@ export class WebSocketClient {
       }
     };
 
-    this.ws.onclose = () => {
+    this.ws.onclose = (event) => {
       this.isConnecting = false;
       console.log('WebSocket disconnected');
-      // Only reconnect if we're not explicitly disconnected
-      if (this.ws !== null) {
+      // The server drops clients that fall too far behind (1013) or go away; come back unless
+      // we closed it ourselves or were refused
+      if (this.ws !== null && !FINAL_CLOSE_CODES.includes(event.code)) {
         this.reconnect();
       }
     };
   }
 
   private reconnect() {
-    if (this.reconnectAttempts < this.maxReconnectAttempts) {
-      this.reconnectAttempts++;
-      setTimeout(() => {
-        console.log(`Reconnecting... Attempt ${this.reconnectAttempts}`);
-        // This would need to be called with the original callbacks
-        // For now, we'll just log
-      }, this.reconnectDelay * this.reconnectAttempts);
+    if (this.reconnectTimer !== null || this.reconnectAttempts >= this.maxReconnectAttempts) {
+      return;
+    }
+    this.reconnectAttempts++;
+    // Exponential backoff with jitter, so evicted clients don't all come back at once
+    const delay = Math.min(this.reconnectDelay * 2 ** (this.reconnectAttempts - 1), this.maxReconnectDelay);
+    this.reconnectTimer = setTimeout(() => {
+      this.reconnectTimer = null;
+      console.log(`Reconnecting... Attempt ${this.reconnectAttempts}`);
+      this.open(true);
+    }, delay * (0.5 + Math.random() / 2));
+  }
+
+  private restoreSubscriptions() {
+    const wanted = new Set(this.books.map(bookId));
+    const dropped = INITIAL_BOOKS.filter((book) => !wanted.has(bookId(book)));
+    if (dropped.length) {
+      this.send({ type: 'unsubscribe', books: dropped });
+    }
+    this.send({ type: 'subscribe', books: this.books });
+    this.send({ type: 'snapshot', books: this.books });
+  }
+
+  /** Stream exactly these books from now on (and after any reconnect) */
+  setBooks(books: BookRef[]) {
+    const wanted = new Set(books.map(bookId));
+    const current = new Set(this.books.map(bookId));
+    const removed = this.books.filter((book) => !wanted.has(bookId(book)));
+    const added = books.filter((book) => !current.has(bookId(book)));
+    this.books = books;
+    if (removed.length) {
+      this.send({ type: 'unsubscribe', books: removed });
+    }
+    if (added.length) {
+      this.send({ type: 'subscribe', books: added });
     }
   }
 
   disconnect() {
+    if (this.reconnectTimer !== null) {
+      clearTimeout(this.reconnectTimer);
+      this.reconnectTimer = null;
+    }
     if (this.ws) {
       // Prevent reconnection
       this.isConnecting = false;
@@ -102,12 +171,15 @@ export class WebSocketClient {
     }
     this.onMessageCallback = null;
     this.onErrorCallback = null;
+    this.onReconnectCallback = null;
+    this.pendingMessages = [];
   }
 
   send(data: any) {
     if (this.ws && this.ws.readyState === WebSocket.OPEN) {
       this.ws.send(JSON.stringify(data));
+    } else if (this.ws && this.ws.readyState === WebSocket.CONNECTING) {
+      this.pendingMessages.push(JSON.stringify(data));
     }
   }
 }
-